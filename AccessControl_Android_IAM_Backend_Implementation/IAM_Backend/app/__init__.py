@@ -3,7 +3,7 @@ from flask_cors import CORS
 from .config import cfg
 from .db import Base, engine
 from . import models  # noqa: F401
-from .net_acl import ip_allowed
+from . import net_acl, rate_limit
 from .startup import ensure_default_admin  # bootstrap admin
 
 def create_app():
@@ -24,22 +24,63 @@ def create_app():
     Base.metadata.create_all(bind=engine)
     ensure_default_admin()
 
-    # ACL simple por IP (static libre; API protegida)
+    # Bloqueo por intentos fallidos (purga periódica del backend configurado)
+    from .attempts import start as start_attempts
+    start_attempts()
+    # Limitación de tasa (purga periódica de cubos llenos)
+    from .rate_limit import start as start_rate_limit
+    start_rate_limit()
+    # Sesiones pendientes de login: temporizador de expiración
+    from .pending_sessions import start as start_pending_sessions
+    start_pending_sessions()
+    # Consumidor de eventos de acceso (ocupación por área / anti-passback)
+    from .occupancy import start as start_occupancy
+    start_occupancy()
+    # Plegado incremental de asistencia (entrada/salida por usuario y día)
+    from .attendance import start as start_attendance
+    start_attendance()
+    # Sondeo de salud de cámaras / escáneres QR
+    from .device_health import start as start_device_health
+    start_device_health()
+    # Escaneo continuo de QR desde las cámaras de los escáneres registrados
+    from .qr_scanner import start as start_qr_scanner
+    start_qr_scanner()
+    # Mantenimiento programado: archivado de eventos, retención de tablas y VACUUM incremental
+    from .maintenance import start as start_maintenance
+    start_maintenance()
+
+    # ACL por IP compilada (static libre; API protegida; políticas por ruta, ver app/net_acl.py)
+    acl = net_acl.get_acl()
+
     @app.before_request
     def _enforce_acl():
-        remote = request.headers.get("X-Forwarded-For", request.remote_addr)
         path = request.path or "/"
-        safe_paths = {"/health", "/favicon.ico", "/", "/login.html", "/app.html", "/qr.html"}
-        is_static = path.startswith("/static/") or any(path.endswith(ext) for ext in (
-            ".html", ".css", ".js", ".png", ".ico", ".svg", ".jpg", ".jpeg", ".webp"
-        ))
-        if path in safe_paths or is_static:
+        if acl.is_public(path):
             return
-        if not ip_allowed(remote, cfg.ALLOWED_IP_RANGES):
+        remote = acl.client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"))
+        if not acl.allowed(remote, path):
             if path.startswith("/api/"):
                 abort(403, description="IP not allowed")
             return redirect("/login.html", code=302)
 
+    # Limitación de tasa por regla de endpoint/blueprint (ver app/rate_limit.py); tras la ACL
+    limiter = rate_limit.get_limiter()
+
+    @app.before_request
+    def _enforce_rate_limit():
+        if not cfg.RATE_LIMIT_ENABLED:
+            return
+        rule = limiter.rule_for(request.endpoint, request.blueprint)
+        if rule is None:
+            return
+        remote = acl.client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"))
+        ok, retry_after, dim = limiter.check(rule, rate_limit.request_keys(request, remote, limiter.rules[rule]))
+        if not ok:
+            resp = jsonify(detail="rate limit exceeded", limit=dim, retry_after=retry_after)
+            resp.status_code = 429
+            resp.headers["Retry-After"] = str(retry_after)
+            return resp
+
     # Blueprints API
     from .api.auth_routes import bp as auth_bp
     from .api.qr_routes import bp as qr_bp
@@ -63,8 +104,14 @@ def create_app():
     # Extra blueprints: messages + access log
     from .api.messages_routes import bp as messages_bp
     from .api.access_routes import bp as access_bp
+    from .api.policy_routes import bp as policy_bp
+    from .api.occupancy_routes import bp as occupancy_bp
+    from .api.attendance_routes import bp as attendance_bp
     app.register_blueprint(messages_bp)
     app.register_blueprint(access_bp)
+    app.register_blueprint(policy_bp)
+    app.register_blueprint(occupancy_bp)
+    app.register_blueprint(attendance_bp)
 
     @app.get("/health")
     def health():
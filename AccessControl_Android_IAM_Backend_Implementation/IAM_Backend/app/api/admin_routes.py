@@ -4,7 +4,8 @@ from ..db import db_session
 from ..models import Usuario, Evento
 from ..logging_utils import sign_event_and_persist
 from ..req_auth import require_roles
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
+from .. import card_export, attempts, rate_limit, identity_cache, pending_sessions, maintenance
 
 bp = Blueprint("admin", __name__, url_prefix="/api/admin")
 
@@ -32,6 +33,46 @@ def list_logs():
             for e in events
         ])
 
+@bp.get("/lockouts")
+def lockout_stats():
+    """Estado del bloqueo por intentos fallidos: backend, claves activas, bloqueos vigentes y contadores."""
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])  # sólo admin
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(attempts.stats())
+
+@bp.get("/rate-limits")
+def rate_limit_stats():
+    """Limitación de tasa: reglas, backend, cubos activos y peticiones admitidas/limitadas por regla."""
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])  # sólo admin
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(rate_limit.stats())
+
+@bp.get("/identity-cache")
+def identity_cache_stats():
+    """Caché de identidad de JWT: entradas, TTL y aciertos/fallos/invalidaciones."""
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])  # sólo admin
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(identity_cache.stats())
+
+@bp.get("/pending-sessions")
+def pending_session_stats():
+    """Sesiones pendientes de login: backend, abiertas, expiradas por temporizador y purgadas."""
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])  # sólo admin
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(pending_sessions.stats())
+
+@bp.get("/maintenance")
+def maintenance_status():
+    """Mantenimiento: retenciones, segmentos archivados, eventos vivos y resultado de la última pasada."""
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])  # sólo admin
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(maintenance.status())
+
 @bp.post("/users/revoke/<uid>")
 def revoke_user(uid: str):
     with db_session() as db:  # type: Session
@@ -41,5 +82,39 @@ def revoke_user(uid: str):
         if not user:
             return jsonify(detail="User not found"), 404
         user.estado = "revoked"; db.commit()
+        identity_cache.bump_epoch(db, uid)   # sus JWT vigentes dejan de valer en el acto
         sign_event_and_persist(db, "user_revoked", actor_uid=uid, source="admin_api", context={})
         return jsonify(ok=True, message=f"User {uid} revoked.")
+
+@bp.route("/cards/export", methods=["GET", "POST"])
+def export_cards():
+    """Tarjetas QR para imprimir en streaming: ZIP de PNG o hojas N-up (PDF / ZIP de PNG).
+
+    Parámetros (query o JSON): format=zip|pdf|png, uids (lista o CSV), role, estado,
+    page=a4|letter|a3, cols, rows, dpi.
+    """
+    args = dict(request.args)
+    if request.is_json:
+        args.update(request.get_json(silent=True) or {})
+    uids = args.get("uids")
+    if isinstance(uids, str):
+        uids = [u.strip() for u in uids.split(",") if u.strip()]
+    try:
+        layout = card_export.Layout(args.get("page"), args.get("cols"), args.get("rows"), args.get("dpi"))
+        fmt = (args.get("format") or "zip").lower()
+        if fmt not in card_export.FORMATS:
+            raise ValueError(f"format must be one of {', '.join(card_export.FORMATS)}")
+    except ValueError as e:
+        return jsonify(detail=str(e)), 400
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])  # sólo admin
+        if err: return jsonify(detail=err[0]), err[1]
+        entries, missing = card_export.select_cards(db, uids or None, args.get("role"), args.get("estado"))
+    if not entries:
+        return jsonify(detail="No cards to export", missing=missing), 404
+    stream, mimetype, name = card_export.export(entries, fmt, layout)
+    return Response(stream_with_context(stream), mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{name}"',
+        "X-Cards-Count": str(len(entries)),
+        "X-Cards-Missing": ",".join(missing[:200]),
+    })
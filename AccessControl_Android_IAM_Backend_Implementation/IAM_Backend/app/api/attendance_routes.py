@@ -0,0 +1,69 @@
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from sqlalchemy.orm import Session
+from ..db import db_session, standalone_session
+from ..req_auth import require_roles
+from .. import attendance
+from ..config import cfg
+
+bp = Blueprint("attendance", __name__, url_prefix="/api/attendance")
+
+#
+# Reportes de asistencia (tabla attendance_days, ver app/attendance.py)
+# - /report?from=YYYY-MM-DD&to=YYYY-MM-DD[&uid=][&format=csv|json]   → una fila por usuario y día
+# - /summary?from=...&to=...[&uid=][&format=csv|json]                → totales por usuario en el rango
+# - /fold (POST)                                                      → fuerza el plegado de eventos nuevos
+#
+
+ROLES = ["R-ADM", "R-MON", "R-AUD"]
+
+
+def _report(kind: str):
+    try:
+        date_from, date_to = attendance.parse_range(request.args.get("from"), request.args.get("to"))
+    except ValueError as e:
+        return jsonify(detail=f"invalid date range: {e}"), 400
+    uid = request.args.get("uid") or None
+    fmt = (request.args.get("format") or "json").lower()
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=ROLES)
+        if err: return jsonify(detail=err[0]), err[1]
+    # Pone al día la tabla antes de leerla: un lote como máximo; el resto lo pliega el job de fondo
+    attendance.fold(max_batches=cfg.ATTENDANCE_REPORT_FOLD_BATCHES)
+    rows_fn = attendance.day_rows if kind == "report" else attendance.summary_rows
+    columns = attendance.DAY_COLUMNS if kind == "report" else attendance.SUMMARY_COLUMNS
+
+    if fmt == "csv":
+        def gen():
+            db = standalone_session()
+            try:
+                yield from attendance.to_csv(rows_fn(db, date_from, date_to, uid), columns)
+            finally:
+                db.close()
+        name = f"attendance_{kind}_{date_from}_{date_to}.csv"
+        return Response(stream_with_context(gen()), mimetype="text/csv",
+                        headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+    db = standalone_session()
+    try:
+        rows = list(rows_fn(db, date_from, date_to, uid))
+    finally:
+        db.close()
+    return jsonify({"from": date_from, "to": date_to, "count": len(rows), "rows": rows})
+
+
+@bp.get("/report")
+def report():
+    return _report("report")
+
+
+@bp.get("/summary")
+def summary():
+    return _report("summary")
+
+
+@bp.post("/fold")
+def fold_now():
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(processed=attendance.fold())
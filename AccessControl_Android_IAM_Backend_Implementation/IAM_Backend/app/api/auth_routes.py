@@ -1,13 +1,11 @@
 from flask import Blueprint, request, jsonify
 from sqlalchemy.orm import Session
 from ..db import db_session
-from ..models import Usuario, AuthSession
+from ..models import Usuario
 from ..auth import verify_password
-import uuid, datetime
-from ..config import cfg
 from ..logging_utils import sign_event_and_persist
-from ..attempts import check_lock, register_failure, reset, MAX_ATTEMPTS
-from ..time_utils import now_cst
+from ..attempts import check_lock, register_failure, reset, MAX_ATTEMPTS, LOCK_WINDOW_SEC
+from .. import pending_sessions
 
 bp = Blueprint("auth", __name__, url_prefix="/api/auth")
 
@@ -47,17 +45,13 @@ def login():
                 context={"email": email, "attempt": count, "max": MAX_ATTEMPTS},
             )
             if count >= MAX_ATTEMPTS:
-                return jsonify(detail="Cuenta bloqueada por 10 minutos debido a múltiples intentos fallidos."), 429
+                return jsonify(detail=f"Cuenta bloqueada por {max(1, LOCK_WINDOW_SEC // 60)} minutos debido a múltiples intentos fallidos."), 429
             restantes = MAX_ATTEMPTS - count
             return jsonify(detail=f"Credenciales inválidas. Intentos restantes: {restantes}"), 401
 
         # Crear sesión pendiente para QR (credenciales correctas)
-        session_id = str(uuid.uuid4())
-        now = now_cst()
-        expires_at = now + datetime.timedelta(seconds=cfg.QR_TTL_SECONDS)
-        sess = AuthSession(session_id=session_id, uid=user.uid, state="pending", expires_at=expires_at)
-        db.add(sess)
-        db.commit()
+        sess = pending_sessions.create(user.uid)
+        session_id, expires_at = sess.session_id, sess.expires_at
 
         # Resetear intentos al éxito
         reset(key)
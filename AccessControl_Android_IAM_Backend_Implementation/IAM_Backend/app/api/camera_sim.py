@@ -2,8 +2,7 @@ from flask import Blueprint, Response, jsonify, request
 from ..config import cfg
 from ..db import SessionLocal
 from ..models import CameraDevice
-import cv2
-import time
+from .. import camera_hub, synthetic_camera
 
 bp = Blueprint("cam_sim", __name__)
 
@@ -13,6 +12,11 @@ bp = Blueprint("cam_sim", __name__)
 # - /cameras          → Lista de cámaras: mezcla de env CAM_URLS + base de datos
 # - /camera_mjpeg/<i> → Proxy MJPEG desde RTSP/HTTP para consumo por navegador
 #   Nota: navegadores no reproducen RTSP de forma nativa; este proxy lo convierte a MJPEG.
+#   Todos los clientes de una misma fuente comparten un lector y un JPEG por frame (app/camera_hub.py).
+# - /camera_snapshot/<i> → Último frame como JPEG (ETag + max-age)
+# - /camera_mosaic    → Varias cámaras compuestas en un solo stream MJPEG
+# - /camera_synth/<n> → Cámara sintética como MJPEG (pruebas de carga sin hardware)
+# - /camera_hub       → Estado de los lectores compartidos
 #
 
 COLORS = ["#aaf","#faa","#afa","#ffa","#ddd","#cdf"]
@@ -43,8 +47,8 @@ def list_cameras():
         else:
             name, url = f"Cam {idx}", item
         url = url.strip()
-        # Si es RTSP/RTMP, los navegadores no lo soportan: ofrecer proxy MJPEG
-        if url.lower().startswith(("rtsp://", "rtmp://")):
+        # Si es RTSP/RTMP (o sintética), los navegadores no lo soportan: ofrecer proxy MJPEG
+        if url.lower().startswith(("rtsp://", "rtmp://", synthetic_camera.SCHEME)):
             proxy_url = f"/camera_mjpeg/{idx}"
             cams.append({"id": idx, "name": name.strip(), "url": proxy_url})
         else:
@@ -55,7 +59,7 @@ def list_cameras():
         rows = db.query(CameraDevice).all()
         for r in rows:
             url = r.url.strip()
-            if url.lower().startswith(("rtsp://", "rtmp://")):
+            if url.lower().startswith(("rtsp://", "rtmp://", synthetic_camera.SCHEME)):
                 # Intentar asignar índice alto evitando colisiones visuales
                 cams.append({"id": (len(cams)+1), "name": r.name, "url": f"/camera_mjpeg/{r.id}?db=1"})
             else:
@@ -68,47 +72,120 @@ def list_cameras():
     return jsonify(cams)
 
 
-def _mjpeg_generator(src_url):
-    """Lee frames con OpenCV y los sirve como stream multipart/x-mixed-replace."""
-    cap = cv2.VideoCapture(src_url)
-    try:
-        if not cap.isOpened():
-            # intento reintento corto
-            time.sleep(0.5)
-            cap.open(src_url)
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                time.sleep(0.1)
-                continue
-            ok, buf = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-            if not ok:
-                continue
-            jpg = buf.tobytes()
-            yield (b"--frame\r\n"
-                   b"Content-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n")
-    finally:
-        cap.release()
+@bp.get("/camera_synth")
+@bp.get("/camera_synth/<name>")
+def camera_synth(name: str = "synthetic"):
+    """Cámara sintética servida como MJPEG (abrible con cv2.VideoCapture por HTTP).
 
+    Escena: w, h, fps, rects, qr (valor o "random"), qr_every, qr_style, seq (ver app/synthetic_camera.py).
+    Entrega por cliente: out_fps, out_w, q (como fps/w/q de /camera_mjpeg).
+    Mismo nombre y parámetros → mismo generador compartido entre clientes.
+    """
+    url = synthetic_camera.canonical_url(name, request.args.to_dict())
+    hub = camera_hub.get_hub(url, dynamic=True)
+    if hub is None:
+        return Response("too many active streams", status=503, headers={'Retry-After': '30'})
+    stream = camera_hub.mjpeg_stream(hub, fps=request.args.get('out_fps') or request.args.get('fps'),
+                                     width=request.args.get('out_w'), quality=request.args.get('q'))
+    return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-store'})
 
-@bp.get("/camera_mjpeg/<int:idx>")
-def camera_mjpeg(idx: int):
-    """Selecciona URL desde CAM_URLS (por índice) o desde BD (?db=1) y proxea como MJPEG."""
-    # Si ?db=1, obtiene desde BD por ID; de lo contrario, índice en CAM_URLS
-    use_db = request.args.get('db') in ('1','true','yes')
+
+@bp.get("/camera_hub")
+def camera_hub_stats():
+    """Estado de los lectores compartidos (suscriptores, frames leídos/codificados, reconexiones)."""
+    return jsonify(camera_hub.stats())
+
+
+def _resolve_source(idx: int, use_db: bool):
+    """(nombre, url) de la cámara: índice en CAM_URLS (1..N) o ID en BD si use_db. None si no existe."""
     if use_db:
         db = SessionLocal()
         try:
             row = db.query(CameraDevice).filter(CameraDevice.id==idx).first()
             if not row:
-                return Response("not found", status=404)
-            url = (row.url or '').strip()
+                return None
+            return row.name or f"Cam {idx}", (row.url or '').strip()
         finally:
             db.close()
-    else:
-        if idx <= 0 or idx > len(cfg.CAM_URLS):
-            return Response("index out of range", status=404)
-        item = cfg.CAM_URLS[idx-1]
-        url = item.split('|',1)[1] if '|' in item else item
-        url = url.strip()
-    return Response(_mjpeg_generator(url), mimetype='multipart/x-mixed-replace; boundary=frame')
+    if idx <= 0 or idx > len(cfg.CAM_URLS):
+        return None
+    item = cfg.CAM_URLS[idx-1]
+    name, url = item.split('|',1) if '|' in item else (f"Cam {idx}", item)
+    return name.strip(), url.strip()
+
+
+@bp.get("/camera_mjpeg/<int:idx>")
+def camera_mjpeg(idx: int):
+    """Selecciona URL desde CAM_URLS (por índice) o desde BD (?db=1) y proxea como MJPEG.
+
+    Parámetros opcionales por cliente: fps (máx. frames/s), w (ancho px) y q (calidad JPEG).
+    """
+    # Si ?db=1, obtiene desde BD por ID; de lo contrario, índice en CAM_URLS
+    use_db = request.args.get('db') in ('1','true','yes')
+    src = _resolve_source(idx, use_db)
+    if src is None:
+        return Response("not found" if use_db else "index out of range", status=404)
+    stream = camera_hub.mjpeg_stream(src[1], fps=request.args.get('fps'), width=request.args.get('w'),
+                                     quality=request.args.get('q'))
+    return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-store'})
+
+
+@bp.get("/camera_snapshot/<int:idx>")
+def camera_snapshot(idx: int):
+    """Último frame de la cámara como JPEG (mismo lector compartido que /camera_mjpeg).
+
+    Parámetros: db=1, w, q. Responde con ETag y Cache-Control max-age=CAMERA_SNAPSHOT_MAX_AGE;
+    If-None-Match con la misma ETag → 304 (el frame no ha cambiado).
+    """
+    use_db = request.args.get('db') in ('1','true','yes')
+    src = _resolve_source(idx, use_db)
+    if src is None:
+        return Response("not found" if use_db else "index out of range", status=404)
+    snap = camera_hub.snapshot(camera_hub.get_hub(src[1]), width=request.args.get('w'),
+                               quality=request.args.get('q'))
+    if snap is None:
+        return Response("no signal", status=503, headers={'Retry-After': '2'})
+    etag, data = snap
+    headers = {'ETag': etag, 'Cache-Control': f'max-age={cfg.CAMERA_SNAPSHOT_MAX_AGE}'}
+    if etag in [t.strip() for t in (request.headers.get('If-None-Match') or '').split(',')]:
+        return Response(status=304, headers=headers)
+    return Response(data, mimetype='image/jpeg', headers=headers)
+
+
+@bp.get("/camera_mosaic")
+def camera_mosaic():
+    """Mosaico de varias cámaras en un solo stream MJPEG.
+
+    Parámetros: ids (CSV; índices de CAM_URLS o "db:<id>" para cámaras de BD; por defecto
+    todas las de CAM_URLS), cols, width (ancho del lienzo) y fps/w/q como /camera_mjpeg.
+    """
+    raw = [x.strip() for x in (request.args.get('ids') or '').split(',') if x.strip()]
+    if not raw:
+        raw = [str(i) for i in range(1, len(cfg.CAM_URLS) + 1)]
+    sources = []
+    for item in raw[:cfg.CAMERA_MOSAIC_MAX_TILES]:
+        use_db = item.lower().startswith('db:')
+        try:
+            idx = int(item[3:] if use_db else item)
+        except ValueError:
+            return Response(f"invalid id: {item}", status=400)
+        src = _resolve_source(idx, use_db)
+        if src is None:
+            return Response(f"camera not found: {item}", status=404)
+        sources.append(src)
+    if not sources:
+        return Response("no cameras", status=404)
+    try:
+        cols = int(request.args.get('cols')) if request.args.get('cols') else None
+        width = int(request.args.get('width')) if request.args.get('width') else None
+    except ValueError:
+        return Response("cols/width must be integers", status=400)
+    hub = camera_hub.get_mosaic(sources, cols=cols, width=width)
+    if hub is None:
+        return Response("too many active streams", status=503, headers={'Retry-After': '30'})
+    stream = camera_hub.mjpeg_stream(hub, fps=request.args.get('fps'), width=request.args.get('w'),
+                                     quality=request.args.get('q'))
+    return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-store'})
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from ..db import SessionLocal
 from ..models import CameraDevice, QRScannerDevice, NFCDevice
 import ipaddress, datetime
+from .. import camera_discovery, device_health, qr_scanner
 
 bp = Blueprint("devices", __name__, url_prefix="/api/dev")
 
@@ -19,7 +20,15 @@ class DB:
 def _as_dict_cam(c: CameraDevice):
     return {"id": c.id, "name": c.name, "ip": c.ip, "url": c.url,
             "status": c.status, "location": c.location,
-            "last_seen": c.last_seen.isoformat() if c.last_seen else None}
+            "last_seen": c.last_seen.isoformat() if c.last_seen else None,
+            "health": device_health.current(f"cam:{c.id}")}
+
+
+def _as_dict_qr(q: QRScannerDevice):
+    return {"id": q.id, "name": q.name, "ip": q.ip, "url": q.url,
+            "status": q.status, "location": q.location,
+            "last_seen": q.last_seen.isoformat() if q.last_seen else None,
+            "health": device_health.current(f"qr:{q.id}")}
 
 
 @bp.get("/cameras")
@@ -29,6 +38,64 @@ def list_cams():
         return jsonify([_as_dict_cam(x) for x in rows])
 
 
+@bp.get("/qr-scanners")
+def list_qr_scanners():
+    with DB() as db:
+        rows = db.query(QRScannerDevice).all()
+        return jsonify([_as_dict_qr(x) for x in rows])
+
+
+@bp.post("/qr-scanners")
+def add_qr_scanner():
+    data = request.get_json(force=True, silent=True) or {}
+    with DB() as db:
+        q = QRScannerDevice(name=data.get("name","QR"), ip=data.get("ip"), url=data.get("url"),
+                            status=data.get("status","active"), location=data.get("location"))
+        db.add(q); db.flush()
+        qid = q.id
+    qr_scanner.refresh()
+    return jsonify(id=qid)
+
+
+@bp.put("/qr-scanners/<int:qid>")
+def upd_qr_scanner(qid:int):
+    data = request.get_json(force=True, silent=True) or {}
+    with DB() as db:
+        q = db.query(QRScannerDevice).filter(QRScannerDevice.id==qid).first()
+        if not q: return jsonify(detail="not found"), 404
+        for k in ("name","ip","url","status","location"):
+            if k in data: setattr(q,k,data[k])
+    qr_scanner.refresh()
+    return jsonify(ok=True)
+
+
+@bp.get("/qr-scanners/pipeline")
+def qr_scanner_pipeline():
+    """Escaneo continuo por dispositivo: frames vistos/muestreados, lecturas, debounce y resultados."""
+    return jsonify(qr_scanner.stats())
+
+
+@bp.get("/health")
+def health_all():
+    """Estado actual de todos los dispositivos sondeados (cam:<id>, qr:<id>, env:<n>)."""
+    return jsonify(device_health.current())
+
+
+@bp.get("/health/<key>/history")
+def health_history(key: str):
+    try:
+        limit = int(request.args.get("limit", "100"))
+    except ValueError:
+        return jsonify(detail="limit must be an integer"), 400
+    return jsonify(key=key, current=device_health.current(key), samples=device_health.history(key, limit))
+
+
+@bp.post("/health/probe")
+def health_probe():
+    device_health.probe_now()
+    return jsonify(ok=True), 202
+
+
 @bp.post("/cameras")
 def add_cam():
     data = request.get_json(force=True, silent=True) or {}
@@ -51,41 +118,52 @@ def upd_cam(cid:int):
         return jsonify(ok=True)
 
 
-@bp.get("/scan")
+def _int_list(raw: str):
+    return [int(x) for x in (raw or "").split(",") if x.strip()]
+
+
+@bp.route("/scan", methods=["GET", "POST"])
 def scan_network():
-    """Escaneo simple HTTP para cámaras.
-    Params: cidr=192.168.1.0/24, port=8080, path=/video, save=0
-    Devuelve lista de {ip, url} detectados.
+    """Lanza un escaneo de cámaras en segundo plano (ver app/camera_discovery.py).
+    Params (query o JSON): cidr=192.168.1.0/24, ports=8080,80,554 (o port=), paths=/video,/mjpg/video.mjpg
+    (o path=), save=0, full=0 (ignora hosts sondeados recientemente).
+    Devuelve 202 {job_id, ...}; el progreso y los hallazgos en GET /api/dev/scan/<job_id>.
     """
-    cidr = request.args.get("cidr")
-    port = int(request.args.get("port", "8080"))
-    path = request.args.get("path", "/video")
-    save = request.args.get("save") in ("1","true","yes")
+    data = request.get_json(silent=True) or {}
+    arg = lambda k, d=None: data.get(k, request.args.get(k, d))
+    cidr = arg("cidr")
     if not cidr:
         return jsonify(detail="cidr required"), 400
-
-    # Lazy import to avoid hard dependency at startup
     try:
-        import requests  # type: ignore
-    except Exception:
+        ports = arg("ports") or arg("port") or "8080"
+        ports = ports if isinstance(ports, list) else _int_list(str(ports))
+        paths = arg("paths") or arg("path") or "/video"
+        paths = paths if isinstance(paths, list) else [p.strip() for p in str(paths).split(",") if p.strip()]
+        save = str(arg("save", "0")).lower() in ("1", "true", "yes")
+        full = str(arg("full", "0")).lower() in ("1", "true", "yes")
+        job = camera_discovery.start_scan(cidr, [int(p) for p in ports], paths, save=save, full=full)
+    except ImportError:
         return jsonify(detail="requests not installed; install to use /api/dev/scan"), 501
+    except ValueError as e:
+        return jsonify(detail=f"invalid scan parameters: {e}"), 400
+    return jsonify(job), 202
+
+
+@bp.get("/scan/jobs")
+def scan_jobs():
+    return jsonify(camera_discovery.list_jobs())
+
+
+@bp.get("/scan/<job_id>")
+def scan_status(job_id: str):
+    job = camera_discovery.get_job(job_id)
+    if job is None:
+        return jsonify(detail="not found"), 404
+    return jsonify(job)
+
 
-    net = ipaddress.ip_network(cidr, strict=False)
-    found = []
-    for ip in net.hosts():
-        url = f"http://{ip}:{port}{path}"
-        try:
-            r = requests.get(url, timeout=0.7, stream=True)
-            ct = r.headers.get("Content-Type","")
-            if r.status_code==200 and ("multipart" in ct or "jpeg" in ct or r.raw):
-                found.append({"ip": str(ip), "url": url})
-        except Exception:
-            pass
-
-    if save and found:
-        with DB() as db:
-            for f in found:
-                name = f"Cam {f['ip']}"
-                if not db.query(CameraDevice).filter(CameraDevice.url==f['url']).first():
-                    db.add(CameraDevice(name=name, ip=f['ip'], url=f['url']))
-    return jsonify(found)
+@bp.delete("/scan/<job_id>")
+def scan_cancel(job_id: str):
+    if not camera_discovery.cancel_job(job_id):
+        return jsonify(detail="not found"), 404
+    return jsonify(ok=True)
@@ -3,24 +3,18 @@ from sqlalchemy.orm import Session
 from ..db import db_session
 from ..models import Mensaje, Usuario, MessageRead, ChannelKey
 from ..logging_utils import sign_event_and_persist
+from .. import policy
 
 bp = Blueprint("messages", __name__, url_prefix="/api/messages")
 
 ALLOWED_GROUPS = {"IAM", "IM", "AC", "Mon", "Avisos"}
 
 def _group_allowed_for_role(group: str, role: str, read: bool) -> bool:
-    # Avisos: lectura para todos; escritura solo admin
-    if group == "Avisos":
-        return True if read else (role == 'R-ADM')
-    if group == "IAM":
-        return role == 'R-ADM'
-    if group == "IM":
-        return role in ('R-IM', 'R-ADM')
-    if group == "AC":
-        return role in ('R-AC', 'R-ADM')
-    if group == "Mon":
-        return role in ('R-MON', 'R-ADM')
-    return False
+    # Reglas msg_read/msg_write del motor de políticas (por defecto: Avisos lectura
+    # para todos y escritura solo admin; IAM solo admin; IM/AC/Mon su rol + admin)
+    if group not in ALLOWED_GROUPS:
+        return False
+    return policy.is_allowed(role, group, "msg_read" if read else "msg_write")
 
 def _is_dm(grupo: str) -> bool:
     return isinstance(grupo, str) and grupo.upper().startswith('DM:')
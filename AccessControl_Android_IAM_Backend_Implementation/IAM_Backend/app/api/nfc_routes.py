@@ -5,7 +5,8 @@ Handles Android NFC app integration for IAM_Backend
 This file provides endpoints for:
 - NFC card scanning (access control)
 - Device heartbeat (monitoring)
-- NFC card assignment (admin)
+- NFC card assignment / revocation (admin)
+- Offline batch sync and fast-reject filter download (readers)
 
 Created: October 26, 2025
 For: UPY Sentinel NFC Android App Integration
@@ -16,6 +17,9 @@ from sqlalchemy.orm import Session
 from ..db import SessionLocal
 from ..models import Usuario, NFCDevice, Evento
 from ..time_utils import now_cst
+from ..req_auth import require_roles
+from .. import nfc_filter, nfc_debounce, policy, occupancy
+from ..config import cfg
 import hashlib
 
 bp = Blueprint("nfc", __name__, url_prefix="/api/nfc")
@@ -48,7 +52,10 @@ def nfc_scan():
         "uid": "04A3B2C1D4E5F6",
         "password_valid": true,
         "device_id": "ba899bab96c788b7",
-        "session_id": "abc123..."
+        "session_id": "abc123...",
+        "area": "Main Entrance",    // optional, only used when the device has no registered location
+        "direction": "in",          // optional "in"/"out" (anti-passback when enabled)
+        "explain": false            // optional, include the policy rule that decided
     }
     
     Response (Granted):
@@ -72,6 +79,8 @@ def nfc_scan():
     password_valid = data.get("password_valid", False)
     device_id = data.get("device_id", "")
     session_id = data.get("session_id", "")
+    area = data.get("area") or None
+    direction = occupancy.direction_of(data)
     
     if not nfc_uid:
         return jsonify({
@@ -81,8 +90,43 @@ def nfc_scan():
             "timestamp": now_cst().isoformat()
         }), 400
     
+    # Debounce: a card held against the reader is submitted several times per
+    # second. Repeats inside the window get the cached decision, no new event.
+    cached = nfc_debounce.lookup(device_id, nfc_uid, bool(password_valid))
+    if cached is not None:
+        return jsonify(cached)
+    
+    payload, event_id, decision = _process_scan(nfc_uid, password_valid, device_id, area, direction)
+    nfc_debounce.remember(device_id, nfc_uid, bool(password_valid), payload, event_id)
+    if data.get("explain") and decision is not None:
+        payload = dict(payload, policy=decision.explain())
+    return jsonify(payload)
+
+
+def _scan_area(requested, nfc_device):
+    """Area of a tap: the reader's registered location always wins; the client-sent area is only
+    accepted for readers without one (otherwise any caller could pick an unrestricted area)."""
+    if nfc_device is not None and nfc_device.location:
+        return nfc_device.location
+    return requested or None
+
+
+def _process_scan(nfc_uid: str, password_valid: bool, device_id: str, area=None, direction=None):
+    """Access decision for one tap. Returns (response payload, Evento id or None, policy Decision or None)."""
+    # Fast reject: the Bloom filter has no false negatives, so a miss means the card
+    # is not registered. Skip the DB entirely and log it aggregated per device/minute.
+    if password_valid and not nfc_filter.might_be_registered(nfc_uid):
+        nfc_filter.record_unknown_reject(device_id, nfc_uid)
+        return {
+            "result": "denied",
+            "reason": "card_not_registered",
+            "message": "NFC card not associated with any user",
+            "timestamp": now_cst().isoformat()
+        }, None, None
+    
     with DB() as db:
         # Update device last_seen (track activity even for failed attempts)
+        nfc_device = None
         if device_id:
             nfc_device = db.query(NFCDevice).filter(NFCDevice.device_id == device_id).first()
             if nfc_device:
@@ -104,36 +148,26 @@ def nfc_scan():
             db.add(event)
             db.commit()
             
-            return jsonify({
+            return {
                 "result": "denied",
                 "reason": "invalid_password",
                 "message": "NFC card password validation failed",
                 "timestamp": now_cst().isoformat()
-            })
+            }, event.id, None
         
         # Lookup user by NFC UID
         user = db.query(Usuario).filter(Usuario.nfc_uid == nfc_uid).first()
         
-        # CASE 1: Card not registered
+        # CASE 1: Card not registered (filter false positive) - aggregated logging
         if not user:
-            event = Evento(
-                event="nfc_scan_denied",
-                actor_uid=None,
-                source=device_id or "unknown",
-                context={
-                    "nfc_uid_truncated": nfc_uid[-4:] if len(nfc_uid) >= 4 else nfc_uid,
-                    "reason": "card_not_registered"
-                }
-            )
-            db.add(event)
-            db.commit()  # SAVE TO DATABASE!
+            nfc_filter.record_unknown_reject(device_id, nfc_uid)
             
-            return jsonify({
+            return {
                 "result": "denied",
                 "reason": "card_not_registered",
                 "message": "NFC card not associated with any user",
                 "timestamp": now_cst().isoformat()
-            })
+            }, None, None
         
         # CASE 2: User account inactive
         if user.estado != "active":
@@ -149,12 +183,12 @@ def nfc_scan():
             db.add(event)
             db.commit()  # SAVE TO DATABASE!
             
-            return jsonify({
+            return {
                 "result": "denied",
                 "reason": "user_inactive",
                 "message": f"User account is {user.estado}",
                 "timestamp": now_cst().isoformat()
-            })
+            }, event.id, None
         
         # CASE 3: NFC card status not active
         if user.nfc_status != "active":
@@ -170,28 +204,66 @@ def nfc_scan():
             db.add(event)
             db.commit()  # SAVE TO DATABASE!
             
-            return jsonify({
+            return {
                 "result": "denied",
                 "reason": "card_revoked",
                 "message": f"NFC card status: {user.nfc_status}",
                 "timestamp": now_cst().isoformat()
-            })
+            }, event.id, None
         
-        # CASE 4: ACCESS GRANTED
+        # CASE 4: Role/area/schedule policy (compiled in memory, no extra query)
+        area = _scan_area(area, nfc_device)
+        decision = policy.evaluate(user.rol, area, "enter")
+        if not decision.allowed:
+            event = Evento(
+                event="nfc_scan_denied",
+                actor_uid=user.uid,
+                source=device_id or "unknown",
+                context={
+                    "reason": "policy_denied",
+                    "area": area,
+                    "policy_rule_id": decision.rule_id
+                }
+            )
+            db.add(event)
+            db.commit()
+            
+            return {
+                "result": "denied",
+                "reason": "policy_denied",
+                "message": f"Access not allowed for {user.rol} in {area or 'this area'} at this time",
+                "timestamp": now_cst().isoformat()
+            }, event.id, decision
+        
+        # CASE 5: Anti-passback against the in-memory occupancy state
+        if cfg.ANTI_PASSBACK:
+            passback = occupancy.check_passback(user.uid, area, direction, source=device_id or "unknown")
+            if passback:
+                event = Evento(
+                    event="nfc_scan_denied",
+                    actor_uid=user.uid,
+                    source=device_id or "unknown",
+                    context={
+                        "reason": passback,
+                        "area": area,
+                        "direction": direction
+                    }
+                )
+                db.add(event)
+                db.commit()
+                
+                return {
+                    "result": "denied",
+                    "reason": passback,
+                    "message": f"Anti-passback: {direction} not allowed in {area or 'this area'}",
+                    "timestamp": now_cst().isoformat()
+                }, event.id, decision
+        
+        # CASE 6: ACCESS GRANTED
         
         # Update user last access
         user.ultimo_acceso = now_cst()
         
-        # Update device last_seen timestamp
-        if device_id:
-            nfc_device = db.query(NFCDevice).filter(NFCDevice.device_id == device_id).first()
-            if nfc_device:
-                nfc_device.last_seen = now_cst()
-                print(f"DEBUG: Updated last_seen for device {device_id}")
-            else:
-                print(f"DEBUG: Device not found with device_id: {device_id}")
-        else:
-            print(f"DEBUG: No device_id provided in scan request")
         
         # Log success event
         event = Evento(
@@ -200,11 +272,17 @@ def nfc_scan():
             source=device_id or "unknown",
             context={
                 "device_id": device_id,
-                "user_rol": user.rol
+                "user_rol": user.rol,
+                "area": area,
+                "direction": direction,
+                "policy_rule_id": decision.rule_id
             }
         )
         db.add(event)
-        db.flush()  # Get event ID
+        db.commit()  # SAVE TO DATABASE!
+        
+        # Occupancy only sees committed grants
+        occupancy.observe(event.id, user.uid, area, direction, source=device_id or "unknown")
         
         # Determine access level based on role
         access_level_map = {
@@ -218,7 +296,7 @@ def nfc_scan():
         }
         access_level = access_level_map.get(user.rol, "standard")
         
-        return jsonify({
+        return {
             "result": "granted",
             "user": {
                 "uid": user.uid,
@@ -231,7 +309,150 @@ def nfc_scan():
             "message": "Access granted",
             "event_id": event.id,
             "timestamp": now_cst().isoformat()
-        })
+        }, event.id, decision
+
+
+# ========== BATCH SCAN (Offline Sync) ==========
+
+@bp.post("/scan/batch")
+def nfc_scan_batch():
+    """
+    Process scans queued by a reader while offline
+    
+    Request Body:
+    {
+        "device_id": "ba899bab96c788b7",
+        "scans": [
+            {"uid": "04A3B2C1D4E5F6", "timestamp": "2025-10-26T15:25:00Z", "password_valid": true},
+            ...
+        ]
+    }
+    Each scan may carry "area", with the same rules as /scan (the device location wins).
+    
+    Response:
+    {
+        "processed": 2,
+        "results": [
+            {"uid": "...", "result": "granted", "event_id": 123},
+            {"uid": "...", "result": "denied", "reason": "card_not_registered"}
+        ]
+    }
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    device_id = data.get("device_id", "")
+    scans = data.get("scans", [])
+    
+    if not isinstance(scans, list):
+        return jsonify({"error": "scans must be an array"}), 400
+    
+    results = []
+    
+    # Unknown cards are rejected by the filter without touching the DB
+    pending = []
+    for scan in scans:
+        if not isinstance(scan, dict):
+            continue
+        nfc_uid = (scan.get("uid") or scan.get("nfc_uid") or "").strip()
+        if not nfc_uid:
+            continue
+        if not scan.get("password_valid", False):
+            results.append({"uid": nfc_uid, "result": "denied", "reason": "invalid_password"})
+            pending.append((scan, nfc_uid, None))
+        elif not nfc_filter.might_be_registered(nfc_uid):
+            nfc_filter.record_unknown_reject(device_id, nfc_uid)
+            results.append({"uid": nfc_uid, "result": "denied", "reason": "card_not_registered"})
+        else:
+            pending.append((scan, nfc_uid, len(results)))
+            results.append(None)
+    
+    if pending:
+        with DB() as db:
+            # Single query for every candidate card in the batch
+            uids = {u for _, u, idx in pending if idx is not None}
+            users = {}
+            if uids:
+                users = {u.nfc_uid: u for u in db.query(Usuario).filter(Usuario.nfc_uid.in_(uids)).all()}
+            
+            nfc_device = None
+            if device_id:
+                nfc_device = db.query(NFCDevice).filter(NFCDevice.device_id == device_id).first()
+            
+            for scan, nfc_uid, idx in pending:
+                # Same area rules as the live path, stored so occupancy/attendance replay match
+                area = _scan_area(scan.get("area"), nfc_device)
+                ctx = {"batch_sync": True, "timestamp": scan.get("timestamp"), "area": area}
+                if idx is None:
+                    ctx.update({
+                        "nfc_uid_truncated": nfc_uid[-4:] if len(nfc_uid) >= 4 else nfc_uid,
+                        "reason": "invalid_password"
+                    })
+                    db.add(Evento(event="nfc_scan_denied", actor_uid=None,
+                                  source=device_id or "unknown", context=ctx))
+                    continue
+                
+                user = users.get(nfc_uid)
+                if not user:
+                    nfc_filter.record_unknown_reject(device_id, nfc_uid)
+                    results[idx] = {"uid": nfc_uid, "result": "denied", "reason": "card_not_registered"}
+                    continue
+                
+                reason = None
+                if user.estado != "active":
+                    reason = "user_inactive"
+                elif user.nfc_status != "active":
+                    reason = "card_revoked"
+                else:
+                    # Evaluate the policy at the time the tap happened offline
+                    decision = policy.evaluate(user.rol, area, "enter", when=scan.get("timestamp"))
+                    ctx["policy_rule_id"] = decision.rule_id
+                    if not decision.allowed:
+                        reason = "policy_denied"
+                
+                if reason:
+                    ctx["reason"] = reason
+                    db.add(Evento(event="nfc_scan_denied", actor_uid=user.uid,
+                                  source=device_id or "unknown", context=ctx))
+                    results[idx] = {"uid": nfc_uid, "result": "denied", "reason": reason}
+                else:
+                    ctx.update({"device_id": device_id, "user_rol": user.rol})
+                    event = Evento(event="nfc_scan_granted", actor_uid=user.uid,
+                                   source=device_id or "unknown", context=ctx)
+                    db.add(event)
+                    db.flush()
+                    results[idx] = {"uid": nfc_uid, "result": "granted", "event_id": event.id}
+            
+            if nfc_device:
+                nfc_device.last_seen = now_cst()
+    
+    return jsonify({
+        "processed": len(results),
+        "results": results
+    })
+
+
+# ========== FAST-REJECT FILTER (Readers) ==========
+
+@bp.get("/filter")
+def nfc_filter_download():
+    """
+    Download the Bloom filter of registered NFC UIDs so readers can reject
+    unknown cards locally (hash scheme documented in app/nfc_filter.py)
+    
+    Response:
+    {
+        "version": "3f9c2a7b1d0e4c58",
+        "algorithm": "bloom-sha256-double-hash",
+        "m": 143776, "k": 10, "count": 42,
+        "bits_b64": "..."
+    }
+    """
+    etag = f'"nfcf-{nfc_filter.filter_version()}"'
+    if request.headers.get("If-None-Match") == etag:
+        return "", 304, {"ETag": etag}
+    resp = jsonify(nfc_filter.export_filter())
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 # ========== HEARTBEAT ==========
@@ -328,6 +549,7 @@ def nfc_assign():
             return jsonify({"error": f"NFC UID already assigned to user {existing.uid}"}), 409
         
         # Assign NFC card
+        previous_uid = user.nfc_uid
         user.nfc_uid = nfc_uid
         user.nfc_uid_hash = hashlib.sha256(nfc_uid.encode()).hexdigest()
         user.nfc_card_id = nfc_uid
@@ -346,6 +568,14 @@ def nfc_assign():
             }
         )
         db.add(event)
+        db.commit()
+        
+        # Keep the fast-reject filter and debounce cache in sync
+        nfc_filter.add_uid(nfc_uid)
+        nfc_debounce.invalidate(nfc_uid)
+        if previous_uid and previous_uid != nfc_uid:
+            nfc_filter.remove_uid(previous_uid)
+            nfc_debounce.invalidate(previous_uid)
         
         return jsonify({
             "ok": True,
@@ -358,6 +588,74 @@ def nfc_assign():
         })
 
 
+@bp.post("/revoke")
+def nfc_revoke():
+    """
+    Revoke a user's NFC card (admin only: Bearer JWT with role R-ADM)
+    
+    Request Body:
+    {
+        "uid": "EMP-001",
+        "release": false    // true = also unlink the card UID so it can be reassigned
+    }
+    
+    Revoked cards stay registered (scans report "card_revoked"); released
+    cards are dropped from the fast-reject filter.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    user_uid = data.get("uid", "").strip()
+    release = bool(data.get("release", False))
+    
+    if not user_uid:
+        return jsonify({"error": "uid required"}), 400
+    
+    with DB() as db:
+        requester, err = require_roles(db, roles=["R-ADM"])
+        if err:
+            return jsonify({"error": err[0]}), err[1]
+        
+        user = db.query(Usuario).filter(Usuario.uid == user_uid).first()
+        
+        if not user:
+            return jsonify({"error": f"User {user_uid} not found"}), 404
+        if not user.nfc_uid:
+            return jsonify({"error": f"User {user_uid} has no NFC card"}), 404
+        
+        card_uid = user.nfc_uid
+        released_uid = card_uid if release else None
+        user.nfc_status = "revoked"
+        user.nfc_revoked_at = now_cst()
+        if release:
+            user.nfc_uid = None
+            user.nfc_uid_hash = None
+        
+        event = Evento(
+            event="nfc_card_revoked",
+            actor_uid=user_uid,
+            source="api",
+            context={
+                "nfc_uid_truncated": card_uid[-4:],
+                "released": release,
+                "revoked_by": requester
+            }
+        )
+        db.add(event)
+        db.commit()
+        
+        nfc_debounce.invalidate(card_uid)
+        if released_uid:
+            nfc_filter.remove_uid(released_uid)
+        
+        return jsonify({
+            "ok": True,
+            "user": {
+                "uid": user.uid,
+                "nfc_status": user.nfc_status,
+                "released": release
+            }
+        })
+
+
 # ========== GET DEVICES (Web UI) ==========
 
 @bp.get("/devices")
@@ -0,0 +1,45 @@
+from flask import Blueprint, request, jsonify
+from sqlalchemy.orm import Session
+from ..db import db_session
+from ..req_auth import require_roles
+from ..time_utils import now_cst
+from .. import occupancy
+
+bp = Blueprint("occupancy", __name__, url_prefix="/api/occupancy")
+
+#
+# Ocupación en tiempo real (estado en memoria mantenido por app/occupancy.py)
+# - /api/occupancy              → todas las áreas {área: {count, uids}}
+# - /api/occupancy/<area>       → quién está dentro de un área
+# - /api/occupancy/user/<uid>   → estado dentro/fuera del usuario por área
+#
+
+ROLES = ["R-ADM", "R-MON", "R-AC", "R-AUD"]
+
+
+@bp.get("")
+def all_areas():
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=ROLES)
+        if err: return jsonify(detail=err[0]), err[1]
+    areas = occupancy.occupancy()
+    if request.args.get("counts_only") in ("1", "true", "yes"):
+        areas = {a: {"count": v["count"]} for a, v in areas.items()}
+    return jsonify(areas=areas, as_of_event_id=occupancy.cursor(), ts=now_cst().isoformat())
+
+
+@bp.get("/<area>")
+def one_area(area: str):
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=ROLES)
+        if err: return jsonify(detail=err[0]), err[1]
+    data = occupancy.occupancy(area)[area]
+    return jsonify(area=area, **data, as_of_event_id=occupancy.cursor(), ts=now_cst().isoformat())
+
+
+@bp.get("/user/<uid>")
+def user(uid: str):
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=ROLES)
+        if err: return jsonify(detail=err[0]), err[1]
+    return jsonify(uid=uid, areas=occupancy.user_state(uid))
@@ -0,0 +1,146 @@
+from flask import Blueprint, request, jsonify
+from sqlalchemy.orm import Session
+from ..db import db_session
+from ..models import AccessPolicyRule
+from ..logging_utils import sign_event_and_persist
+from ..req_auth import require_roles
+from ..time_utils import now_cst, ensure_cst
+from .. import policy
+
+bp = Blueprint("policy", __name__, url_prefix="/api/policy")
+
+#
+# Rutas de políticas de acceso (solo R-ADM)
+# - /rules          → lista / alta de reglas rol × área × horario
+# - /rules/<id>     → actualización / baja
+# - /explain        → qué regla concede o deniega (role, area, action, at)
+# - /reload         → fuerza recompilación en esta instancia
+# Cada cambio recompila el motor en caliente (app/policy.py).
+#
+
+RULE_FIELDS = ("role", "area", "action", "effect", "days", "start_time", "end_time",
+               "priority", "enabled", "description")
+
+
+def _as_dict_rule(r: AccessPolicyRule):
+    return {"id": r.id, "role": r.role, "area": r.area, "action": r.action, "effect": r.effect,
+            "days": r.days, "start_time": r.start_time, "end_time": r.end_time,
+            "priority": r.priority, "enabled": r.enabled, "description": r.description,
+            "updated_at": r.updated_at.isoformat() if r.updated_at else None}
+
+
+def _validate(db, data: dict):
+    if not policy.known_role(db, data.get("role", "*")):
+        return f"role must be '*' or one of {', '.join(policy.ROLES)} (or a role in use)"
+    area = data.get("area", "*")
+    if not isinstance(area, str) or not area.strip():
+        return "area must be a non-empty string"
+    if data.get("action", "enter") not in policy.ACTIONS:
+        return f"action must be one of {', '.join(policy.ACTIONS)}"
+    if data.get("effect", "allow") not in ("allow", "deny"):
+        return "effect must be allow or deny"
+    priority = data.get("priority", 100)
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        return "priority must be an integer"
+    if not isinstance(data.get("enabled", True), bool):
+        return "enabled must be a boolean"
+    try:
+        policy.validate_rule(data.get("days"), data.get("start_time"), data.get("end_time"))
+    except (ValueError, TypeError) as e:
+        return f"invalid schedule: {e}"
+    return None
+
+
+@bp.get("/rules")
+def list_rules():
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+        policy.evaluate("*", None)  # asegura reglas sembradas
+        rows = db.query(AccessPolicyRule).order_by(AccessPolicyRule.priority.desc(), AccessPolicyRule.id).all()
+        return jsonify([_as_dict_rule(r) for r in rows])
+
+
+@bp.post("/rules")
+def create_rule():
+    data = request.get_json(force=True, silent=True) or {}
+    with db_session() as db:  # type: Session
+        requester, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+        problem = _validate(db, data)
+        if problem:
+            return jsonify(detail=problem), 400
+        r = AccessPolicyRule(**{k: data[k] for k in RULE_FIELDS if k in data})
+        r.updated_at = now_cst()
+        db.add(r); db.commit()
+        sign_event_and_persist(db, "policy_rule_created", actor_uid=requester, source="admin_api",
+                               context=_as_dict_rule(r))
+        policy.reload()
+        return jsonify(id=r.id), 201
+
+
+@bp.put("/rules/<int:rid>")
+def update_rule(rid: int):
+    data = request.get_json(force=True, silent=True) or {}
+    with db_session() as db:  # type: Session
+        requester, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+        r = db.query(AccessPolicyRule).filter(AccessPolicyRule.id == rid).first()
+        if not r:
+            return jsonify(detail="not found"), 404
+        merged = {k: data.get(k, getattr(r, k)) for k in RULE_FIELDS}
+        problem = _validate(db, merged)
+        if problem:
+            return jsonify(detail=problem), 400
+        for k in RULE_FIELDS:
+            if k in data:
+                setattr(r, k, data[k])
+        r.updated_at = now_cst()
+        db.commit()
+        sign_event_and_persist(db, "policy_rule_updated", actor_uid=requester, source="admin_api",
+                               context=_as_dict_rule(r))
+        policy.reload()
+        return jsonify(ok=True)
+
+
+@bp.delete("/rules/<int:rid>")
+def delete_rule(rid: int):
+    with db_session() as db:  # type: Session
+        requester, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+        r = db.query(AccessPolicyRule).filter(AccessPolicyRule.id == rid).first()
+        if not r:
+            return jsonify(detail="not found"), 404
+        snapshot = _as_dict_rule(r)
+        db.delete(r); db.commit()
+        sign_event_and_persist(db, "policy_rule_deleted", actor_uid=requester, source="admin_api",
+                               context=snapshot)
+        policy.reload()
+        return jsonify(ok=True)
+
+
+@bp.get("/explain")
+def explain():
+    """Evalúa role/area/action (opcional at=ISO8601) y devuelve la regla que decide."""
+    role = request.args.get("role")
+    area = request.args.get("area")
+    action = request.args.get("action", "enter")
+    at = request.args.get("at")
+    if not role:
+        return jsonify(detail="role required"), 400
+    if at and ensure_cst(at) is None:
+        return jsonify(detail="at must be ISO8601"), 400
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+    d = policy.evaluate(role, area, action, when=at)
+    return jsonify(role=role, area=area, action=action, at=at, **d.explain())
+
+
+@bp.post("/reload")
+def reload_rules():
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM"])
+        if err: return jsonify(detail=err[0]), err[1]
+    policy.reload()
+    return jsonify(ok=True)
@@ -1,19 +1,24 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from sqlalchemy.orm import Session
 from ..db import db_session
-from ..models import AuthSession, Usuario
-from ..qr import verify_qr_value, hash_qr_value, qr_value_fingerprint
+from ..models import Usuario
+from ..qr import (verify_qr_value, hash_qr_value, qr_value_fingerprint, gen_qr_value_b32, make_upy_qr_image,
+                  make_upy_qr_svg, card_version)
+from ..user_qr import resolve_logo, save_user_qr_png
+from ..req_auth import require_roles, current_identity
+from .. import card_cache, identity_cache, pending_sessions, qr_scanner
 from ..auth import create_jwt
 from ..logging_utils import sign_event_and_persist
 from ..attempts import check_lock, register_failure
-from ..time_utils import now_cst, ensure_cst
+from ..time_utils import now_cst
+from ..config import cfg
 import datetime
+import io
 
 # Robust decoder
-import io
-import numpy as np
 import cv2
-from PIL import Image, UnidentifiedImageError
+from PIL import UnidentifiedImageError
+from .. import qr_decode
 
 bp = Blueprint("qr", __name__, url_prefix="/api/qr")
 
@@ -23,6 +28,9 @@ bp = Blueprint("qr", __name__, url_prefix="/api/qr")
 # - /assign → asigna (o rota) un QR a un usuario (admin)
 # - /revoke → revoca un QR de un usuario
 # - /decode → fallback universal: el servidor intenta decodificar un QR desde una imagen
+# - /decode/batch → varios frames (ráfaga) en una petición; responde con el primero que decodifica
+# - /card/<uid> → PNG de la tarjeta bajo demanda (LRU + ETag por versión; ver app/card_cache.py)
+# - /preview → vista previa de la tarjeta (SVG por defecto, o PNG) para un valor dado o de ejemplo
 #
 
 
@@ -31,7 +39,7 @@ def scan_qr():
     """Valida el QR leído durante la ventana corta de login.
 
     Flujo esperado:
-    1) El frontend hace /api/auth/login → crea AuthSession con state=pending.
+    1) El frontend hace /api/auth/login → abre una sesión pendiente (app/pending_sessions.py).
     2) En qr.html se lee un QR; aquí se compara con todos los usuarios activos.
     3) Si hay match y el QR pertenece al mismo UID de la sesión → state=completed.
        El frontend continúa a app.html y habilita la sesión larga.
@@ -43,18 +51,15 @@ def scan_qr():
     qr_value = data.get("qr_value")
 
     with db_session() as db:  # type: Session
-        sess = db.query(AuthSession).filter(AuthSession.session_id == session_id).first()
+        sess = pending_sessions.get(session_id)
         if not sess:
             # Loggear explícitamente el caso de sesión inexistente
             sign_event_and_persist(db, "qr_session_not_found", actor_uid=None, source="qr_api",
                                    context={"session_id": session_id})
             return jsonify(detail="session not found"), 404
-        exp = ensure_cst(sess.expires_at)
-        if exp and exp < now_cst():
-            sess.state = "expired"; db.commit()
-            # Alerta amarilla por timeout/expiración
-            sign_event_and_persist(db, "qr_session_expired", actor_uid=sess.uid, source="qr_api",
-                                   context={"session_id": sess.session_id})
+        if sess.state == "expired" or sess.is_expired():
+            # La alerta amarilla (qr_session_expired) la emite el temporizador; si aún no pasó, aquí
+            pending_sessions.expire(sess.session_id)
             return jsonify(detail="session expired", reason="session_expired"), 400
 
         # Si el usuario está bloqueado por intentos, rechazar
@@ -90,7 +95,7 @@ def scan_qr():
                     break
 
         if not matched:
-            sess.state = "failed"; db.commit()
+            pending_sessions.mark(sess.session_id, "failed")
             # Registrar intento fallido vinculado al UID de la sesión
             count, _ = register_failure(sess.uid)
             ev = "qr_scanned_fail"  # se mantiene para compatibilidad
@@ -99,7 +104,7 @@ def scan_qr():
             return jsonify(detail="QR not recognized", reason="hash_miss"), 401
 
         if sess.uid != matched.uid:
-            sess.state = "failed"; db.commit()
+            pending_sessions.mark(sess.session_id, "failed")
             count, _ = register_failure(sess.uid)
             # Registro explícito de intento de usar QR ajeno
             sign_event_and_persist(
@@ -117,7 +122,7 @@ def scan_qr():
             return jsonify(detail="QR does not belong to logged user", reason="session_user_mismatch"), 403
 
         # Éxito → marcar sesión como completada y actualizar último acceso
-        sess.state = "completed"
+        pending_sessions.mark(sess.session_id, "completed")
         now = now_cst()
         matched.ultimo_acceso = now
         matched.actualizado_en = now  # si existe el campo
@@ -132,7 +137,8 @@ def scan_qr():
         except Exception:
             pass
         # Emitir JWT para sesión larga en frontend
-        token = create_jwt({"uid": matched.uid, "rol": matched.rol})
+        ident = identity_cache.lookup(db, matched.uid)
+        token = create_jwt({"uid": matched.uid, "rol": matched.rol, "te": ident.epoch if ident else 0})
         return jsonify(ok=True, next="done", token=token)
 
 
@@ -171,6 +177,14 @@ def assign_qr():
         user.qr_status = "active"
         user.actualizado_en = now_cst()
         db.commit()
+        if qr_value:
+            # PNG maestro de la nueva versión (fuente de /card/<uid>)
+            try:
+                save_user_qr_png(user.uid, qr_value, qr_hash=user.qr_value_hash)
+            except Exception as e:
+                print("[qr] card image failed:", e)
+        card_cache.invalidate(user.uid)
+        qr_scanner.forget_unknown()
         sign_event_and_persist(db, "qr_assigned", actor_uid=user.uid, source="admin_api",
                                context={"qr_card_id": user.qr_card_id, "reused_existing": reused})
         return jsonify(ok=True, reused_existing=reused)
@@ -187,6 +201,7 @@ def revoke_qr(uid: str):
         user.qr_revoked_at = now_cst()
         user.actualizado_en = now_cst()
         db.commit()
+        card_cache.invalidate(user.uid)
         sign_event_and_persist(db, "qr_revoked", actor_uid=user.uid, source="admin_api", context={})
         return jsonify(ok=True)
 
@@ -195,113 +210,157 @@ def revoke_qr(uid: str):
 def qr_timeout():
     """Registrar expiración del tiempo de escaneo desde el cliente.
 
-    El frontend avisa cuando agota su contador sin escanear. Aquí marcamos la
-    sesión como expirada (si existe) y emitimos un evento amarillo estable
-    (qr_session_expired) para que siempre quede en la bitácora.
+    El frontend avisa cuando agota su contador sin escanear. Si la sesión sigue
+    abierta se expira ya y se emite qr_session_expired; si el temporizador del
+    servidor se adelantó, el evento ya está en la bitácora y esto es un no-op.
     """
     data = request.get_json(force=True, silent=True) or {}
     session_id = data.get("session_id")
     if not session_id:
         return jsonify(detail="session_id required"), 400
-    with db_session() as db:  # type: Session
-        sess = db.query(AuthSession).filter(AuthSession.session_id == session_id).first()
-        if not sess:
-            return jsonify(ok=True)  # no-op
-        if sess.state != "completed":
-            sess.state = "expired"
-            db.commit()
-        sign_event_and_persist(db, "qr_session_expired", actor_uid=sess.uid, source="qr_api",
-                               context={"session_id": sess.session_id, "client": True})
-        return jsonify(ok=True)
+    pending_sessions.expire(session_id, client=True)
+    return jsonify(ok=True)
 
 
 # ========================
 #  Fallback Universal: decodificar QR en servidor desde imagen (robusto)
 #  Útil para navegadores sin BarcodeDetector o cámaras con permisos limitados.
+#  Decodificación por etapas en app/qr_decode.py (carga reducida, variantes baratas primero,
+#  el resto en paralelo); tiempos por etapa en la respuesta y en la cabecera Server-Timing.
 # ========================
 
-def _opencv_decode_try(mat_bgr):
-    """Intenta varias transformaciones hasta extraer un QR y devuelve texto o None."""
-    det = cv2.QRCodeDetector()
-
-    def try_once(img):
-        val, pts, _ = det.detectAndDecode(img)
-        return val if val else None
-
-    # 1) original
-    v = try_once(mat_bgr)
-    if v: return v
-
-    # 2) reescalar si es enorme o muy chico
-    h, w = mat_bgr.shape[:2]
-    scale = 1024.0 / max(h, w)
-    if scale < 1.0:
-        resized = cv2.resize(mat_bgr, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_AREA)
-        v = try_once(resized)
-        if v: return v
-
-    # 3) gris y umbrales
-    gray = cv2.cvtColor(mat_bgr, cv2.COLOR_BGR2GRAY)
-    # a) adaptativo
-    thr = cv2.adaptiveThreshold(gray,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                cv2.THRESH_BINARY, 31, 10)
-    v = try_once(thr)
-    if v: return v
-    # b) Otsu
-    _, thr2 = cv2.threshold(gray,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-    v = try_once(thr2)
-    if v: return v
-
-    # 4) rotaciones 90/180/270
-    for rot in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_180, cv2.ROTATE_90_COUNTERCLOCKWISE):
-        rimg = cv2.rotate(mat_bgr, rot)
-        v = try_once(rimg)
-        if v: return v
-
-    # 5) un poco de sharpen + intento
-    k = np.array([[0,-1,0],[-1,5,-1],[0,-1,0]])
-    sharp = cv2.filter2D(mat_bgr, -1, k)
-    v = try_once(sharp)
-    if v: return v
-
-    return None
+def _multi_flag() -> bool:
+    return str(request.values.get("multi", "0")).lower() in ("1", "true", "yes")
+
+
+def _decode_response(decode):
+    """Ejecuta decode() → (valores, info) y arma la respuesta común de /decode y /decode/batch."""
+    try:
+        values, info = decode()
+    except UnidentifiedImageError:
+        return jsonify(detail="unsupported image format"), 400
+    except cv2.error as e:
+        return jsonify(detail=f"opencv error: {e}"), 400
+    except Exception as e:
+        return jsonify(detail=f"image read error: {e}"), 400
+
+    headers = {"Server-Timing": qr_decode.server_timing(info["timings_ms"])}
+    if values:
+        return jsonify(value=values[0], values=values, **info), 200, headers
+    # no encontrado
+    return jsonify(value=None), 204, headers
 
 
 @bp.post("/decode")
 def decode_qr_image():
     """
-    multipart/form-data con campo 'image'.
-    200 -> { "value": "<texto>" } si hay QR
+    multipart/form-data con campo 'image'; multi=1 devuelve todos los códigos de la imagen.
+    200 -> { "value": "<texto>", "values": [...], "stage": "...", "timings_ms": {...} } si hay QR
     204 -> { "value": null } si no detecta
     400 -> { "detail": "..."} si la imagen es inválida
     """
     file = request.files.get("image")
     if not file:
         return jsonify(detail="image required"), 400
+    raw, multi = file.read(), _multi_flag()
+    return _decode_response(lambda: qr_decode.decode_bytes(raw, multi=multi))
 
-    try:
-        raw = file.read()
-        # Abrir con PIL (mejor compatibilidad: HEIC/WEBP/PNG/JPEG… según plugins disponibles)
-        img_pil = Image.open(io.BytesIO(raw)).convert("RGB")
-    except UnidentifiedImageError:
-        return jsonify(detail="unsupported image format"), 400
-    except Exception as e:
-        return jsonify(detail=f"image read error: {e}"), 400
 
-    # PIL -> numpy BGR para OpenCV
+@bp.post("/decode/batch")
+def decode_qr_batch():
+    """
+    Ráfaga de frames en una sola petición: multipart con varios campos 'images' (o 'image').
+    Se decodifican en paralelo y se responde con el primer frame que dé algún código.
+    200 -> { "value", "values", "frame": <índice>, "frames": n, "stage", "timings_ms" }
+    204 -> { "value": null } si ningún frame tiene QR
+    """
+    files = request.files.getlist("images") or request.files.getlist("image")
+    if not files:
+        return jsonify(detail="images required"), 400
+    if len(files) > cfg.QR_DECODE_BATCH_MAX:
+        return jsonify(detail=f"too many frames (max {cfg.QR_DECODE_BATCH_MAX})"), 400
+    raws, multi = [f.read() for f in files], _multi_flag()
+    return _decode_response(lambda: qr_decode.decode_batch(raws, multi=multi))
+
+
+@bp.get("/card/<uid>")
+def card_image(uid: str):
+    """PNG de la tarjeta QR de `uid` (el propio usuario o R-ADM/R-IM); ?size=<px> (por defecto 600).
+
+    ETag fuerte ligado a la versión de la tarjeta: con If-None-Match vigente responde 304 sin
+    tocar la imagen; tras una rotación la versión cambia y el navegador recibe la nueva.
+    404 sin QR asignado, 410 QR revocado, 409 si falta la imagen de la versión vigente.
+    """
     try:
-        mat_rgb = np.array(img_pil)
-        mat_bgr = cv2.cvtColor(mat_rgb, cv2.COLOR_RGB2BGR)
-    except Exception as e:
-        return jsonify(detail=f"image convert error: {e}"), 400
+        size = int(request.args.get("size") or 600)
+    except ValueError:
+        return jsonify(detail="size must be an integer"), 400
+    if not 64 <= size <= cfg.QR_IMAGE_MAX_SIZE:
+        return jsonify(detail=f"size must be between 64 and {cfg.QR_IMAGE_MAX_SIZE}"), 400
+    with db_session() as db:  # type: Session
+        requester, role = current_identity(db)
+        if not requester:
+            return jsonify(detail="unauthorized"), 401
+        if requester != uid and role not in ("R-ADM", "R-IM"):
+            return jsonify(detail="forbidden"), 403
+        user = db.query(Usuario).filter(Usuario.uid == uid).first()
+        if not user or not user.qr_value_hash:
+            return jsonify(detail="card not found"), 404
+        if user.qr_status == "revoked":
+            return jsonify(detail="card revoked"), 410
+        version = card_version(user.qr_value_hash)
+    tag = card_cache.etag(version, size)
+    headers = {"Cache-Control": "private, no-cache"}   # reutilizable, pero siempre revalidado
+    if request.if_none_match.contains(tag):
+        resp = Response(status=304, headers=headers)
+    else:
+        try:
+            data = card_cache.get_card_png(uid, version, size)
+        except card_cache.CardUnavailable as e:
+            return jsonify(detail=str(e)), 409
+        resp = Response(data, mimetype="image/png", headers=headers)
+    resp.set_etag(tag)
+    return resp
 
-    try:
-        val = _opencv_decode_try(mat_bgr)
-    except Exception as e:
-        return jsonify(detail=f"opencv error: {e}"), 400
 
-    if val:
-        return jsonify(value=val)
-    else:
-        # no encontrado
-        return jsonify(value=None), 204
+@bp.get("/card-cache/stats")
+def card_cache_stats():
+    """Aciertos, renders y ocupación de la caché de tarjetas."""
+    return jsonify(card_cache.stats())
+
+
+@bp.post("/preview")
+def preview_card():
+    """Vista previa de la tarjeta QR tema UPY (admin/IAM).
+
+    JSON: { "value": "<opcional; si falta se usa uno de ejemplo>", "format": "svg"|"png", "size": 600 }
+    El valor va en el cuerpo (no en la URL) para que no quede en logs de acceso. SVG es mucho más
+    barato de generar y de enviar; PNG es el mismo render que las tarjetas impresas.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    fmt = (data.get("format") or "svg").lower()
+    if fmt not in ("svg", "png"):
+        return jsonify(detail="format must be svg or png"), 400
+    try:
+        size = int(data.get("size") or 600)
+    except (TypeError, ValueError):
+        return jsonify(detail="size must be an integer"), 400
+    if not 64 <= size <= 2048:
+        return jsonify(detail="size must be between 64 and 2048"), 400
+    with db_session() as db:  # type: Session
+        _, err = require_roles(db, roles=["R-ADM", "R-IM"])
+        if err: return jsonify(detail=err[0]), err[1]
+    value = str(data.get("value") or gen_qr_value_b32())
+    headers = {"Cache-Control": "no-store"}
+    if fmt == "svg":
+        return Response(make_upy_qr_svg(value, size=size, logo_path=resolve_logo()),
+                        mimetype="image/svg+xml", headers=headers)
+    buf = io.BytesIO()
+    make_upy_qr_image(value, size=size, logo_path=resolve_logo()).save(buf, format="PNG")
+    return Response(buf.getvalue(), mimetype="image/png", headers=headers)
+
+
+@bp.get("/decode/stats")
+def decode_stats():
+    """Acumulados del decodificador: peticiones, aciertos por variante y ms medios por etapa."""
+    return jsonify(qr_decode.stats())
@@ -8,6 +8,7 @@ from ..qr import gen_qr_value_b32, hash_qr_value
 from ..user_qr import save_user_qr_png, resolve_logo
 from ..logging_utils import sign_event_and_persist, register_log_listener, unregister_log_listener
 from ..req_auth import require_roles
+from .. import identity_cache, pending_sessions
 from flask import Response, stream_with_context
 import json
 import os
@@ -42,7 +43,7 @@ class DB:
             self.db.close()
 
 def _require_role(db: Session, requester_uid: str, roles: list[str]):
-    u = db.query(Usuario).filter(Usuario.uid == requester_uid).first()
+    u = identity_cache.lookup(db, requester_uid)
     if not u or u.estado != "active":
         return None, ("user not active", 403)
     if u.rol not in roles:
@@ -215,10 +216,17 @@ def update_user(uid: str):
         if err: return jsonify(detail=err[0]), err[1]
         u = db.query(Usuario).filter(Usuario.uid == uid).first()
         if not u: return jsonify(detail="not found"), 404
+        prev_estado = u.estado
         for k in ("nombre","apellido","email","rol","estado"):
             if k in data and data[k] is not None:
                 setattr(u, k, data[k])
         u.actualizado_en = now_cst()
+        db.commit()
+        # Cambio de estado: los JWT ya emitidos dejan de valer; si no, basta refrescar rol/estado
+        if u.estado != prev_estado:
+            identity_cache.bump_epoch(db, uid)
+        else:
+            identity_cache.invalidate(uid)
         return jsonify(ok=True)
 
 @bp.post("/users")
@@ -253,7 +261,7 @@ def create_user():
             except Exception:
                 pass
             # Guardar PNG con tema UPY
-            save_user_qr_png(u.uid, qr_val, outdir="cards", size=600)
+            save_user_qr_png(u.uid, qr_val, outdir="cards", size=600, qr_hash=u.qr_value_hash)
         except Exception:
             pass
         db.add(u)
@@ -422,6 +430,7 @@ def db_all():
         # auth_sessions puede no existir en este SessionLocal import, pero está en models
         from ..models import AuthSession, CameraDevice, QRScannerDevice, NFCDevice
         sessions = db.query(AuthSession).order_by(AuthSession.created_at.desc()).limit(300).all()
+        live_sessions = pending_sessions.recent(300)   # backend memory: no están en la tabla
 
         resp = jsonify({
             "usuarios": [{
@@ -443,13 +452,13 @@ def db_all():
                 "ts": e.ts.isoformat() if getattr(e, 'ts', None) else None,
                 "context": e.context,
             } for e in eventos],
-            "auth_sessions": [{
+            "auth_sessions": live_sessions + [{
                 "session_id": s.session_id,
                 "uid": s.uid,
                 "state": s.state,
                 "created_at": s.created_at.isoformat() if getattr(s, 'created_at', None) else None,
                 "expires_at": s.expires_at.isoformat() if getattr(s, 'expires_at', None) else None,
-            } for s in sessions],
+            } for s in sessions][:300 - len(live_sessions)],
             "devices": {
                 "cameras": [{
                     "id": d.id, "name": d.name, "ip": d.ip, "url": d.url,
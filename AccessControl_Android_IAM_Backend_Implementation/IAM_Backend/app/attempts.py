@@ -1,33 +1,299 @@
+import math
+import os
+import sqlite3
+import threading
 import time
-from typing import Tuple, Dict
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
 
-# Intentos fallidos y bloqueo temporal (en memoria de proceso)
-LOCK_WINDOW_SEC = 10 * 60  # 10 minutos
-MAX_ATTEMPTS = 3
+from .config import cfg
 
-_attempts: Dict[str, Dict[str, int]] = {}
+#
+# Intentos fallidos y bloqueo temporal (login por contraseña y escaneo de QR)
+# - Ventana deslizante: se bloquea cuando hay ATTEMPT_MAX fallos dentro de los últimos
+#   ATTEMPT_WINDOW_SEC; el bloqueo dura ATTEMPT_LOCK_SEC. Los fallos viejos caducan solos.
+# - Backends (ATTEMPT_STORE):
+#     · memory: dict LRU acotado (ATTEMPT_MAX_KEYS) por proceso; suficiente con un solo worker.
+#       Lleno, una clave nueva primero purga las entradas sin efecto y luego desaloja la menos
+#       reciente sin bloqueo vigente; un bloqueo nunca se desaloja (inundar con claves nuevas no
+#       desbloquea a nadie). Si todas están bloqueadas la clave nueva no se registra.
+#     · sqlite: archivo SQLite local (ATTEMPT_STORE_PATH, WAL) compartido por todos los procesos
+#       worker de la máquina: el contador no se reparte entre procesos.
+# - Un hilo de fondo (start()) purga cada ATTEMPT_SWEEP_SEC las entradas ya sin efecto; stats()
+#   expone claves activas, bloqueos vigentes y contadores.
+# - check_lock / register_failure / reset a nivel de módulo delegan en el backend configurado.
+#
+
+MAX_ATTEMPTS = cfg.ATTEMPT_MAX
+LOCK_WINDOW_SEC = cfg.ATTEMPT_LOCK_SEC
+
+
+class LockoutStore(ABC):
+    """Interfaz común de los backends."""
+    backend = "base"
+
+    def __init__(self, max_attempts: int, window_sec: int, lock_sec: int):
+        self.max_attempts = max(1, int(max_attempts))
+        self.window_sec = max(1, int(window_sec))
+        self.lock_sec = max(1, int(lock_sec))
+
+    @abstractmethod
+    def check_lock(self, key: str) -> int:
+        """Segundos restantes de bloqueo (>0) o 0 si no hay bloqueo."""
+
+    @abstractmethod
+    def register_failure(self, key: str) -> Tuple[int, int]:
+        """Anota un fallo y devuelve (fallos en la ventana, locked_until_ts o 0)."""
+
+    @abstractmethod
+    def reset(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Purga entradas sin fallos en la ventana ni bloqueo vigente. Devuelve cuántas."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class _Rec:
+    __slots__ = ("fails", "locked_until")
+
+    def __init__(self):
+        self.fails: Deque[float] = deque()
+        self.locked_until = 0.0
+
+
+class MemoryLockoutStore(LockoutStore):
+    backend = "memory"
+
+    def __init__(self, max_attempts: int, window_sec: int, lock_sec: int, max_keys: int = 100000):
+        super().__init__(max_attempts, window_sec, lock_sec)
+        self.max_keys = max(1, int(max_keys))
+        self._lock = threading.Lock()
+        self._recs: "OrderedDict[str, _Rec]" = OrderedDict()
+        self._swept_at = 0.0
+        self._full_until = 0.0   # todas las claves bloqueadas hasta este instante (sin hueco)
+        self._stats = {"failures": 0, "locks": 0, "blocked_checks": 0, "evicted": 0, "swept": 0,
+                       "refused": 0}
+
+    def check_lock(self, key: str) -> int:
+        now = time.time()
+        with self._lock:
+            rec = self._recs.get(key)
+            if rec and rec.locked_until > now:
+                self._stats["blocked_checks"] += 1
+                return math.ceil(rec.locked_until - now)
+        return 0
+
+    def _dead(self, rec: _Rec, now: float) -> bool:
+        return rec.locked_until <= now and (not rec.fails or rec.fails[-1] <= now - self.window_sec)
+
+    def _make_room(self, now: float) -> bool:
+        """Con _lock tomado: deja hueco para una clave nueva. False si todas están bloqueadas."""
+        if now < self._full_until:
+            return False
+        if now - self._swept_at >= 1.0:   # purga completa como mucho una vez por segundo
+            self._swept_at = now
+            dead = [k for k, r in self._recs.items() if self._dead(r, now)]
+            for k in dead:
+                del self._recs[k]
+            self._stats["swept"] += len(dead)
+            if len(self._recs) < self.max_keys:
+                return True
+        victim = next((k for k, r in self._recs.items() if r.locked_until <= now), None)
+        if victim is None:
+            self._full_until = min(r.locked_until for r in self._recs.values())
+            return False
+        del self._recs[victim]
+        self._stats["evicted"] += 1
+        return True
+
+    def register_failure(self, key: str) -> Tuple[int, int]:
+        now = time.time()
+        with self._lock:
+            rec = self._recs.pop(key, None)
+            if rec is None:
+                if len(self._recs) >= self.max_keys and not self._make_room(now):
+                    self._stats["refused"] += 1
+                    return 1, 0
+                rec = _Rec()
+            while rec.fails and rec.fails[0] <= now - self.window_sec:
+                rec.fails.popleft()
+            rec.fails.append(now)
+            self._stats["failures"] += 1
+            if len(rec.fails) >= self.max_attempts and rec.locked_until <= now:
+                rec.locked_until = now + self.lock_sec
+                self._stats["locks"] += 1
+            self._recs[key] = rec   # al final: más reciente
+            return len(rec.fails), int(rec.locked_until) if rec.locked_until > now else 0
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._recs.pop(key, None)
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            dead = [k for k, r in self._recs.items() if self._dead(r, now)]
+            for k in dead:
+                del self._recs[k]
+            self._stats["swept"] += len(dead)
+        return len(dead)
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            locked = sum(1 for r in self._recs.values() if r.locked_until > now)
+            return {"backend": self.backend, "keys": len(self._recs), "locked": locked,
+                    "max_keys": self.max_keys, **self._stats}
+
+
+class SQLiteLockoutStore(LockoutStore):
+    backend = "sqlite"
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS lockout_failures (key TEXT NOT NULL, ts REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_lockout_failures_key_ts ON lockout_failures (key, ts)",
+        "CREATE TABLE IF NOT EXISTS lockout_locks (key TEXT PRIMARY KEY, locked_until REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS lockout_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    )
+
+    def __init__(self, path: str, max_attempts: int, window_sec: int, lock_sec: int):
+        super().__init__(max_attempts, window_sec, lock_sec)
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+        conn = self._conn()
+        for stmt in self._SCHEMA:
+            conn.execute(stmt)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo; autocommit salvo las transacciones explícitas
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _bump(conn, name: str, n: int = 1) -> None:
+        conn.execute("INSERT INTO lockout_stats (name, value) VALUES (?, ?) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def check_lock(self, key: str) -> int:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT locked_until FROM lockout_locks WHERE key = ?", (key,)).fetchone()
+        if row and row[0] > now:
+            self._bump(conn, "blocked_checks")
+            return math.ceil(row[0] - now)
+        return 0
+
+    def register_failure(self, key: str) -> Tuple[int, int]:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")   # serializa entre procesos: el conteo no se pierde
+        try:
+            conn.execute("DELETE FROM lockout_failures WHERE key = ? AND ts <= ?", (key, now - self.window_sec))
+            conn.execute("INSERT INTO lockout_failures (key, ts) VALUES (?, ?)", (key, now))
+            count = conn.execute("SELECT COUNT(*) FROM lockout_failures WHERE key = ?", (key,)).fetchone()[0]
+            self._bump(conn, "failures")
+            row = conn.execute("SELECT locked_until FROM lockout_locks WHERE key = ?", (key,)).fetchone()
+            locked_until = row[0] if row and row[0] > now else 0
+            if count >= self.max_attempts and not locked_until:
+                locked_until = now + self.lock_sec
+                conn.execute("INSERT OR REPLACE INTO lockout_locks (key, locked_until) VALUES (?, ?)",
+                             (key, locked_until))
+                self._bump(conn, "locks")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return count, int(locked_until)
+
+    def reset(self, key: str) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM lockout_failures WHERE key = ?", (key,))
+        conn.execute("DELETE FROM lockout_locks WHERE key = ?", (key,))
+        conn.execute("COMMIT")
+
+    def sweep(self) -> int:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        n = conn.execute("DELETE FROM lockout_failures WHERE ts <= ?", (now - self.window_sec,)).rowcount
+        n += conn.execute("DELETE FROM lockout_locks WHERE locked_until <= ?", (now,)).rowcount
+        if n:
+            self._bump(conn, "swept", n)
+        conn.execute("COMMIT")
+        return n
+
+    def stats(self) -> dict:
+        now = time.time()
+        conn = self._conn()
+        keys = conn.execute("SELECT COUNT(DISTINCT key) FROM lockout_failures").fetchone()[0]
+        locked = conn.execute("SELECT COUNT(*) FROM lockout_locks WHERE locked_until > ?", (now,)).fetchone()[0]
+        counters = dict(conn.execute("SELECT name, value FROM lockout_stats").fetchall())
+        return {"backend": self.backend, "path": self.path, "keys": keys, "locked": locked,
+                **{k: counters.get(k, 0) for k in ("failures", "locks", "blocked_checks", "swept")}}
+
+
+_store: Optional[LockoutStore] = None
+_store_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def get_store() -> LockoutStore:
+    """Backend configurado (ATTEMPT_STORE), creado una vez por proceso."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if cfg.ATTEMPT_STORE == "sqlite":
+                _store = SQLiteLockoutStore(cfg.ATTEMPT_STORE_PATH, cfg.ATTEMPT_MAX,
+                                            cfg.ATTEMPT_WINDOW_SEC, cfg.ATTEMPT_LOCK_SEC)
+            else:
+                _store = MemoryLockoutStore(cfg.ATTEMPT_MAX, cfg.ATTEMPT_WINDOW_SEC,
+                                            cfg.ATTEMPT_LOCK_SEC, cfg.ATTEMPT_MAX_KEYS)
+        return _store
 
 
 def check_lock(key: str) -> int:
     """Devuelve segundos restantes de bloqueo (>0) o 0 si no hay bloqueo."""
-    rec = _attempts.get(key)
-    now_ts = int(time.time())
-    if rec and rec.get("locked_until", 0) > now_ts:
-        return rec["locked_until"] - now_ts
-    return 0
+    return get_store().check_lock(key)
 
 
 def register_failure(key: str) -> Tuple[int, int]:
-    """Incrementa contador y devuelve (count, locked_until_ts)."""
-    now_ts = int(time.time())
-    rec = _attempts.get(key) or {"count": 0, "first_ts": now_ts, "locked_until": 0}
-    rec["count"] = int(rec.get("count", 0)) + 1
-    if rec["count"] >= MAX_ATTEMPTS:
-        rec["locked_until"] = now_ts + LOCK_WINDOW_SEC
-    _attempts[key] = rec
-    return rec["count"], rec["locked_until"]
+    """Anota un fallo y devuelve (fallos en la ventana, locked_until_ts o 0)."""
+    return get_store().register_failure(key)
 
 
 def reset(key: str) -> None:
-    _attempts.pop(key, None)
+    get_store().reset(key)
+
+
+def stats() -> dict:
+    return get_store().stats()
+
+
+def _loop() -> None:
+    while True:
+        time.sleep(max(5, cfg.ATTEMPT_SWEEP_SEC))
+        try:
+            get_store().sweep()
+        except Exception as e:
+            print("[attempts] sweep failed:", e)
+
 
+def start() -> None:
+    global _thread
+    if _thread is not None:
+        return
+    get_store()
+    _thread = threading.Thread(target=_loop, name="attempts-sweep", daemon=True)
+    _thread.start()
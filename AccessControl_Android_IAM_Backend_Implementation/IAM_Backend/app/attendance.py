@@ -0,0 +1,301 @@
+import csv
+import datetime
+import io
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from sqlalchemy import func
+
+from .config import cfg
+from .db import standalone_session
+from .models import AttendanceDay, Evento, ProcessingCursor, Usuario
+from .occupancy import ACCESS_EVENTS, area_key, direction_of
+from .time_utils import now_cst, ensure_cst
+
+#
+# Asistencia (primera entrada / última salida / tiempo de presencia por usuario y día)
+# - fold() pliega los eventos de acceso nuevos (Evento.id > cursor "attendance") sobre la tabla
+#   attendance_days; cada lote y el avance del cursor van en una sola transacción.
+# - Solo cuentan los lectores de entrada: ATTENDANCE_AREAS lista las áreas del perímetro (misma
+#   clave de área que app/occupancy.py: context.area o el lector). Ahí, dirección =
+#   context.direction ("in"/"out") y sin dirección las lecturas alternan entrada/salida.
+#   Sin ATTENDANCE_AREAS solo cuentan las lecturas con dirección explícita: alternar con las
+#   puertas interiores falsearía la presencia.
+# - Hora de cada lectura: la del evento, salvo en las sincronizadas por lote desde un lector
+#   offline (context.batch_sync), donde vale context.timestamp (hora real del escaneo) si se puede
+#   leer y no es posterior al registro. Dentro de un lote se aplican en orden de esa hora.
+# - Los intervalos que cruzan medianoche se reparten entre ambos días.
+# - Una entrada sin salida más larga que ATTENDANCE_MAX_OPEN_HOURS se descarta (missing_out)
+#   y la siguiente lectura cuenta como entrada nueva.
+# - Los reportes leen solo attendance_days (no la bitácora), por lo que un mes completo de
+#   miles de usuarios es una consulta por rango sobre el índice de día.
+#
+
+CURSOR_NAME = "attendance"
+BATCH = 5000
+
+DAY_COLUMNS = ["uid", "nombre", "apellido", "day", "first_in", "last_out",
+               "presence_sec", "presence_hhmm", "events", "inside_now", "missing_out"]
+SUMMARY_COLUMNS = ["uid", "nombre", "apellido", "days_present", "presence_sec", "presence_hhmm",
+                   "first_in", "last_out", "events", "missing_out"]
+
+_fold_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def _day_key(ts: datetime.datetime) -> str:
+    return ts.date().isoformat()
+
+
+def _event_ts(ts, ctx: dict) -> Optional[datetime.datetime]:
+    logged = ensure_cst(ts)
+    if ctx.get("batch_sync"):
+        raw = ctx.get("timestamp")
+        scanned = ensure_cst(raw) if isinstance(raw, str) else None
+        if scanned is not None and (logged is None or scanned <= logged):
+            return scanned
+    return logged
+
+
+def _hhmm(seconds: int) -> str:
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600}:{(seconds % 3600) // 60:02d}"
+
+
+class _Batch:
+    """Filas de attendance_days tocadas por un lote (caché por (uid, día) + intervalos abiertos)."""
+
+    def __init__(self, db, uids, days):
+        self.db = db
+        self.rows: Dict[Tuple[str, str], AttendanceDay] = {}
+        self.open: Dict[str, AttendanceDay] = {}
+        if not uids:
+            return
+        for r in (db.query(AttendanceDay)
+                  .filter(AttendanceDay.uid.in_(uids), AttendanceDay.day.in_(days)).all()):
+            self.rows[(r.uid, r.day)] = r
+        for r in (db.query(AttendanceDay)
+                  .filter(AttendanceDay.uid.in_(uids), AttendanceDay.open_since != None).all()):  # noqa: E711
+            self.rows[(r.uid, r.day)] = r
+            self.open[r.uid] = r
+
+    def day(self, uid: str, day: str) -> AttendanceDay:
+        r = self.rows.get((uid, day))
+        if r is None:
+            r = self.db.get(AttendanceDay, (uid, day))
+            if r is None:
+                r = AttendanceDay(uid=uid, day=day, presence_sec=0, events=0, missing_out=0)
+                self.db.add(r)
+            self.rows[(uid, day)] = r
+        return r
+
+    def credit(self, uid: str, start: datetime.datetime, end: datetime.datetime) -> None:
+        """Suma [start, end) a la presencia, repartida por día natural."""
+        while start < end:
+            midnight = datetime.datetime.combine(start.date() + datetime.timedelta(days=1),
+                                                 datetime.time(), tzinfo=start.tzinfo)
+            chunk_end = min(end, midnight)
+            r = self.day(uid, _day_key(start))
+            r.presence_sec = (r.presence_sec or 0) + int((chunk_end - start).total_seconds())
+            start = chunk_end
+
+    def apply(self, ev_id: int, uid: str, ts: datetime.datetime, direction: Optional[str]) -> None:
+        today = self.day(uid, _day_key(ts))
+        today.events = (today.events or 0) + 1
+        today.last_event_id = max(today.last_event_id or 0, ev_id)
+        max_open = datetime.timedelta(hours=cfg.ATTENDANCE_MAX_OPEN_HOURS)
+
+        opened = self.open.get(uid)
+        since = ensure_cst(opened.open_since) if opened is not None else None
+        if since is not None and ts - since > max_open:
+            # Entrada olvidada: no se acredita y no altera la paridad de las lecturas siguientes
+            opened.missing_out = (opened.missing_out or 0) + 1
+            opened.open_since = None
+            del self.open[uid]
+            opened = since = None
+
+        is_in = direction == "in" if direction else opened is None
+        if is_in:
+            first = ensure_cst(today.first_in)
+            if first is None or ts < first:
+                today.first_in = ts
+            if opened is None:
+                today.open_since = ts
+                self.open[uid] = today
+            return
+
+        if opened is not None:
+            if ts > since:
+                self.credit(uid, since, ts)
+            opened.open_since = None
+            del self.open[uid]
+        last = ensure_cst(today.last_out)
+        if last is None or ts > last:
+            today.last_out = ts
+
+
+def fold(max_batches: Optional[int] = None) -> int:
+    """Pliega los eventos nuevos en attendance_days. Devuelve cuántos eventos procesó."""
+    total = 0
+    with _fold_lock:
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            n = _fold_batch()
+            if n < 0:
+                break
+            total += n
+            batches += 1
+    return total
+
+
+def _fold_batch() -> int:
+    """Un lote: eventos aplicados (>= 0) o -1 si no hubo avance."""
+    db = standalone_session()
+    try:
+        cur = db.get(ProcessingCursor, CURSOR_NAME)
+        start = cur.last_id if cur else 0
+        max_id = db.query(func.max(Evento.id)).scalar() or 0
+        if max_id < start:
+            # IDs reiniciados (wipe-db): la bitácora nueva empieza de cero
+            start = 0
+        if max_id == start:
+            return -1
+        upper = min(max_id, start + BATCH * 10)
+        events = (db.query(Evento.id, Evento.ts, Evento.actor_uid, Evento.source, Evento.context)
+                  .filter(Evento.id > start, Evento.id <= upper, Evento.event.in_(ACCESS_EVENTS))
+                  .order_by(Evento.id.asc()).limit(BATCH).all())
+        if len(events) == BATCH:
+            upper = events[-1].id
+        entry_areas = set(cfg.ATTENDANCE_AREAS)
+        parsed = []
+        for ev_id, ts, uid, source, ctx in events:
+            ctx = ctx or {}
+            ts = _event_ts(ts, ctx)
+            if not uid or ts is None:
+                continue
+            direction = direction_of(ctx)
+            if entry_areas:
+                if area_key(ctx.get("area"), source) not in entry_areas:
+                    continue
+            elif direction is None:
+                continue
+            parsed.append((ev_id, uid, ts, direction))
+        parsed.sort(key=lambda p: (p[2], p[0]))
+        batch = _Batch(db, {p[1] for p in parsed}, {_day_key(p[2]) for p in parsed})
+        for ev_id, uid, ts, direction in parsed:
+            batch.apply(ev_id, uid, ts, direction)
+
+        # Avance optimista del cursor: si otro proceso ya plegó este rango, se descarta el lote
+        if cur is None:
+            db.add(ProcessingCursor(name=CURSOR_NAME, last_id=upper))
+        else:
+            moved = (db.query(ProcessingCursor)
+                     .filter(ProcessingCursor.name == CURSOR_NAME, ProcessingCursor.last_id == cur.last_id)
+                     .update({"last_id": upper, "updated_at": now_cst()}, synchronize_session=False))
+            if not moved:
+                db.rollback()
+                return -1
+        db.commit()
+        return len(parsed)
+    except Exception as e:
+        db.rollback()
+        print("[attendance] fold failed:", e)
+        return -1
+    finally:
+        db.close()
+
+
+def rebuild() -> int:
+    """Recalcula la tabla completa desde la bitácora (p. ej. tras cambiar ATTENDANCE_MAX_OPEN_HOURS)."""
+    with _fold_lock:
+        db = standalone_session()
+        try:
+            db.query(AttendanceDay).delete(synchronize_session=False)
+            db.query(ProcessingCursor).filter(ProcessingCursor.name == CURSOR_NAME).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+    return fold()
+
+
+# ---------------------------
+# Reportes
+# ---------------------------
+def parse_range(date_from: Optional[str], date_to: Optional[str]) -> Tuple[str, str]:
+    """Valida YYYY-MM-DD; por defecto, del día 1 del mes actual a hoy. Lanza ValueError."""
+    today = now_cst().date()
+    d_from = datetime.date.fromisoformat(date_from) if date_from else today.replace(day=1)
+    d_to = datetime.date.fromisoformat(date_to) if date_to else today
+    if d_to < d_from:
+        raise ValueError("'to' must not be before 'from'")
+    return d_from.isoformat(), d_to.isoformat()
+
+
+def _iso(dt) -> Optional[str]:
+    dt = ensure_cst(dt)
+    return dt.isoformat() if dt else None
+
+
+def day_rows(db, date_from: str, date_to: str, uid: Optional[str] = None) -> Iterator[dict]:
+    q = (db.query(AttendanceDay, Usuario.nombre, Usuario.apellido)
+         .outerjoin(Usuario, Usuario.uid == AttendanceDay.uid)
+         .filter(AttendanceDay.day >= date_from, AttendanceDay.day <= date_to))
+    if uid:
+        q = q.filter(AttendanceDay.uid == uid)
+    for r, nombre, apellido in q.order_by(AttendanceDay.uid, AttendanceDay.day).yield_per(1000):
+        yield {"uid": r.uid, "nombre": nombre or "", "apellido": apellido or "", "day": r.day,
+               "first_in": _iso(r.first_in), "last_out": _iso(r.last_out),
+               "presence_sec": r.presence_sec or 0, "presence_hhmm": _hhmm(r.presence_sec),
+               "events": r.events or 0, "inside_now": r.open_since is not None,
+               "missing_out": r.missing_out or 0}
+
+
+def summary_rows(db, date_from: str, date_to: str, uid: Optional[str] = None) -> Iterator[dict]:
+    q = (db.query(AttendanceDay.uid, Usuario.nombre, Usuario.apellido,
+                  func.count(AttendanceDay.day), func.sum(AttendanceDay.presence_sec),
+                  func.min(AttendanceDay.first_in), func.max(AttendanceDay.last_out),
+                  func.sum(AttendanceDay.events), func.sum(AttendanceDay.missing_out))
+         .outerjoin(Usuario, Usuario.uid == AttendanceDay.uid)
+         .filter(AttendanceDay.day >= date_from, AttendanceDay.day <= date_to))
+    if uid:
+        q = q.filter(AttendanceDay.uid == uid)
+    q = q.group_by(AttendanceDay.uid, Usuario.nombre, Usuario.apellido).order_by(AttendanceDay.uid)
+    for u, nombre, apellido, days, secs, first, last, events, missing in q:
+        yield {"uid": u, "nombre": nombre or "", "apellido": apellido or "", "days_present": days,
+               "presence_sec": int(secs or 0), "presence_hhmm": _hhmm(secs),
+               "first_in": _iso(first), "last_out": _iso(last),
+               "events": int(events or 0), "missing_out": int(missing or 0)}
+
+
+def to_csv(rows: Iterable[dict], columns) -> Iterator[str]:
+    """Genera el CSV por trozos (cabecera + una línea por fila) para respuestas en streaming."""
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+    w.writeheader()
+    for row in rows:
+        w.writerow(row)
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0); buf.truncate()
+    yield buf.getvalue()
+
+
+# ---------------------------
+# Job en segundo plano
+# ---------------------------
+def _loop() -> None:
+    while True:
+        time.sleep(max(1, cfg.ATTENDANCE_FOLD_SEC))
+        try:
+            fold()
+        except Exception as e:
+            print("[attendance] fold failed:", e)
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or not cfg.ATTENDANCE_ENABLED:
+        return
+    _thread = threading.Thread(target=_loop, name="attendance-fold", daemon=True)
+    _thread.start()
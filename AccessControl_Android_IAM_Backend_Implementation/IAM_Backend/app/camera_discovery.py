@@ -0,0 +1,208 @@
+import ipaddress
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from .config import cfg
+from .db import standalone_session
+from .models import CameraDevice
+from .time_utils import now_cst
+
+#
+# Descubrimiento de cámaras en red como job en segundo plano
+# - Cada host del CIDR se sondea en un pool de hilos acotado (CAMERA_SCAN_WORKERS):
+#   primero un connect TCP por puerto (barato, descarta hosts apagados en ~timeout) y solo si
+#   el puerto está abierto se prueban las rutas HTTP (MJPEG/JPEG).
+# - Varias combinaciones puerto × ruta por host.
+# - Reescaneos incrementales: la caché es por (host, puerto) y recuerda las rutas probadas. Un
+#   puerto sondeado hace menos de CAMERA_SCAN_RESCAN_SEC con las mismas rutas se omite (se reutiliza
+#   su resultado) salvo full=True; puertos o rutas nuevos sí se sondean.
+# - Progreso consultable por job_id; los hallazgos se guardan en devices_cameras en una sola
+#   transacción al terminar (alta de URLs nuevas, last_seen en las existentes).
+#
+
+MAX_JOBS = 20
+MAX_HOSTS = 65536
+
+_jobs: "OrderedDict[str, dict]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_probed: Dict[Tuple[str, int], tuple] = {}   # (ip, puerto) -> (monotonic ts, rutas, hallazgo o None)
+_probed_lock = threading.Lock()
+
+
+def _port_open(ip: str, port: int, timeout: float) -> bool:
+    try:
+        with socket.create_connection((ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _probe_http(requests, url: str, timeout: float) -> Optional[str]:
+    """Content-Type si la URL responde como stream/imagen de cámara, si no None."""
+    try:
+        r = requests.get(url, timeout=timeout, stream=True)
+        try:
+            ct = r.headers.get("Content-Type", "")
+            if r.status_code == 200 and ("multipart" in ct or "jpeg" in ct or "image" in ct):
+                return ct
+        finally:
+            r.close()
+    except Exception:
+        pass
+    return None
+
+
+def _probe_host(requests, ip: str, ports: List[int], paths: List[str]) -> List[dict]:
+    found = []
+    for port in ports:
+        if not _port_open(ip, port, cfg.CAMERA_SCAN_CONNECT_TIMEOUT):
+            continue
+        for path in paths:
+            url = f"http://{ip}:{port}{path}"
+            ct = _probe_http(requests, url, cfg.CAMERA_SCAN_HTTP_TIMEOUT)
+            if ct:
+                found.append({"ip": ip, "port": port, "path": path, "url": url, "content_type": ct})
+                break  # una ruta válida por puerto es suficiente
+    return found
+
+
+def _public(job: dict) -> dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def start_scan(cidr: str, ports: List[int], paths: List[str], save: bool = False, full: bool = False) -> dict:
+    """Valida parámetros, registra el job y lo lanza en segundo plano. Lanza ValueError."""
+    net = ipaddress.ip_network(cidr, strict=False)
+    if net.num_addresses > MAX_HOSTS:
+        raise ValueError(f"network too large (max {MAX_HOSTS} addresses)")
+    if not ports or any(not (0 < p < 65536) for p in ports):
+        raise ValueError("invalid port list")
+    paths = [p if p.startswith("/") else "/" + p for p in paths] or ["/"]
+
+    # Lazy import to avoid hard dependency at startup
+    import requests  # type: ignore
+
+    job_id = uuid.uuid4().hex[:12]
+    job = {"job_id": job_id, "status": "running", "cidr": str(net), "ports": ports, "paths": paths,
+           "save": save, "full": full, "total": None,
+           "done": 0, "skipped_recent": 0, "found": [], "saved": 0, "updated": 0, "error": None,
+           "started_at": now_cst().isoformat(), "finished_at": None, "elapsed_sec": None,
+           "_cancel": threading.Event()}
+    with _jobs_lock:
+        _jobs[job_id] = job
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+    threading.Thread(target=_run, args=(job, net, requests), name=f"camscan:{job_id}", daemon=True).start()
+    return _public(job)
+
+
+def _run(job: dict, net, requests) -> None:
+    t0 = time.monotonic()
+    try:
+        now = time.monotonic()
+        hosts = [str(ip) for ip in net.hosts()]
+        job["total"] = len(hosts)
+        paths = tuple(job["paths"])
+        todo = []
+        with _probed_lock:
+            for key in [k for k, v in _probed.items() if now - v[0] >= cfg.CAMERA_SCAN_RESCAN_SEC]:
+                del _probed[key]
+            for ip in hosts:
+                missing = []
+                for port in job["ports"]:
+                    prev = None if job["full"] else _probed.get((ip, port))
+                    if prev and prev[1] == paths:
+                        if prev[2]:
+                            job["found"].append(prev[2])
+                    else:
+                        missing.append(port)
+                if missing:
+                    todo.append((ip, missing))
+                else:
+                    job["skipped_recent"] += 1
+                    job["done"] += 1
+        with ThreadPoolExecutor(max_workers=max(1, cfg.CAMERA_SCAN_WORKERS)) as pool:
+            futures = {pool.submit(_probe_host, requests, ip, ports, job["paths"]): (ip, ports) for ip, ports in todo}
+            for fut in as_completed(futures):
+                ip, ports = futures[fut]
+                try:
+                    hits = fut.result()
+                except Exception:
+                    hits = []
+                by_port = {f["port"]: f for f in hits}
+                with _probed_lock:
+                    ts = time.monotonic()
+                    for port in ports:
+                        _probed[(ip, port)] = (ts, paths, by_port.get(port))
+                job["found"].extend(hits)
+                job["done"] += 1
+                if job["_cancel"].is_set():
+                    for f in futures:
+                        f.cancel()
+                    job["status"] = "cancelled"
+                    break
+        if job["save"] and job["found"]:
+            job["saved"], job["updated"] = _save(job["found"])
+        if job["status"] == "running":
+            job["status"] = "done"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["finished_at"] = now_cst().isoformat()
+        job["elapsed_sec"] = round(time.monotonic() - t0, 2)
+
+
+def _save(found: List[dict]):
+    """Alta de cámaras nuevas y last_seen de las existentes, en una sola transacción."""
+    db = standalone_session()
+    try:
+        urls = {f["url"]: f for f in found}
+        existing = db.query(CameraDevice).filter(CameraDevice.url.in_(list(urls))).all()
+        seen = now_cst()
+        for c in existing:
+            c.last_seen = seen
+        known = {c.url for c in existing}
+        new = [CameraDevice(name=f"Cam {f['ip']}", ip=f["ip"], url=u, last_seen=seen)
+               for u, f in urls.items() if u not in known]
+        db.add_all(new)
+        db.commit()
+        return len(new), len(existing)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return None
+    out = _public(job)
+    out["found"] = list(job["found"])
+    total = job["total"]
+    out["progress"] = round(job["done"] / total, 3) if total else (0.0 if total is None else 1.0)
+    return out
+
+
+def list_jobs() -> List[dict]:
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return [{k: v for k, v in _public(j).items() if k != "found"} | {"found_count": len(j["found"])}
+            for j in jobs]
+
+
+def cancel_job(job_id: str) -> bool:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return False
+    job["_cancel"].set()
+    return True
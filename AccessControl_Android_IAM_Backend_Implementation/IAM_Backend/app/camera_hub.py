@@ -0,0 +1,424 @@
+import math
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .config import cfg
+from .synthetic_camera import open_capture
+
+VARIANT_IDLE_SEC = 30.0   # variantes sin uso se descartan de la caché
+
+#
+# Hub de captura compartido por fuente de cámara
+# - Un hilo lector por URL (RTSP/HTTP/archivo/synthetic://) decodifica con OpenCV y deja el último frame
+#   en una ranura (frame + número de secuencia); los suscriptores MJPEG esperan el siguiente
+#   número con una Condition. Un cliente lento simplemente salta frames: nunca hay cola.
+# - El JPEG se codifica una sola vez por frame (perezoso, al primer suscriptor que lo pide)
+#   y se comparte entre todos los clientes.
+# - El hilo arranca con el primer suscriptor y se detiene CAMERA_IDLE_STOP_SEC después de que
+#   se vaya el último (evita reabrir el RTSP en cada recarga de página).
+# - Reconexión con backoff exponencial (hasta CAMERA_RECONNECT_MAX_SEC) si la fuente falla.
+# - Fuentes de archivo se leen a su fps nominal y se reabren al llegar al final.
+# - Variantes por cliente (fps máx., ancho, calidad JPEG): el reescalado + codificación se hace
+#   una vez por (frame, ancho, calidad) y se comparte entre clientes con la misma variante.
+#   Anchos y calidades se redondean (múltiplos de 16 / 5) para acotar el número de variantes.
+# - snapshot(): último JPEG de una fuente con ETag (época del hub + secuencia + variante).
+# - MosaicHub: compone varias fuentes en un lienzo NumPy preasignado (solo redibuja los
+#   mosaicos cuyo frame cambió) y se publica como una fuente más: un muro de 16 cámaras es
+#   una sola conexión y una sola codificación por frame compuesto.
+# - Registro acotado: los hubs sin suscriptores ni hilo durante CAMERA_HUB_EVICT_SEC se descartan
+#   (con su último frame). Los hubs "dinámicos" (mosaicos y /camera_synth, cuyas variantes elige el
+#   cliente) no pasan de CAMERA_MAX_DYNAMIC_HUBS: al llegar al tope get_hub/get_mosaic devuelven None.
+#
+
+
+class CaptureHub:
+    def __init__(self, url: str):
+        self.url = url
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._frame_ts = 0.0
+        # (ancho, calidad) -> [seq, bytes, último uso] del último frame codificado en esa variante
+        self._variants: Dict[Tuple[int, int], list] = {}
+        self._encode_lock = threading.Lock()
+        self._subscribers = 0
+        self._idle_since: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._connected = False
+        self._reconnects = 0
+        self._frames_read = 0
+        self._frames_encoded = 0
+        self._frames_dropped = 0
+        self._fps = 0.0
+        self._last_error: Optional[str] = None
+        self.epoch = int(time.time() * 1000)   # distingue secuencias entre reinicios (ETag)
+        self.dynamic = False                    # variante elegida por el cliente (cuenta para el tope)
+        self._created = time.monotonic()
+
+    # ---- suscripción ----
+    def subscribe(self) -> None:
+        with self._cond:
+            self._subscribers += 1
+            self._idle_since = None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"camhub:{self.url}", daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self._subscribers = max(0, self._subscribers - 1)
+            if self._subscribers == 0:
+                self._idle_since = time.monotonic()
+
+    def evictable(self, now: float) -> bool:
+        """Sin suscriptores ni lector desde hace CAMERA_HUB_EVICT_SEC."""
+        with self._cond:
+            if self._subscribers or self._thread is not None:
+                return False
+            since = self._idle_since if self._idle_since is not None else self._created
+            return now - since >= cfg.CAMERA_HUB_EVICT_SEC
+
+    def _should_stop(self) -> bool:
+        """Llamar con _cond tomado: True si no hay suscriptores desde hace CAMERA_IDLE_STOP_SEC."""
+        return (self._subscribers == 0 and self._idle_since is not None
+                and time.monotonic() - self._idle_since >= cfg.CAMERA_IDLE_STOP_SEC)
+
+    # ---- lectura ----
+    def wait_frame(self, last_seq: int, timeout: float = 1.0):
+        """Espera un frame con secuencia > last_seq. Devuelve (seq, frame) o None si vence el plazo."""
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait(timeout)
+            if self._seq <= last_seq or self._frame is None:
+                return None
+            return self._seq, self._frame
+
+    def latest(self):
+        """(seq, frame) del último frame publicado, sin esperar; None si aún no hay."""
+        with self._cond:
+            return (self._seq, self._frame) if self._frame is not None else None
+
+    def jpeg(self, seq: int, frame, width: int = 0, quality: Optional[int] = None) -> Optional[bytes]:
+        """JPEG del frame `seq` en la variante (ancho, calidad), codificado una sola vez por variante.
+
+        width=0 conserva la resolución nativa; nunca se amplía.
+        """
+        key = (width, quality or cfg.CAMERA_JPEG_QUALITY)
+        now = time.monotonic()
+        cached = self._variants.get(key)
+        if cached is not None and cached[0] >= seq:
+            cached[2] = now
+            return cached[1]
+        with self._encode_lock:
+            cached = self._variants.get(key)
+            if cached is not None and cached[0] >= seq:
+                cached[2] = now
+                return cached[1]
+            img = frame
+            if width and width < frame.shape[1]:
+                height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+                img = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), key[1]])
+            if not ok:
+                return None
+            data = buf.tobytes()
+            self._variants[key] = [seq, data, now]
+            self._frames_encoded += 1
+            for k in [k for k, v in self._variants.items() if now - v[2] > VARIANT_IDLE_SEC]:
+                del self._variants[k]
+            return data
+
+    def _note_dropped(self, n: int) -> None:
+        if n > 0:
+            self._frames_dropped += n
+
+    def _publish(self, frame) -> None:
+        with self._cond:
+            now = time.time()
+            if self._frame_ts and now > self._frame_ts:
+                # Media móvil exponencial de la tasa de frames de la fuente
+                inst = 1.0 / (now - self._frame_ts)
+                self._fps = 0.9 * self._fps + 0.1 * inst if self._fps else inst
+            self._frame = frame
+            self._seq += 1
+            self._frame_ts = now
+            self._frames_read += 1
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        backoff = 0.5
+        cap = None
+        try:
+            while True:
+                with self._cond:
+                    if self._should_stop():
+                        self._thread = None
+                        self._connected = False
+                        return
+                if cap is None:
+                    cap = open_capture(self.url)
+                    if not cap.isOpened():
+                        cap.release(); cap = None
+                        self._fail(f"open failed: {self.url}")
+                        self._idle_sleep(backoff)
+                        backoff = min(backoff * 2, cfg.CAMERA_RECONNECT_MAX_SEC)
+                        continue
+                    self._connected = True
+                    misses = 0
+                    # Archivos de video: se reproducen a su fps nominal (las cámaras en vivo ya marcan el ritmo)
+                    fps = cap.get(cv2.CAP_PROP_FPS) or 0
+                    interval = 1.0 / fps if fps > 0 and cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0 else 0.0
+                    next_at = time.monotonic()
+                ok, frame = cap.read()
+                if not ok:
+                    misses += 1
+                    if misses >= 25:
+                        # Fuente caída: liberar y reabrir con backoff
+                        cap.release(); cap = None
+                        self._fail("read failed")
+                        self._idle_sleep(backoff)
+                        backoff = min(backoff * 2, cfg.CAMERA_RECONNECT_MAX_SEC)
+                    else:
+                        time.sleep(0.04)
+                    continue
+                misses = 0
+                backoff = 0.5
+                self._publish(frame)
+                if interval:
+                    next_at += interval
+                    delay = next_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_at = time.monotonic()
+        finally:
+            if cap is not None:
+                cap.release()
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _idle_sleep(self, seconds: float) -> None:
+        """Espera de backoff interrumpible: termina antes si ya no quedan suscriptores."""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            with self._cond:
+                if self._should_stop():
+                    return
+            time.sleep(min(0.25, max(0.0, deadline - time.monotonic())))
+
+    def _fail(self, msg: str) -> None:
+        self._connected = False
+        self._reconnects += 1
+        self._last_error = msg
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"url": self.url, "running": self._thread is not None, "connected": self._connected,
+                    "subscribers": self._subscribers, "seq": self._seq, "fps": round(self._fps, 2),
+                    "frame_age_sec": round(time.time() - self._frame_ts, 3) if self._frame_ts else None,
+                    "frames_read": self._frames_read, "frames_encoded": self._frames_encoded,
+                    "frames_dropped": self._frames_dropped, "variants": sorted(self._variants),
+                    "reconnects": self._reconnects, "last_error": self._last_error}
+
+
+_hubs: Dict[str, CaptureHub] = {}
+_hubs_lock = threading.Lock()
+_evicted = 0
+
+
+def _evict_idle() -> None:
+    # Llamar con _hubs_lock tomado
+    global _evicted
+    now = time.monotonic()
+    for key in [k for k, h in _hubs.items() if h.evictable(now)]:
+        del _hubs[key]
+        _evicted += 1
+
+
+def _register(key: str, factory, dynamic: bool) -> Optional[CaptureHub]:
+    with _hubs_lock:
+        hub = _hubs.get(key)
+        if hub is not None:
+            return hub
+        _evict_idle()
+        if dynamic and sum(1 for h in _hubs.values() if h.dynamic) >= cfg.CAMERA_MAX_DYNAMIC_HUBS:
+            return None
+        hub = _hubs[key] = factory()
+        hub.dynamic = dynamic
+        return hub
+
+
+def get_hub(url: str, dynamic: bool = False) -> Optional[CaptureHub]:
+    """Hub único por URL de origen (la misma cámara desde CAM_URLS o BD comparte lector).
+
+    dynamic=True para fuentes que arma el cliente (/camera_synth): None si se alcanzó el tope.
+    """
+    return _register(url, lambda: CaptureHub(url), dynamic)
+
+
+class MosaicHub(CaptureHub):
+    """Fuente compuesta: mosaico de `sources` [(nombre, url)] en `cols` columnas y `width` px."""
+
+    def __init__(self, key: str, sources: List[Tuple[str, str]], cols: int, width: int):
+        super().__init__(key)
+        self.sources = sources
+        self.cols = max(1, cols)
+        self.rows = max(1, math.ceil(len(sources) / self.cols))
+        self.tile_w = max(16, width // self.cols)
+        self.tile_h = self.tile_w * 9 // 16
+
+    def _draw_tile(self, canvas, i: int, frame, label: str) -> None:
+        x, y = (i % self.cols) * self.tile_w, (i // self.cols) * self.tile_h
+        tile = canvas[y:y + self.tile_h, x:x + self.tile_w]
+        tile[:] = 0
+        if frame is not None:
+            # Ajuste con proporción conservada (letterbox) dentro del mosaico
+            h, w = frame.shape[:2]
+            scale = min(self.tile_w / w, self.tile_h / h)
+            nw, nh = max(1, int(w * scale)), max(1, int(h * scale))
+            ox, oy = (self.tile_w - nw) // 2, (self.tile_h - nh) // 2
+            tile[oy:oy + nh, ox:ox + nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_AREA)
+        else:
+            cv2.putText(tile, "NO SIGNAL", (8, self.tile_h // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5, (255, 255, 255), 1, cv2.LINE_AA)
+        cv2.putText(tile, label, (6, 16), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1, cv2.LINE_AA)
+
+    def _run(self) -> None:
+        hubs = [get_hub(url) for _, url in self.sources]
+        for h in hubs:
+            h.subscribe()
+        try:
+            canvas = np.zeros((self.rows * self.tile_h, self.cols * self.tile_w, 3), np.uint8)
+            for i, (name, _) in enumerate(self.sources):
+                self._draw_tile(canvas, i, None, name)
+            seqs = [0] * len(hubs)
+            self._connected = True
+            self._publish(canvas.copy())
+            interval = 1.0 / max(0.5, cfg.CAMERA_MOSAIC_FPS)
+            while True:
+                with self._cond:
+                    if self._should_stop():
+                        self._thread = None
+                        self._connected = False
+                        return
+                changed = False
+                for i, h in enumerate(hubs):
+                    got = h.latest()
+                    if got is not None and got[0] != seqs[i]:
+                        seqs[i] = got[0]
+                        self._draw_tile(canvas, i, got[1], self.sources[i][0])
+                        changed = True
+                if changed:
+                    # Copia para los suscriptores (codifican en diferido) mientras se sigue dibujando
+                    self._publish(canvas.copy())
+                time.sleep(interval)
+        finally:
+            for h in hubs:
+                h.unsubscribe()
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+
+def get_mosaic(sources: List[Tuple[str, str]], cols: Optional[int] = None,
+               width: Optional[int] = None) -> Optional[MosaicHub]:
+    """Mosaico compartido por composición (mismas fuentes, columnas y ancho → mismo hub).
+
+    Columnas acotadas al número de fuentes y ancho redondeado a múltiplos de 128 para limitar
+    las variantes. None si ya hay CAMERA_MAX_DYNAMIC_HUBS hubs dinámicos.
+    """
+    cols = min(max(1, cols or math.ceil(math.sqrt(max(1, len(sources))))), max(1, len(sources)))
+    width = min(max(256, width or cfg.CAMERA_MOSAIC_WIDTH), cfg.CAMERA_MAX_WIDTH) // 128 * 128
+    key = "mosaic:" + "|".join(url for _, url in sources) + f"#{cols}x{width}"
+    return _register(key, lambda: MosaicHub(key, sources, cols, width), True)
+
+
+def snapshot(hub: CaptureHub, width=None, quality=None, timeout: float = 3.0) -> Optional[Tuple[str, bytes]]:
+    """(etag, jpeg) del último frame de `hub`; arranca el lector si hace falta y espera hasta `timeout`.
+
+    El lector queda vivo CAMERA_IDLE_STOP_SEC, así que un sondeo periódico no reabre la fuente.
+    """
+    _, width, quality = variant(None, width, quality)
+    hub.subscribe()
+    try:
+        got = hub.latest()
+        deadline = time.monotonic() + timeout
+        while got is None and time.monotonic() < deadline:
+            got = hub.wait_frame(0, timeout=max(0.05, deadline - time.monotonic()))
+        if got is None:
+            return None
+        seq, frame = got
+        data = hub.jpeg(seq, frame, width, quality)
+        if data is None:
+            return None
+        return f'"{hub.epoch:x}-{seq}-{width}x{quality}"', data
+    finally:
+        hub.unsubscribe()
+
+
+def peek_hub(url: str) -> Optional[CaptureHub]:
+    """Hub existente para `url` (sin crearlo)."""
+    with _hubs_lock:
+        return _hubs.get(url)
+
+
+def variant(fps=None, width=None, quality=None) -> Tuple[float, int, int]:
+    """Normaliza los parámetros del cliente a (fps, ancho, calidad) dentro de los límites del servidor."""
+    def num(v, default, cast):
+        try:
+            return cast(v) if v not in (None, "") else default
+        except (TypeError, ValueError):
+            return default
+    fps = min(max(num(fps, cfg.CAMERA_DEFAULT_FPS, float), 0.2), cfg.CAMERA_MAX_FPS)
+    width = max(0, num(width, cfg.CAMERA_DEFAULT_WIDTH, int))
+    if width:
+        width = max(64, min(width, cfg.CAMERA_MAX_WIDTH) // 16 * 16)
+    quality = num(quality, cfg.CAMERA_JPEG_QUALITY, int)
+    quality = min(max(quality, 20), 95) // 5 * 5
+    return fps, width, quality
+
+
+def mjpeg_stream(source, fps=None, width=None, quality=None) -> Iterator[bytes]:
+    """Generador multipart/x-mixed-replace alimentado por el hub compartido de `source` (URL o hub).
+
+    Cada cliente recibe como máximo `fps` frames/s; si su socket va lento, al volver del
+    envío toma el frame más reciente y los intermedios se descartan. frames_dropped cuenta
+    los frames que un cliente no llegó a recibir (por límite de fps o por socket lento).
+    """
+    fps, width, quality = variant(fps, width, quality)
+    interval = 1.0 / fps
+    hub = source if isinstance(source, CaptureHub) else get_hub(source)
+    hub.subscribe()
+    try:
+        seq = 0
+        next_at = 0.0
+        while True:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            got = hub.wait_frame(seq, timeout=1.0)
+            if got is None:
+                continue
+            last, (seq, frame) = seq, got
+            if last:
+                hub._note_dropped(seq - last - 1)
+            jpg = hub.jpeg(seq, frame, width, quality)
+            if jpg is None:
+                continue
+            next_at = time.monotonic() + interval
+            yield (b"--frame\r\n"
+                   b"Content-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n")
+    finally:
+        hub.unsubscribe()
+
+
+def stats() -> list:
+    with _hubs_lock:
+        _evict_idle()
+        hubs = list(_hubs.values())
+    return [h.stats() for h in hubs]
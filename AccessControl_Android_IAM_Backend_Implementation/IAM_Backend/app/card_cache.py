@@ -0,0 +1,148 @@
+import io
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from .config import cfg
+
+#
+# Tarjetas QR bajo demanda (/api/qr/card/<uid>)
+# - En BD solo está el hash del valor: la fuente es el PNG maestro que se escribe al asignar/rotar
+#   (<cards>/<uid>_QR.png), etiquetado con la versión de la tarjeta (qr.card_version del hash).
+#   Solo se sirve un maestro cuya etiqueta coincide con la versión actual: uno de un QR ya rotado o
+#   sin etiqueta (PNG anterior a las etiquetas, no verificable) responde 409 hasta reasignar el QR.
+# - Cada tamaño pedido se deriva del maestro una vez y sus bytes se guardan en una LRU en memoria
+#   acotada por QR_IMAGE_CACHE_MB y, si QR_IMAGE_CACHE_DIR está definido, en disco
+#   (<dir>/<uid>/<versión>_<tamaño>.png, compartido entre procesos y reinicios).
+# - La clave incluye la versión: tras una rotación nada viejo puede servirse aunque la rotación
+#   ocurra en otro proceso (CLI). invalidate(uid) además libera en el acto lo del usuario; lo llaman
+#   /api/qr/assign, /api/qr/revoke, assign_qr_to_user y assign-qr-bulk.
+# - ETag fuerte "<versión>-<tamaño>": el navegador revalida y recibe 304 sin tocar la imagen.
+#
+
+_lock = threading.Lock()
+_lru: "OrderedDict[Tuple[str, str, int], bytes]" = OrderedDict()
+_bytes = 0
+_stats = {"hits": 0, "disk_hits": 0, "renders": 0, "evictions": 0, "invalidations": 0}
+
+
+class CardUnavailable(Exception):
+    """No hay imagen vigente de la tarjeta (falta el PNG maestro o es de un QR anterior)."""
+
+
+def etag(version: str, size: int) -> str:
+    return f"{version}-{int(size)}"
+
+
+def _safe(uid: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", uid)
+
+
+def master_path(uid: str, outdir: str = "cards") -> str:
+    from .user_qr import resolve_outdir
+    return os.path.join(resolve_outdir(outdir), f"{uid}_QR.png")
+
+
+def master_version(path: str) -> Optional[str]:
+    """Versión con la que se etiquetó el PNG maestro (None si no tiene etiqueta o no se puede leer)."""
+    try:
+        with Image.open(path) as img:
+            return getattr(img, "text", {}).get("card_version")
+    except (OSError, ValueError):
+        return None
+
+
+def _render(uid: str, version: str, size: int, outdir: str) -> bytes:
+    path = master_path(uid, outdir)
+    if not os.path.isfile(path):
+        raise CardUnavailable("card image missing; reassign the QR")
+    with Image.open(path) as img:
+        tagged = getattr(img, "text", {}).get("card_version")
+        if not tagged:
+            raise CardUnavailable("card image is untagged and cannot be verified; reassign the QR")
+        if tagged != version:
+            raise CardUnavailable("card image belongs to a rotated QR; reassign the QR")
+        if img.size == (size, size):
+            with open(path, "rb") as f:
+                return f.read()
+        img = img.convert("RGB")
+        # Ampliar con vecino más cercano mantiene nítidos los módulos; reducir con Lanczos
+        out = img.resize((size, size), Image.NEAREST if size >= img.width else Image.LANCZOS)
+    buf = io.BytesIO()
+    out.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _disk_path(uid: str, version: str, size: int) -> Optional[str]:
+    if not cfg.QR_IMAGE_CACHE_DIR:
+        return None
+    return os.path.join(cfg.QR_IMAGE_CACHE_DIR, _safe(uid), f"{version}_{int(size)}.png")
+
+
+def _store(key, data: bytes) -> None:
+    global _bytes
+    limit = max(0, cfg.QR_IMAGE_CACHE_MB) * 1024 * 1024
+    with _lock:
+        if key in _lru or len(data) > limit:
+            return
+        _lru[key] = data
+        _bytes += len(data)
+        while _bytes > limit and _lru:
+            _, old = _lru.popitem(last=False)
+            _bytes -= len(old)
+            _stats["evictions"] += 1
+
+
+def get_card_png(uid: str, version: str, size: int, outdir: str = "cards") -> bytes:
+    """PNG de la tarjeta de `uid` en la versión `version` y lado `size` (memoria → disco → maestro).
+    Lanza CardUnavailable si no hay imagen vigente."""
+    key = (uid, version, int(size))
+    with _lock:
+        data = _lru.get(key)
+        if data is not None:
+            _lru.move_to_end(key)
+            _stats["hits"] += 1
+            return data
+    disk = _disk_path(uid, version, size)
+    if disk and os.path.isfile(disk):
+        with open(disk, "rb") as f:
+            data = f.read()
+        with _lock:
+            _stats["disk_hits"] += 1
+    else:
+        data = _render(uid, version, int(size), outdir)
+        with _lock:
+            _stats["renders"] += 1
+        if disk:
+            try:
+                os.makedirs(os.path.dirname(disk), exist_ok=True)
+                tmp = f"{disk}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, disk)
+            except OSError as e:
+                print("[card_cache] disk write failed:", e)
+    _store(key, data)
+    return data
+
+
+def invalidate(uid: str) -> None:
+    """Descarta todo lo cacheado de `uid` (memoria y disco) tras rotar o revocar su QR."""
+    global _bytes
+    with _lock:
+        for key in [k for k in _lru if k[0] == uid]:
+            _bytes -= len(_lru.pop(key))
+        _stats["invalidations"] += 1
+    if cfg.QR_IMAGE_CACHE_DIR:
+        shutil.rmtree(os.path.join(cfg.QR_IMAGE_CACHE_DIR, _safe(uid)), ignore_errors=True)
+
+
+def stats() -> dict:
+    with _lock:
+        return {"entries": len(_lru), "bytes": _bytes, "limit_bytes": max(0, cfg.QR_IMAGE_CACHE_MB) * 1024 * 1024,
+                "disk_dir": cfg.QR_IMAGE_CACHE_DIR or None, **_stats}
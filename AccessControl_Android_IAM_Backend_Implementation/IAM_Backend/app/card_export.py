@@ -0,0 +1,237 @@
+import io
+import os
+import zipfile
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .card_cache import master_version
+from .config import cfg
+from .models import Usuario
+from .qr import card_version
+
+#
+# Exportación de tarjetas QR para imprimir (CLI export-cards y GET/POST /api/admin/cards/export)
+# - En BD solo está el hash del valor QR: se exportan los PNG ya emitidos (<cards>/<uid>_QR.png);
+#   los usuarios seleccionados sin PNG vigente (falta, sin etiqueta o de un QR ya rotado, ver
+#   app/card_cache.py) se informan como faltantes (reemitir con assign-qr). Los QR revocados no
+#   se exportan.
+# - Formatos, todos generados al consumir el stream (memoria constante aunque sean miles):
+#     · zip: los PNG tal cual (sin recomprimir), leídos por bloques.
+#     · pdf: hojas N-up (cols × rows por página, con uid/nombre y guías de corte); cada página se
+#       compone, se escribe y se libera antes de pasar a la siguiente (PDF mínimo propio; el de
+#       Pillow necesita todas las páginas de antemano).
+#     · png: las mismas hojas como PNG sueltos dentro de un ZIP.
+# - Página, rejilla y resolución por defecto: CARD_SHEET_PAGE / _COLS / _ROWS / _DPI.
+#
+
+FORMATS = ("zip", "pdf", "png")
+PAGES = {"a4": (595.28, 841.89), "letter": (612.0, 792.0), "a3": (841.89, 1190.55)}   # puntos (1/72")
+MIME = {"zip": "application/zip", "pdf": "application/pdf", "png": "application/zip"}
+_CHUNK = 64 * 1024
+
+
+class Layout:
+    """Rejilla de una hoja: página (pt), columnas, filas y resolución en píxeles."""
+
+    def __init__(self, page: Optional[str] = None, cols=None, rows=None, dpi=None):
+        page = (page or cfg.CARD_SHEET_PAGE).lower()
+        if page not in PAGES:
+            raise ValueError(f"page must be one of {', '.join(PAGES)}")
+        try:
+            self.cols = int(cols or cfg.CARD_SHEET_COLS)
+            self.rows = int(rows or cfg.CARD_SHEET_ROWS)
+            self.dpi = int(dpi or cfg.CARD_SHEET_DPI)
+        except (TypeError, ValueError):
+            raise ValueError("cols, rows and dpi must be integers")
+        if not (1 <= self.cols <= 10 and 1 <= self.rows <= 10):
+            raise ValueError("cols and rows must be between 1 and 10")
+        if not 72 <= self.dpi <= 600:
+            raise ValueError("dpi must be between 72 and 600")
+        self.page = page
+        self.size_pt = PAGES[page]
+        self.size_px = tuple(int(round(v / 72.0 * self.dpi)) for v in self.size_pt)
+
+    @property
+    def per_page(self) -> int:
+        return self.cols * self.rows
+
+
+def select_cards(db, uids: Optional[List[str]] = None, role: Optional[str] = None,
+                 estado: Optional[str] = None, outdir: str = "cards") -> Tuple[List[dict], List[str]]:
+    """Usuarios con QR vigente según el filtro → ([{uid, nombre, path}], [uid sin PNG vigente])."""
+    from .user_qr import resolve_outdir
+    base = resolve_outdir(outdir)
+    q = (db.query(Usuario.uid, Usuario.nombre, Usuario.apellido, Usuario.qr_value_hash)
+         .filter(Usuario.qr_value_hash.isnot(None),
+                 (Usuario.qr_status != "revoked") | Usuario.qr_status.is_(None)))
+    if uids:
+        q = q.filter(Usuario.uid.in_(list(uids)))
+    if role:
+        q = q.filter(Usuario.rol == role)
+    if estado:
+        q = q.filter(Usuario.estado == estado)
+    entries, missing = [], []
+    for uid, nombre, apellido, qr_hash in q.order_by(Usuario.uid).all():
+        path = os.path.join(base, f"{uid}_QR.png")
+        if os.path.isfile(path) and master_version(path) == card_version(qr_hash):
+            entries.append({"uid": uid, "nombre": " ".join(p for p in (nombre, apellido) if p), "path": path})
+        else:
+            missing.append(uid)
+    if uids:
+        found = {e["uid"] for e in entries} | set(missing)
+        missing.extend(u for u in uids if u not in found)   # uid inexistente, sin QR o revocado
+    return entries, missing
+
+
+class _Sink:
+    """Destino sin seek para zipfile: acumula lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data) -> int:
+        self.buf += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        out = bytes(self.buf)
+        self.buf.clear()
+        return out
+
+
+def _zip_stream(files: Iterable[Tuple[str, object]]) -> Iterator[bytes]:
+    """ZIP en streaming (descriptores de datos, sin seek). files: (nombre, ruta | bytes)."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:   # PNG ya va comprimido
+        for name, src in files:
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED
+            if isinstance(src, (bytes, bytearray)):
+                info.file_size = len(src)
+                with zf.open(info, "w") as w:
+                    w.write(src)
+            else:
+                info.file_size = os.path.getsize(src)
+                with zf.open(info, "w") as w, open(src, "rb") as f:
+                    while True:
+                        chunk = f.read(_CHUNK)
+                        if not chunk:
+                            break
+                        w.write(chunk)
+                        if len(sink.buf) >= _CHUNK:
+                            yield sink.take()
+            yield sink.take()
+    yield sink.take()   # directorio central
+
+
+def _font(px: int):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", px)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _sheets(entries: List[dict], layout: Layout) -> Iterator[Image.Image]:
+    """Hojas N-up (RGB) de una en una."""
+    W, H = layout.size_px
+    margin = int(layout.dpi * 10 / 25.4)   # 10 mm
+    cell_w = (W - 2 * margin) // layout.cols
+    cell_h = (H - 2 * margin) // layout.rows
+    text_px = max(10, int(layout.dpi * 0.11))   # ~8 pt
+    font = _font(text_px)
+    caption_h = int(text_px * 2.6)
+    side = max(16, min(cell_w, cell_h - caption_h) - 2 * (layout.dpi // 25))
+    for start in range(0, len(entries), layout.per_page):
+        page = Image.new("RGB", (W, H), "white")
+        draw = ImageDraw.Draw(page)
+        for i, e in enumerate(entries[start:start + layout.per_page]):
+            x0 = margin + (i % layout.cols) * cell_w
+            y0 = margin + (i // layout.cols) * cell_h
+            draw.rectangle([x0, y0, x0 + cell_w - 1, y0 + cell_h - 1], outline=(210, 210, 210))   # guía de corte
+            with Image.open(e["path"]) as card:
+                card = card.convert("RGB")
+                # Ampliar con vecino más cercano mantiene nítidos los módulos del QR
+                resample = Image.NEAREST if card.width <= side else Image.LANCZOS
+                card = card.resize((side, side), resample)
+            cx = x0 + (cell_w - side) // 2
+            cy = y0 + (cell_h - caption_h - side) // 2
+            page.paste(card, (cx, cy))
+            for k, line in enumerate((e["uid"], e["nombre"])):
+                if not line:
+                    continue
+                tw = draw.textlength(line, font=font)
+                draw.text((x0 + (cell_w - tw) / 2, cy + side + k * int(text_px * 1.25)), line,
+                          fill=(20, 20, 20), font=font)
+        yield page
+
+
+def _pdf_stream(pages: Iterable[Image.Image], layout: Layout) -> Iterator[bytes]:
+    """PDF mínimo con una imagen a página completa por hoja; cada página sale al generarse.
+    Objetos: 1 catálogo, 2 árbol de páginas (al final, cuando ya se conocen las hojas), 3.. hojas."""
+    offsets = {}
+    pos = 0
+    kids = []
+
+    def emit(num: int, body: bytes, stream: Optional[bytes] = None) -> bytes:
+        nonlocal pos
+        offsets[num] = pos
+        out = b"%d 0 obj\n" % num + body
+        if stream is not None:
+            out += b"\nstream\n" + stream + b"\nendstream"
+        out += b"\nendobj\n"
+        pos += len(out)
+        return out
+
+    head = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    pos = len(head)
+    yield head
+    yield emit(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    w_pt, h_pt = layout.size_pt
+    num = 3
+    for img in pages:
+        data = zlib.compress(img.tobytes(), 6)
+        yield emit(num, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB "
+                        b"/BitsPerComponent 8 /Filter /FlateDecode /Length %d >>" % (img.width, img.height, len(data)),
+                   data)
+        content = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (w_pt, h_pt)
+        yield emit(num + 1, b"<< /Length %d >>" % len(content), content)
+        yield emit(num + 2, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                            b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                   % (w_pt, h_pt, num, num + 1))
+        kids.append(num + 2)
+        num += 3
+    yield emit(2, b"<< /Type /Pages /Kids [%s] /Count %d >>"
+               % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)))
+    xref = [b"xref\n0 %d\n" % num, b"0000000000 65535 f \n"]
+    xref += [b"%010d 00000 n \n" % offsets[i] for i in range(1, num)]
+    yield b"".join(xref) + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (num, pos)
+
+
+def _png_sheets(entries: List[dict], layout: Layout) -> Iterator[Tuple[str, bytes]]:
+    for n, page in enumerate(_sheets(entries, layout), start=1):
+        buf = io.BytesIO()
+        page.save(buf, format="PNG", dpi=(layout.dpi, layout.dpi))
+        yield f"sheet_{n:04d}.png", buf.getvalue()
+
+
+def export(entries: List[dict], fmt: str = "zip", layout: Optional[Layout] = None) -> Tuple[Iterator[bytes], str, str]:
+    """(generador de bytes, mimetype, nombre de archivo) para las tarjetas `entries`."""
+    fmt = (fmt or "zip").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    layout = layout or Layout()
+    if fmt == "zip":
+        stream = _zip_stream((os.path.basename(e["path"]), e["path"]) for e in entries)
+        name = "qr_cards.zip"
+    elif fmt == "pdf":
+        stream = _pdf_stream(_sheets(entries, layout), layout)
+        name = f"qr_cards_{layout.cols}x{layout.rows}_{layout.page}.pdf"
+    else:
+        stream = _zip_stream(_png_sheets(entries, layout))
+        name = f"qr_sheets_{layout.cols}x{layout.rows}_{layout.page}.zip"
+    return stream, MIME[fmt], name
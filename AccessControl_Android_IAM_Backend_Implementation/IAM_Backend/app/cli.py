@@ -2,7 +2,13 @@
 # - create-admin  → alta del usuario admin inicial
 # - create-user   → alta de usuarios por rol (R-ADM/R-MON/R-IM/R-AC/R-EMP/R-GRD/R-AUD)
 # - assign-qr     → emite/rota el valor de QR y exporta PNG del código (tema UPY)
-# - qr-from-value → genera PNG del QR a partir de un valor dado (sin tocar BD)
+# - qr-from-value → genera PNG (o SVG) del QR a partir de un valor dado (sin tocar BD)
+# - export-cards  → tarjetas QR emitidas para imprimir: ZIP de PNG u hojas N-up (PDF / PNG)
+# - attendance-report → CSV de asistencia por día o resumen por usuario (rango de fechas)
+# - bench-qr-decode → mide /api/qr/decode (app/qr_decode.py) sobre un corpus de fotos
+# - bench-qr-render → tiempo y bytes de la tarjeta QR en PNG frente a SVG
+# - maintenance   → archivado de eventos, retención de tablas y VACUUM incremental (app/maintenance.py)
+# - verify-events → verifica firmas y cadena de hashes de la bitácora (archivada + viva)
 
 import argparse
 import os
@@ -13,7 +19,7 @@ Base.metadata.create_all(bind=engine)
 
 from .models import Usuario
 from .auth import hash_password
-from .qr import gen_qr_value_b32, hash_qr_value, save_upy_qr_png
+from .qr import gen_qr_value_b32, hash_qr_value, save_upy_qr_png, save_upy_qr_svg
 from .logging_utils import sign_event_and_persist
 from .user_qr import assign_qr_to_user, resolve_outdir
 from .seed_demo import seed_demo
@@ -100,46 +106,293 @@ def assign_qr(uid, outdir="cards", size=600):
         print("assign_qr failed:", e)
 
 
-def assign_qr_bulk(missing_only=True, outdir="cards", size=600):
+def assign_qr_bulk(missing_only=True, outdir="cards", size=600, workers=None, batch=200, resume=False):
     """Asigna/rota QR para muchos usuarios.
 
     - missing_only=True: solo usuarios sin `qr_value_hash`.
     - missing_only=False: rota QR para todos los usuarios.
+
+    Valor + hash Argon2 + PNG se generan en un pool de procesos (`workers`, por defecto uno por
+    CPU); los hashes y eventos qr_assigned se guardan en transacciones de `batch` usuarios.
+    Cada lote confirmado se anota en <outdir>/.assign-qr-bulk.progress: si se interrumpe,
+    `resume=True` continúa con los pendientes. Los PNG se generan aparte (<uid>_QR.png.staged) y
+    solo reemplazan la tarjeta vigente cuando el lote con su hash se confirma; al empezar, los que
+    quedaron de una corrida interrumpida se mueven a su sitio o se descartan (settle_staged_qrs).
     """
+    import json
+    import time
+    import uuid
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from .user_qr import render_user_qr, commit_rendered_qrs, settle_staged_qrs
+
+    mode = "missing" if missing_only else "all"
     # Capturamos sólo los UID para evitar problemas de instancia detach/expire
     db = SessionLocal()
     try:
         q = db.query(Usuario.uid)
         if missing_only:
             q = q.filter((Usuario.qr_value_hash == None))  # noqa: E711
-        uids = [row[0] for row in q.all()]
+        uids = [row[0] for row in q.order_by(Usuario.uid).all()]
     finally:
         db.close()
 
-    if not uids:
+    moved, dropped = settle_staged_qrs(outdir)
+    if moved or dropped:
+        print(f"[assign-qr-bulk] Staged cards from a previous run: {moved} moved into place, {dropped} discarded.")
+    journal = os.path.join(resolve_outdir(outdir), ".assign-qr-bulk.progress")
+    done, run_id = set(), None
+    if os.path.exists(journal):
+        if resume:
+            with open(journal, encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                done = {line.strip() for line in f if line.strip()}
+            if header.get("mode") == mode:
+                run_id = header.get("run_id")
+            else:
+                print(f"[assign-qr-bulk] Progress file is for mode={header.get('mode')}; starting over.")
+                done = set()
+        else:
+            print("[assign-qr-bulk] Previous run was interrupted; starting over (use --resume to continue it).")
+    if run_id is None:
+        run_id = uuid.uuid4().hex[:12]
+        with open(journal, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"run_id": run_id, "mode": mode, "size": int(size)}) + "\n")
+
+    todo = [u for u in uids if u not in done]
+    if not todo:
         print("[assign-qr-bulk] No users matched condition.")
+        os.remove(journal)
         return
-    ok = 0; fail = 0
-    for uid in uids:
+    total = len(todo)
+    print(f"[assign-qr-bulk] {total} users (skipped {len(uids) - total} already done), run {run_id}")
+
+    ok = 0; fail = 0; pending = []
+    t0 = time.monotonic()
+
+    def flush(jf):
+        nonlocal ok, pending
+        if not pending:
+            return
+        saved = commit_rendered_qrs(pending, source="cli", extra={"bulk_run": run_id})
+        jf.write("".join(u + "\n" for u in saved))
+        jf.flush(); os.fsync(jf.fileno())
+        ok += len(saved)
+        pending = []
+        rate = ok / max(1e-6, time.monotonic() - t0)
+        eta = (total - ok - fail) / rate if rate else 0
+        print(f"[assign-qr-bulk] {ok + fail}/{total} ({100 * (ok + fail) // total}%) "
+              f"{rate:.1f} users/s, ETA {eta:.0f}s")
+
+    interrupted = False
+    pool = ProcessPoolExecutor(max_workers=workers or None)
+    with open(journal, "a", encoding="utf-8") as jf:
         try:
-            assign_qr_to_user(uid, outdir=outdir, size=int(size))
-            ok += 1
-        except Exception as e:
-            print(f"[assign-qr-bulk] Failed {uid}: {e}")
-            fail += 1
-    print(f"[assign-qr-bulk] Done. OK={ok} FAIL={fail}")
-
-
-def qr_from_value(qr_value, outdir=".", filename="QR_custom.png", size=600):
+            futures = {pool.submit(render_user_qr, uid, outdir, int(size)): uid for uid in todo}
+            for fut in as_completed(futures):
+                try:
+                    pending.append(fut.result())
+                except Exception as e:
+                    print(f"[assign-qr-bulk] Failed {futures[fut]}: {e}")
+                    fail += 1
+                if len(pending) >= max(1, int(batch)):
+                    flush(jf)
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            pool.shutdown(wait=not interrupted, cancel_futures=True)
+            flush(jf)   # lo ya generado se confirma también al interrumpir
+    if interrupted:
+        print(f"[assign-qr-bulk] Interrupted. OK={ok}; rerun with --resume to continue.")
+    elif fail:
+        print(f"[assign-qr-bulk] Done. OK={ok} FAIL={fail}; rerun with --resume to retry the failures.")
+    else:
+        os.remove(journal)
+        print(f"[assign-qr-bulk] Done. OK={ok} FAIL={fail} in {time.monotonic() - t0:.1f}s")
+
+
+def qr_from_value(qr_value, outdir=".", filename="QR_custom.png", size=600, fmt="png"):
     """
-    Exporta un PNG de SOLO el QR (tema UPY) a partir de un valor dado (no toca BD).
+    Exporta un PNG (o SVG con fmt="svg") de SOLO el QR (tema UPY) a partir de un valor dado (no toca BD).
     Útil si te pasaron el valor por otra vía.
     """
     os.makedirs(outdir, exist_ok=True)
     logo = resolve_logo()
+    if fmt == "svg" and filename.lower().endswith(".png"):
+        filename = filename[:-4] + ".svg"
     path = os.path.join(outdir, filename)
-    save_upy_qr_png(path, qr_value=qr_value, size=int(size), logo_path=logo)
-    print("Saved PNG:", path)
+    if fmt == "svg":
+        save_upy_qr_svg(path, qr_value=qr_value, size=int(size), logo_path=logo)
+        print("Saved SVG:", path)
+    else:
+        save_upy_qr_png(path, qr_value=qr_value, size=int(size), logo_path=logo)
+        print("Saved PNG:", path)
+
+
+def export_cards(fmt="zip", out=None, uids=None, role=None, estado=None, cards_dir="cards",
+                 page=None, cols=None, rows=None, dpi=None):
+    """Escribe las tarjetas seleccionadas (ZIP de PNG, PDF N-up o ZIP de hojas PNG) sin cargarlas todas."""
+    from . import card_export
+    layout = card_export.Layout(page, cols, rows, dpi)
+    uid_list = [u.strip() for u in uids.split(",") if u.strip()] if uids else None
+    db = SessionLocal()
+    try:
+        entries, missing = card_export.select_cards(db, uid_list, role, estado, outdir=cards_dir)
+    finally:
+        db.close()
+    if missing:
+        print(f"[export-cards] {len(missing)} selected users have no card PNG (use assign-qr): "
+              + ", ".join(missing[:20]) + (" ..." if len(missing) > 20 else ""))
+    if not entries:
+        print("[export-cards] No cards to export.")
+        return
+    stream, _, name = card_export.export(entries, fmt, layout)
+    out = out or name
+    written = 0
+    with open(out + ".tmp", "wb") as f:
+        for chunk in stream:
+            f.write(chunk)
+            written += len(chunk)
+    os.replace(out + ".tmp", out)
+    print(f"[export-cards] {len(entries)} cards → {out} ({written // 1024} KiB)")
+
+
+def attendance_report(date_from=None, date_to=None, uid=None, summary=False, out=None, rebuild=False):
+    """Escribe el reporte de asistencia en CSV (archivo o stdout) tras plegar los eventos nuevos."""
+    import sys
+    from . import attendance
+    date_from, date_to = attendance.parse_range(date_from, date_to)
+    n = attendance.rebuild() if rebuild else attendance.fold()
+    print(f"[attendance] events folded: {n}", file=sys.stderr)
+    rows_fn = attendance.summary_rows if summary else attendance.day_rows
+    columns = attendance.SUMMARY_COLUMNS if summary else attendance.DAY_COLUMNS
+    db = SessionLocal()
+    try:
+        chunks = attendance.to_csv(rows_fn(db, date_from, date_to, uid), columns)
+        if out:
+            with open(out, "w", newline="", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            print(f"[attendance] saved: {out}", file=sys.stderr)
+        else:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+    finally:
+        db.close()
+
+
+def _gen_qr_corpus(corpus, n):
+    """Fotos sintéticas tipo teléfono (12 MP, perspectiva, desenfoque, ruido) con el valor en el nombre."""
+    import numpy as np
+    import cv2
+    from .qr import make_upy_qr_image
+    rng = np.random.default_rng(1234)
+    os.makedirs(corpus, exist_ok=True)
+    for i in range(int(n)):
+        value = gen_qr_value_b32()
+        W, H = (4032, 3024) if i % 2 else (3024, 4032)
+        side = int(rng.integers(300, 1100))
+        if i % 3 == 2:   # QR liso impreso (sin marco UPY)
+            import qrcode
+            q = qrcode.QRCode(border=4, box_size=1); q.add_data(value); q.make(fit=True)
+            tile = cv2.resize(np.asarray(q.make_image().convert("RGB")), (side, side), interpolation=cv2.INTER_NEAREST)
+        else:
+            tile = np.asarray(make_upy_qr_image(qr_value=value, size=side).convert("RGB"))
+        tile = cv2.copyMakeBorder(tile, side // 10, side // 10, side // 10, side // 10, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+        t = tile.shape[0]
+        # Fondo: degradado con ruido; el código en un cuadrilátero aleatorio (perspectiva + giro)
+        grad = np.linspace(rng.integers(30, 120), rng.integers(120, 220), W).astype(np.uint8)
+        photo = np.dstack([np.tile(grad, (H, 1))] * 3)
+        cx, cy = rng.integers(t, W - t), rng.integers(t, H - t)
+        ang = rng.uniform(0, 2 * np.pi)
+        quad = []
+        for k in range(4):
+            a = ang + k * np.pi / 2 + np.pi / 4
+            r = t * 0.71 * rng.uniform(0.85, 1.15)
+            quad.append([cx + r * np.cos(a), cy + r * np.sin(a)])
+        M = cv2.getPerspectiveTransform(np.float32([[t, t], [0, t], [0, 0], [t, 0]]), np.float32(quad))
+        mask = cv2.warpPerspective(np.full((t, t), 255, np.uint8), M, (W, H))
+        warped = cv2.warpPerspective(tile, M, (W, H))
+        photo[mask > 0] = warped[mask > 0]
+        k = int(rng.choice([1, 3, 5, 7]))
+        photo = cv2.GaussianBlur(photo, (k, k), 0)
+        photo = cv2.add(photo, rng.integers(0, 12, photo.shape, dtype=np.uint8))
+        cv2.imwrite(os.path.join(corpus, f"gen_{i:03d}_{value}.jpg"), cv2.cvtColor(photo, cv2.COLOR_RGB2BGR),
+                    [cv2.IMWRITE_JPEG_QUALITY, 88])
+    print(f"[bench-qr-decode] generated {n} images in {corpus}")
+
+
+def bench_qr_decode(corpus="bench/qr_corpus", generate=0, repeat=3):
+    """Tiempos por etapa y tasa de acierto del decodificador sobre las imágenes de `corpus`.
+
+    Fotos propias (p. ej. de teléfonos) se añaden a la carpeta tal cual; las generadas llevan el
+    valor esperado en el nombre (gen_<n>_<valor>.jpg) y solo cuentan como acierto si coincide.
+    """
+    import statistics
+    from . import qr_decode
+    if generate:
+        _gen_qr_corpus(corpus, generate)
+    files = sorted(f for f in os.listdir(corpus) if os.path.splitext(f)[1].lower() in
+                   (".jpg", ".jpeg", ".png", ".webp", ".bmp")) if os.path.isdir(corpus) else []
+    if not files:
+        print(f"[bench-qr-decode] no images in {corpus} (use --generate N)")
+        return
+    totals, stages, hits = [], {}, 0
+    per_stage = {"load": [], "cheap": [], "parallel": []}
+    for name in files:
+        with open(os.path.join(corpus, name), "rb") as f:
+            raw = f.read()
+        expected = os.path.splitext(name)[0].split("_", 2)[2] if name.startswith("gen_") else None
+        runs = []
+        for _ in range(max(1, int(repeat))):
+            vals, info = qr_decode.decode_bytes(raw)
+            runs.append(info["timings_ms"]["total"])
+        ok = bool(vals) and (expected is None or vals[0] == expected)
+        hits += ok
+        stages[info["stage"] or "-"] = stages.get(info["stage"] or "-", 0) + 1
+        for k in per_stage:
+            if k in info["timings_ms"]:
+                per_stage[k].append(info["timings_ms"][k])
+        totals.append(min(runs))
+        print(f"{name[:40]:40} {'OK ' if ok else 'MISS'} {min(runs):8.1f} ms  stage={info['stage'] or '-'}"
+              f"  {info['size'][0]}x{info['size'][1]}→{info['decoded_size'][0]}x{info['decoded_size'][1]}")
+    totals.sort()
+    p95 = totals[min(len(totals) - 1, int(round(0.95 * (len(totals) - 1))))]
+    print(f"\nimages={len(files)} decoded={hits} ({100 * hits / len(files):.0f}%)")
+    print(f"total ms: p50={statistics.median(totals):.1f} p95={p95:.1f} mean={statistics.mean(totals):.1f}")
+    print("stage mean ms: " + ", ".join(f"{k}={statistics.mean(v):.1f} (n={len(v)})" for k, v in per_stage.items() if v))
+    print("decoded by: " + ", ".join(f"{k}={v}" for k, v in sorted(stages.items(), key=lambda x: -x[1])))
+
+
+def bench_qr_render(n=50, size=600, logo=True):
+    """Tarjeta QR por PNG (make_upy_qr_image + codificación) frente a SVG: ms por tarjeta y bytes."""
+    import gzip
+    import io
+    import statistics
+    import time
+    from .qr import make_upy_qr_image, make_upy_qr_svg
+    logo_path = resolve_logo() if logo else None
+    values = [gen_qr_value_b32() for _ in range(int(n))]
+    make_upy_qr_image(values[0], size=int(size), logo_path=logo_path)   # plantillas en caché
+    make_upy_qr_svg(values[0], size=int(size), logo_path=logo_path)
+    rows = {}
+    for kind in ("png", "svg"):
+        ms, sizes, gz = [], [], []
+        for v in values:
+            t0 = time.perf_counter()
+            if kind == "png":
+                buf = io.BytesIO()
+                make_upy_qr_image(v, size=int(size), logo_path=logo_path).save(buf, format="PNG")
+                data = buf.getvalue()
+            else:
+                data = make_upy_qr_svg(v, size=int(size), logo_path=logo_path).encode()
+            ms.append((time.perf_counter() - t0) * 1000)
+            sizes.append(len(data))
+            gz.append(len(gzip.compress(data)))
+        rows[kind] = (statistics.median(ms), statistics.mean(sizes), statistics.mean(gz))
+        print(f"{kind}: render+encode p50={rows[kind][0]:.2f} ms  bytes={rows[kind][1]:.0f}  gzip={rows[kind][2]:.0f}")
+    png, svg = rows["png"], rows["svg"]
+    print(f"svg vs png: {png[0] / svg[0]:.1f}x faster, {png[1] / svg[1]:.1f}x smaller ({png[2] / svg[2]:.1f}x gzip)"
+          f"  [n={n}, size={size}, logo={'yes' if logo_path else 'no'}]")
 
 
 if __name__ == "__main__":
@@ -169,6 +422,7 @@ if __name__ == "__main__":
     s3.add_argument("--out", default=".", help="Carpeta de salida")
     s3.add_argument("--name", default="QR_custom.png", help="Nombre de archivo (p. ej., EMP-001.png)")
     s3.add_argument("--size", default=600, help="Tamaño (px) del PNG cuadrado")
+    s3.add_argument("--format", dest="fmt", choices=["png", "svg"], default="png", help="png (raster) o svg (vectorial)")
 
     s4 = sub.add_parser("seed-demo")
     s4.add_argument(
@@ -196,11 +450,54 @@ if __name__ == "__main__":
     s5.add_argument("--all", action="store_true", help="Rotar QR para TODOS los usuarios")
     s5.add_argument("--out", default="cards", help="Carpeta para guardar PNGs de QR")
     s5.add_argument("--size", default=600, help="Tamaño (px) del PNG cuadrado")
+    s5.add_argument("--workers", type=int, default=None, help="Procesos para hash + render (por defecto: uno por CPU)")
+    s5.add_argument("--batch", type=int, default=200, help="Usuarios por transacción")
+    s5.add_argument("--resume", action="store_true", help="Continúa una ejecución interrumpida")
 
     s6 = sub.add_parser("wipe-db")
     s6.add_argument("--keep-uid", default=DEFAULT_ADMIN.get("uid", "ADMIN-1"), help="UID a conservar (admin)")
     s6.add_argument("--yes", action="store_true", help="Confirmación explícita: borra todo excepto el admin indicado")
 
+    s7 = sub.add_parser("attendance-report")
+    s7.add_argument("--from", dest="date_from", default=None, help="Fecha inicial YYYY-MM-DD (por defecto: día 1 del mes)")
+    s7.add_argument("--to", dest="date_to", default=None, help="Fecha final YYYY-MM-DD (por defecto: hoy)")
+    s7.add_argument("--uid", default=None, help="Solo este usuario")
+    s7.add_argument("--summary", action="store_true", help="Totales por usuario en lugar de una fila por día")
+    s7.add_argument("--out", default=None, help="Archivo CSV de salida (por defecto: stdout)")
+    s7.add_argument("--rebuild", action="store_true", help="Recalcula la tabla de asistencia desde cero")
+
+    s9 = sub.add_parser("export-cards")
+    s9.add_argument("--format", dest="fmt", choices=["zip", "pdf", "png"], default="zip",
+                    help="zip: PNG sueltos; pdf: hojas N-up; png: hojas N-up como PNG dentro de un ZIP")
+    s9.add_argument("--out", default=None, help="Archivo de salida (por defecto: nombre según formato)")
+    s9.add_argument("--uids", default=None, help="UID separados por coma (por defecto: todos con QR)")
+    s9.add_argument("--role", default=None, help="Solo usuarios de este rol")
+    s9.add_argument("--estado", default=None, help="Solo usuarios en este estado (p. ej. active)")
+    s9.add_argument("--cards-dir", default="cards", help="Carpeta con los <uid>_QR.png")
+    s9.add_argument("--page", default=None, help="a4 | letter | a3 (por defecto CARD_SHEET_PAGE)")
+    s9.add_argument("--cols", type=int, default=None, help="Tarjetas por fila (por defecto CARD_SHEET_COLS)")
+    s9.add_argument("--rows", type=int, default=None, help="Filas por hoja (por defecto CARD_SHEET_ROWS)")
+    s9.add_argument("--dpi", type=int, default=None, help="Resolución de las hojas (por defecto CARD_SHEET_DPI)")
+
+    s10 = sub.add_parser("bench-qr-render")
+    s10.add_argument("--n", type=int, default=50, help="Tarjetas por formato")
+    s10.add_argument("--size", type=int, default=600, help="Lado (px) de la tarjeta")
+    s10.add_argument("--no-logo", action="store_true", help="Sin logo embebido")
+
+    s11 = sub.add_parser("maintenance")
+    s11.add_argument("--job", action="append", choices=["eventos", "sessions", "alarm_commands", "vacuum"],
+                     help="Trabajo a ejecutar (repetible; por defecto todos)")
+    s11.add_argument("--convert-vacuum", action="store_true",
+                     help="Pasa la BD SQLite a auto_vacuum=INCREMENTAL (VACUUM completo, una sola vez)")
+
+    s12 = sub.add_parser("verify-events")
+    s12.add_argument("--limit", type=int, default=50, help="Máximo de ids con error a listar")
+
+    s8 = sub.add_parser("bench-qr-decode")
+    s8.add_argument("--corpus", default="bench/qr_corpus", help="Carpeta con las imágenes (fotos de teléfono, etc.)")
+    s8.add_argument("--generate", type=int, default=0, help="Genera N fotos sintéticas en la carpeta antes de medir")
+    s8.add_argument("--repeat", type=int, default=3, help="Repeticiones por imagen (se reporta la mejor)")
+
     args = p.parse_args()
 
     if args.cmd == "create-admin":
@@ -213,7 +510,7 @@ if __name__ == "__main__":
         assign_qr(args.uid, outdir=args.out, size=args.size)
 
     elif args.cmd == "qr-from-value":
-        qr_from_value(args.value, outdir=args.out, filename=args.name, size=args.size)
+        qr_from_value(args.value, outdir=args.out, filename=args.name, size=args.size, fmt=args.fmt)
 
     elif args.cmd == "seed-demo":
         overrides = None
@@ -246,13 +543,45 @@ if __name__ == "__main__":
         seed_demo(users_override=overrides, update_existing=bool(args.update_existing))
 
     elif args.cmd == "assign-qr-bulk":
-        assign_qr_bulk(missing_only=(not args.all), outdir=args.out, size=args.size)
+        assign_qr_bulk(missing_only=(not args.all), outdir=args.out, size=args.size,
+                       workers=args.workers, batch=args.batch, resume=args.resume)
+
+    elif args.cmd == "attendance-report":
+        attendance_report(args.date_from, args.date_to, uid=args.uid, summary=args.summary,
+                          out=args.out, rebuild=args.rebuild)
+
+    elif args.cmd == "export-cards":
+        export_cards(args.fmt, out=args.out, uids=args.uids, role=args.role, estado=args.estado,
+                     cards_dir=args.cards_dir, page=args.page, cols=args.cols, rows=args.rows, dpi=args.dpi)
+
+    elif args.cmd == "bench-qr-decode":
+        bench_qr_decode(args.corpus, generate=args.generate, repeat=args.repeat)
+
+    elif args.cmd == "bench-qr-render":
+        bench_qr_render(args.n, size=args.size, logo=not args.no_logo)
+
+    elif args.cmd == "maintenance":
+        import json
+        from . import maintenance
+        if args.convert_vacuum:
+            print("[maintenance] convert-vacuum:", maintenance.convert_vacuum())
+        summary = maintenance.run(jobs=tuple(args.job or maintenance.JOBS), force=True)
+        print(json.dumps(summary, indent=2, ensure_ascii=False, default=str))
+
+    elif args.cmd == "verify-events":
+        import json
+        import sys
+        from . import maintenance
+        rep = maintenance.verify_chain(limit_report=args.limit)
+        print(json.dumps(rep, indent=2, ensure_ascii=False))
+        sys.exit(0 if rep["ok"] else 1)
 
     elif args.cmd == "wipe-db":
         if not args.yes:
             print("[wipe-db] Esta operación elimina TODAS las tablas excepto el usuario admin. Repite con --yes para confirmar.")
         else:
             from .models import AuthSession, Evento, Mensaje, CameraDevice, QRScannerDevice, NFCDevice
+            from .models import AttendanceDay, OccupancyState, ProcessingCursor, EventArchiveSegment
             import os
             db = SessionLocal()
             try:
@@ -266,6 +595,11 @@ if __name__ == "__main__":
                 n_cam = db.query(CameraDevice).delete(synchronize_session=False)
                 n_qr = db.query(QRScannerDevice).delete(synchronize_session=False)
                 n_nfc = db.query(NFCDevice).delete(synchronize_session=False)
+                # Estado derivado de la bitácora (se recalcula desde cero)
+                db.query(AttendanceDay).delete(synchronize_session=False)
+                db.query(OccupancyState).delete(synchronize_session=False)
+                db.query(ProcessingCursor).delete(synchronize_session=False)
+                db.query(EventArchiveSegment).delete(synchronize_session=False)   # la cadena empieza de nuevo
                 # Usuarios: conservar admin solicitado
                 n_users = db.query(Usuario).filter(Usuario.uid != args.keep_uid).delete(synchronize_session=False)
                 db.commit()
@@ -17,6 +17,16 @@ class Config:
     # --------- Parámetros de QR ----------
     QR_TTL_SECONDS = int(os.getenv("QR_TTL_SECONDS", "60"))  # ventana de 60 s
     QR_BYTES = int(os.getenv("QR_BYTES", "20"))              # longitud del valor Base32
+    QR_TEMPLATE_CACHE_SIZE = int(os.getenv("QR_TEMPLATE_CACHE_SIZE", "16"))  # plantillas de tarjeta (tamaño/colores/logo)
+    # Hojas de impresión N-up (export-cards / /api/admin/cards/export): página a4|letter|a3, rejilla y resolución
+    CARD_SHEET_PAGE = os.getenv("CARD_SHEET_PAGE", "a4")
+    CARD_SHEET_COLS = int(os.getenv("CARD_SHEET_COLS", "2"))
+    CARD_SHEET_ROWS = int(os.getenv("CARD_SHEET_ROWS", "3"))
+    CARD_SHEET_DPI = int(os.getenv("CARD_SHEET_DPI", "300"))
+    # Tarjetas bajo demanda (/api/qr/card/<uid>): LRU en memoria (MB), caché en disco opcional y lado máx. (px)
+    QR_IMAGE_CACHE_MB = int(os.getenv("QR_IMAGE_CACHE_MB", "32"))
+    QR_IMAGE_CACHE_DIR = os.getenv("QR_IMAGE_CACHE_DIR", "")      # vacío = sin caché en disco
+    QR_IMAGE_MAX_SIZE = int(os.getenv("QR_IMAGE_MAX_SIZE", "2048"))
 
     # --------- Seguridad de red (ACL de IPs permitidas) ----------
     # Formato CIDR separados por coma. Ejemplo:
@@ -27,6 +37,70 @@ class Config:
             "127.0.0.1/32,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16"
         ).split(",") if cidr.strip()
     ]
+    # Políticas por prefijo de ruta (gana el más largo; "*" = cualquier IP), separadas por ';':
+    #   "/api/nfc/=10.0.0.0/8,192.168.0.0/16;/api/admin/=127.0.0.1/32"
+    ACL_POLICIES = os.getenv("ACL_POLICIES", "")
+    # Proxies cuyo X-Forwarded-For se respeta (CIDR por coma); desde otras IPs la cabecera se ignora
+    TRUSTED_PROXIES = [c.strip() for c in os.getenv("TRUSTED_PROXIES", "127.0.0.1/32,::1/128").split(",") if c.strip()]
+    ACL_CACHE_SIZE = int(os.getenv("ACL_CACHE_SIZE", "4096"))   # decisiones (política, IP) recientes
+
+    # --------- Bloqueo por intentos fallidos (login y escaneo QR, ver app/attempts.py) ----------
+    # Backend: memory (por proceso) | sqlite (archivo compartido por los workers de la máquina)
+    ATTEMPT_STORE = os.getenv("ATTEMPT_STORE", "memory").lower()
+    ATTEMPT_STORE_PATH = os.getenv("ATTEMPT_STORE_PATH", "attempts.db")
+    ATTEMPT_MAX = int(os.getenv("ATTEMPT_MAX", "3"))                     # fallos dentro de la ventana
+    ATTEMPT_WINDOW_SEC = int(os.getenv("ATTEMPT_WINDOW_SEC", "600"))     # ventana deslizante
+    ATTEMPT_LOCK_SEC = int(os.getenv("ATTEMPT_LOCK_SEC", "600"))         # duración del bloqueo
+    ATTEMPT_MAX_KEYS = int(os.getenv("ATTEMPT_MAX_KEYS", "100000"))      # tope de claves (memory)
+    ATTEMPT_SWEEP_SEC = int(os.getenv("ATTEMPT_SWEEP_SEC", "60"))
+
+    # --------- Limitación de tasa por token bucket (ver app/rate_limit.py) ----------
+    # Reglas por endpoint ("blueprint.función") o blueprint, separadas por ';'. Cada dimensión
+    # (ip | device | uid) es N/S: ráfaga de N peticiones que se recupera a N por S segundos.
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true", "yes")
+    RATE_LIMITS = os.getenv(
+        "RATE_LIMITS",
+        "auth.login=ip:20/60,uid:10/60;"
+        "qr.scan_qr=ip:60/60,uid:20/60;"
+        "qr.decode_qr_image=ip:30/60,device:30/60;"
+        "qr.decode_qr_batch=ip:10/60,device:10/60;"
+        "nfc.nfc_scan=ip:600/60,device:120/60;"
+        "nfc.nfc_scan_batch=ip:60/60,device:30/60;"
+        "ingest=ip:600/60,device:120/60",
+    )
+    # Backend: memory (por proceso) | sqlite (archivo compartido por los workers de la máquina)
+    RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory").lower()
+    RATE_LIMIT_STORE_PATH = os.getenv("RATE_LIMIT_STORE_PATH", "ratelimit.db")
+    RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))   # tope de cubos (memory)
+    RATE_LIMIT_SWEEP_SEC = int(os.getenv("RATE_LIMIT_SWEEP_SEC", "60"))
+
+    # --------- Caché de identidad de JWT (estado, rol y época de token; ver app/identity_cache.py) ----------
+    IDENTITY_CACHE_TTL_SEC = int(os.getenv("IDENTITY_CACHE_TTL_SEC", "30"))   # 0 = sin caché
+    IDENTITY_CACHE_MAX = int(os.getenv("IDENTITY_CACHE_MAX", "10000"))
+    # Archivo cuyo mtime avisa a los demás workers de una invalidación (vacío = solo TTL)
+    IDENTITY_CACHE_SIGNAL_PATH = os.getenv("IDENTITY_CACHE_SIGNAL_PATH", "identity.signal")
+
+    # --------- Sesiones pendientes de login (ver app/pending_sessions.py) ----------
+    # Backend: memory (un solo worker, sin filas en BD) | db (tabla auth_sessions, varios workers)
+    PENDING_SESSION_STORE = os.getenv("PENDING_SESSION_STORE", "memory").lower()
+    PENDING_SESSION_KEEP_SEC = int(os.getenv("PENDING_SESSION_KEEP_SEC", "300"))    # cerradas en memoria
+    PENDING_SESSION_MAX = int(os.getenv("PENDING_SESSION_MAX", "100000"))
+    PENDING_SESSION_POLL_SEC = float(os.getenv("PENDING_SESSION_POLL_SEC", "2"))    # sondeo del backend db
+    PENDING_SESSION_RETENTION_DAYS = int(os.getenv("PENDING_SESSION_RETENTION_DAYS", "7"))   # -1 = conservar
+
+    # --------- Mantenimiento programado (ver app/maintenance.py) ----------
+    MAINT_ENABLED = os.getenv("MAINT_ENABLED", "1").lower() in ("1", "true", "yes")
+    MAINT_INTERVAL_SEC = int(os.getenv("MAINT_INTERVAL_SEC", "3600"))
+    MAINT_START_DELAY_SEC = int(os.getenv("MAINT_START_DELAY_SEC", "300"))   # primera pasada tras arrancar
+    # Retenciones (días; -1 = conservar). auth_sessions usa PENDING_SESSION_RETENTION_DAYS.
+    # El archivado de eventos es opcional: por defecto la bitácora completa sigue en la tabla.
+    MAINT_EVENTOS_RETENTION_DAYS = int(os.getenv("MAINT_EVENTOS_RETENTION_DAYS", "-1"))
+    MAINT_ALARM_COMMANDS_RETENTION_DAYS = int(os.getenv("MAINT_ALARM_COMMANDS_RETENTION_DAYS", "7"))
+    # Segmentos de bitácora archivados (.jsonl.gz) y tamaño de lote de borrado
+    MAINT_ARCHIVE_DIR = os.getenv("MAINT_ARCHIVE_DIR", "archive")
+    MAINT_ARCHIVE_SEGMENT_ROWS = int(os.getenv("MAINT_ARCHIVE_SEGMENT_ROWS", "5000"))
+    MAINT_DELETE_BATCH = int(os.getenv("MAINT_DELETE_BATCH", "500"))
+    MAINT_VACUUM_PAGES = int(os.getenv("MAINT_VACUUM_PAGES", "2000"))   # páginas por incremental_vacuum
 
     # --------- Tamaño máximo de subida (para fotos del móvil) ----------
     # 15 MB por defecto
@@ -45,6 +119,61 @@ class Config:
         "Cam 1|/camera_sim/1,Cam 2|/camera_sim/2,Cam 3|/camera_sim/3,Cam 4|/camera_sim/4"
     ).split(',') if x.strip()]
 
+    # Hub de captura compartido (/camera_mjpeg): calidad JPEG, parada tras el último cliente y backoff.
+    CAMERA_JPEG_QUALITY = int(os.getenv("CAMERA_JPEG_QUALITY", "80"))
+    CAMERA_IDLE_STOP_SEC = float(os.getenv("CAMERA_IDLE_STOP_SEC", "5"))
+    CAMERA_RECONNECT_MAX_SEC = float(os.getenv("CAMERA_RECONNECT_MAX_SEC", "30"))
+    # Valores por defecto y límites por cliente (?fps=&w=&q=); ancho 0 = resolución nativa.
+    CAMERA_DEFAULT_FPS = float(os.getenv("CAMERA_DEFAULT_FPS", "10"))
+    CAMERA_MAX_FPS = float(os.getenv("CAMERA_MAX_FPS", "30"))
+    CAMERA_DEFAULT_WIDTH = int(os.getenv("CAMERA_DEFAULT_WIDTH", "0"))
+    CAMERA_MAX_WIDTH = int(os.getenv("CAMERA_MAX_WIDTH", "1920"))
+    # /camera_snapshot: max-age del JPEG (s). /camera_mosaic: ancho del lienzo y fps de composición.
+    CAMERA_SNAPSHOT_MAX_AGE = int(os.getenv("CAMERA_SNAPSHOT_MAX_AGE", "1"))
+    CAMERA_MOSAIC_WIDTH = int(os.getenv("CAMERA_MOSAIC_WIDTH", "1280"))
+    CAMERA_MOSAIC_FPS = float(os.getenv("CAMERA_MOSAIC_FPS", "10"))
+    CAMERA_MOSAIC_MAX_TILES = int(os.getenv("CAMERA_MOSAIC_MAX_TILES", "16"))
+    # Registro de hubs: descarte tras CAMERA_HUB_EVICT_SEC sin uso y tope de mosaicos/sintéticas activos.
+    CAMERA_HUB_EVICT_SEC = float(os.getenv("CAMERA_HUB_EVICT_SEC", "60"))
+    CAMERA_MAX_DYNAMIC_HUBS = int(os.getenv("CAMERA_MAX_DYNAMIC_HUBS", "16"))
+    # Fuente sintética (synthetic://, /camera_synth): carpeta base de secuencias de imágenes y máximo a cargar.
+    CAMERA_SYNTH_SEQ_DIR = os.getenv("CAMERA_SYNTH_SEQ_DIR", "synthetic")
+    CAMERA_SYNTH_SEQ_MAX = int(os.getenv("CAMERA_SYNTH_SEQ_MAX", "300"))
+    # Descubrimiento (/api/dev/scan): concurrencia, timeouts (s) y ventana de reescaneo incremental.
+    CAMERA_SCAN_WORKERS = int(os.getenv("CAMERA_SCAN_WORKERS", "64"))
+    CAMERA_SCAN_CONNECT_TIMEOUT = float(os.getenv("CAMERA_SCAN_CONNECT_TIMEOUT", "0.5"))
+    CAMERA_SCAN_HTTP_TIMEOUT = float(os.getenv("CAMERA_SCAN_HTTP_TIMEOUT", "1.5"))
+    CAMERA_SCAN_RESCAN_SEC = int(os.getenv("CAMERA_SCAN_RESCAN_SEC", "600"))
+
+    # --------- Salud de cámaras / escáneres QR (sondeo en segundo plano) ----------
+    DEVICE_HEALTH_ENABLED = os.getenv("DEVICE_HEALTH_ENABLED", "1").lower() in ("1", "true", "yes")
+    DEVICE_HEALTH_INTERVAL_SEC = int(os.getenv("DEVICE_HEALTH_INTERVAL_SEC", "60"))
+    DEVICE_HEALTH_WORKERS = int(os.getenv("DEVICE_HEALTH_WORKERS", "8"))
+    DEVICE_HEALTH_TIMEOUT_SEC = float(os.getenv("DEVICE_HEALTH_TIMEOUT_SEC", "3"))
+    DEVICE_HEALTH_SAMPLE_SEC = float(os.getenv("DEVICE_HEALTH_SAMPLE_SEC", "2"))   # ventana para medir fps
+    DEVICE_HEALTH_RETENTION_DAYS = int(os.getenv("DEVICE_HEALTH_RETENTION_DAYS", "7"))
+
+    # --------- Escaneo continuo de QR en servidor (escáneres QR con stream de cámara) ----------
+    QR_SCAN_ENABLED = os.getenv("QR_SCAN_ENABLED", "1").lower() in ("1", "true", "yes")
+    QR_SCAN_FPS = float(os.getenv("QR_SCAN_FPS", "4"))                 # frames muestreados por dispositivo
+    QR_SCAN_WORKERS = int(os.getenv("QR_SCAN_WORKERS", "4"))
+    QR_SCAN_MAX_WIDTH = int(os.getenv("QR_SCAN_MAX_WIDTH", "960"))     # 0 = resolución nativa
+    QR_SCAN_MULTI = os.getenv("QR_SCAN_MULTI", "1").lower() in ("1", "true", "yes")   # varios códigos por frame
+    QR_SCAN_DEBOUNCE_SEC = float(os.getenv("QR_SCAN_DEBOUNCE_SEC", "3"))
+    QR_SCAN_REFRESH_SEC = int(os.getenv("QR_SCAN_REFRESH_SEC", "30"))
+    QR_SCAN_UNKNOWN_TTL_SEC = float(os.getenv("QR_SCAN_UNKNOWN_TTL_SEC", "60"))   # caché negativa; 0 = sin caché
+    QR_SCAN_UNKNOWN_MAX = int(os.getenv("QR_SCAN_UNKNOWN_MAX", "4096"))
+    QR_SCAN_SIGNAL_PATH = os.getenv("QR_SCAN_SIGNAL_PATH", "qr_scan.signal")
+
+    # --------- /api/qr/decode (imagen subida) ----------
+    # Lado máx. (px) de la primera pasada, de la pasada a mayor resolución (0 = original) e hilos por intento.
+    QR_DECODE_MAX_SIDE = int(os.getenv("QR_DECODE_MAX_SIDE", "1024"))
+    QR_DECODE_FULL_MAX_SIDE = int(os.getenv("QR_DECODE_FULL_MAX_SIDE", "2048"))
+    QR_DECODE_WORKERS = int(os.getenv("QR_DECODE_WORKERS", "4"))
+    # /api/qr/decode/batch: frames por petición y frames decodificados a la vez.
+    QR_DECODE_BATCH_MAX = int(os.getenv("QR_DECODE_BATCH_MAX", "8"))
+    QR_DECODE_BATCH_WORKERS = int(os.getenv("QR_DECODE_BATCH_WORKERS", "4"))
+
     # --------- CORS ----------
     # CSV de orígenes permitidos. Por defecto '*' para compatibilidad.
     CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(',') if o.strip()]
@@ -52,4 +181,40 @@ class Config:
     # --------- SSE / Logs ----------
     MAX_SSE_LISTENERS = int(os.getenv("MAX_SSE_LISTENERS", "100"))
 
+    # --------- NFC: filtro de rechazo rápido (Bloom) ----------
+    # Capacidad esperada de tarjetas y tasa de falsos positivos del filtro.
+    NFC_FILTER_CAPACITY = int(os.getenv("NFC_FILTER_CAPACITY", "10000"))
+    NFC_FILTER_FP_RATE = float(os.getenv("NFC_FILTER_FP_RATE", "0.001"))
+    # Reconstrucción periódica desde BD (cubre asignaciones hechas por otros procesos).
+    NFC_FILTER_REFRESH_SEC = int(os.getenv("NFC_FILTER_REFRESH_SEC", "60"))
+    # Archivo de señal: las altas/bajas de otro worker fuerzan un rebuild antes de responder ("" = desactivado).
+    NFC_FILTER_SIGNAL_PATH = os.getenv("NFC_FILTER_SIGNAL_PATH", "nfc_filter.signal")
+    # Ventana de agregación (s) para rechazos de tarjetas desconocidas: 1 fila por dispositivo/ventana.
+    NFC_UNKNOWN_AGG_WINDOW_SEC = int(os.getenv("NFC_UNKNOWN_AGG_WINDOW_SEC", "60"))
+
+    # --------- NFC: debounce de lecturas repetidas ----------
+    # Ventana (ms) por (dispositivo, tarjeta) en la que se devuelve la decisión en caché. 0 = desactivado.
+    NFC_DEBOUNCE_MS = int(os.getenv("NFC_DEBOUNCE_MS", "1500"))
+    NFC_DEBOUNCE_MAX_ENTRIES = int(os.getenv("NFC_DEBOUNCE_MAX_ENTRIES", "10000"))
+
+    # --------- Políticas de acceso ----------
+    # Cada cuántos segundos se comprueba si otra instancia cambió las reglas en BD.
+    POLICY_RELOAD_CHECK_SEC = int(os.getenv("POLICY_RELOAD_CHECK_SEC", "30"))
+
+    # --------- Ocupación por área / anti-passback ----------
+    OCCUPANCY_ENABLED = os.getenv("OCCUPANCY_ENABLED", "1").lower() in ("1", "true", "yes")
+    OCCUPANCY_POLL_SEC = float(os.getenv("OCCUPANCY_POLL_SEC", "1"))         # lectura incremental de eventos
+    OCCUPANCY_SNAPSHOT_SEC = int(os.getenv("OCCUPANCY_SNAPSHOT_SEC", "60"))  # persistencia del estado en BD
+    # Anti-passback en /api/nfc/scan: rechaza "in" si ya está dentro y "out" si no entró.
+    ANTI_PASSBACK = os.getenv("ANTI_PASSBACK", "0").lower() in ("1", "true", "yes")
+
+    # --------- Asistencia (entrada/salida por día) ----------
+    ATTENDANCE_ENABLED = os.getenv("ATTENDANCE_ENABLED", "1").lower() in ("1", "true", "yes")
+    ATTENDANCE_FOLD_SEC = int(os.getenv("ATTENDANCE_FOLD_SEC", "60"))          # plegado incremental
+    ATTENDANCE_MAX_OPEN_HOURS = int(os.getenv("ATTENDANCE_MAX_OPEN_HOURS", "16"))  # entrada sin salida → se descarta
+    # Áreas de los lectores de entrada (perímetro). Vacío = solo lecturas con dirección explícita.
+    ATTENDANCE_AREAS = [a.strip() for a in os.getenv("ATTENDANCE_AREAS", "").split(",") if a.strip()]
+    # Lotes que /api/attendance/report|summary pliega antes de responder (el resto, el job de fondo)
+    ATTENDANCE_REPORT_FOLD_BATCHES = int(os.getenv("ATTENDANCE_REPORT_FOLD_BATCHES", "1"))
+
 cfg = Config()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
 from .config import cfg
 
@@ -7,6 +7,13 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in cfg.DATABASE_URL else {}
 )
 
+if "sqlite" in cfg.DATABASE_URL:
+    @event.listens_for(engine, "connect")
+    def _sqlite_auto_vacuum(dbapi_conn, _record):
+        # Solo surte efecto en una BD nueva (antes de la primera tabla): habilita el VACUUM
+        # incremental del mantenimiento (app/maintenance.py) sin reescribir todo el archivo.
+        dbapi_conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
 SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
 Base = declarative_base()
 
@@ -16,3 +23,8 @@ def db_session():
         def __enter__(self): self.db = SessionLocal(); return self.db
         def __exit__(self, exc_type, exc, tb): self.db.close()
     return _Ctx()
+
+def standalone_session():
+    # Sesión independiente del scoped_session del hilo: para cachés/tareas de fondo
+    # que abren y cierran su propia sesión sin afectar la de la petición en curso.
+    return SessionLocal.session_factory()
@@ -0,0 +1,265 @@
+import datetime
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .config import cfg
+from .db import standalone_session
+from .models import CameraDevice, QRScannerDevice, DeviceHealthSample
+from .time_utils import now_cst
+from . import camera_hub, synthetic_camera
+
+#
+# Sondeo periódico de salud de cámaras y escáneres QR
+# - Objetivos: devices_cameras (cam:<id>), devices_qr_scanners (qr:<id>) y CAM_URLS (env:<n>).
+# - Cada DEVICE_HEALTH_INTERVAL_SEC se sondean en un pool acotado (DEVICE_HEALTH_WORKERS):
+#     · HTTP: latencia hasta el primer JPEG completo y fps contando marcadores JPEG durante
+#       DEVICE_HEALTH_SAMPLE_SEC (multipart/MJPEG); otras respuestas 200 = alcanzable.
+#     · RTSP/RTMP/otros: OpenCV con timeouts de apertura/lectura; primer frame y fps.
+#     · Si el hub de captura ya tiene la fuente abierta (alguien la está viendo) se usan sus
+#       métricas en vez de abrir otra sesión contra la cámara.
+#     · Escáner QR sin URL: connect TCP a ip:80.
+# - Cada ciclo guarda una fila compacta por dispositivo en device_health, actualiza last_seen
+#   de los dispositivos alcanzables y purga el historial anterior a DEVICE_HEALTH_RETENTION_DAYS,
+#   todo en una transacción. El estado actual se sirve desde memoria.
+#
+
+_lock = threading.Lock()
+_current: Dict[str, dict] = {}
+_thread: Optional[threading.Thread] = None
+_wake = threading.Event()
+
+JPEG_EOI = b"\xff\xd9"
+
+
+def _targets() -> List[dict]:
+    out = []
+    db = standalone_session()
+    try:
+        for c in db.query(CameraDevice).all():
+            if (c.status or "active") != "disabled":
+                out.append({"key": f"cam:{c.id}", "kind": "camera", "name": c.name, "url": (c.url or "").strip(), "ip": c.ip})
+        for q in db.query(QRScannerDevice).all():
+            if (q.status or "active") != "disabled":
+                out.append({"key": f"qr:{q.id}", "kind": "qr_scanner", "name": q.name, "url": (q.url or "").strip(), "ip": q.ip})
+    finally:
+        db.close()
+    for idx, item in enumerate(cfg.CAM_URLS, start=1):
+        name, url = item.split("|", 1) if "|" in item else (f"Cam {idx}", item)
+        out.append({"key": f"env:{idx}", "kind": "camera", "name": name.strip(), "url": url.strip(), "ip": None})
+    return out
+
+
+def _chunks(r):
+    """Bytes según llegan (sin esperar a llenar un búfer fijo) para medir latencia y fps reales."""
+    read1 = getattr(r.raw, "read1", None)
+    if read1 is None:   # urllib3 1.x
+        yield from r.iter_content(1024)
+        return
+    while True:
+        data = read1(16384)
+        if not data:
+            return
+        yield data
+
+
+def _probe_http(url: str) -> dict:
+    import requests  # type: ignore
+    timeout = cfg.DEVICE_HEALTH_TIMEOUT_SEC
+    t0 = time.monotonic()
+    r = requests.get(url, timeout=(timeout, timeout), stream=True)
+    try:
+        if r.status_code >= 400:
+            return {"ok": False, "error": f"http {r.status_code}"}
+        ct = r.headers.get("Content-Type", "").lower()
+        if "multipart" not in ct and "image" not in ct:
+            return {"ok": True, "latency_ms": int((time.monotonic() - t0) * 1000)}
+        # Contar frames JPEG (marcador EOI) durante la ventana de muestreo
+        frames, first_at, last_at, tail, read = 0, None, None, b"", 0
+        deadline = t0 + timeout + cfg.DEVICE_HEALTH_SAMPLE_SEC
+        for chunk in _chunks(r):
+            now = time.monotonic()
+            read += len(chunk)
+            n = (tail + chunk).count(JPEG_EOI)
+            if n:
+                frames += n
+                first_at = first_at or now
+                last_at = now
+            tail = chunk[-1:]
+            if (frames and "multipart" not in ct) or now > deadline or read > 8 * 1024 * 1024:
+                break
+            if first_at and now - first_at >= cfg.DEVICE_HEALTH_SAMPLE_SEC:
+                break
+        if not frames:
+            return {"ok": False, "error": "no frame"}
+        fps = (frames - 1) / (last_at - first_at) if frames > 1 and last_at > first_at else None
+        return {"ok": True, "latency_ms": int((first_at - t0) * 1000), "fps": fps}
+    finally:
+        r.close()
+
+
+def _probe_cv(url: str) -> dict:
+    import cv2
+    ms = int(cfg.DEVICE_HEALTH_TIMEOUT_SEC * 1000)
+    t0 = time.monotonic()
+    if synthetic_camera.is_synthetic(url):
+        cap = synthetic_camera.open_capture(url)
+    else:
+        try:
+            cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, ms, cv2.CAP_PROP_READ_TIMEOUT_MSEC, ms])
+        except Exception:
+            cap = cv2.VideoCapture(url)   # OpenCV sin parámetros de apertura
+    try:
+        if not cap.isOpened():
+            return {"ok": False, "error": "open failed"}
+        frames, first_at, last_at = 0, None, None
+        while True:
+            ok, _ = cap.read()
+            now = time.monotonic()
+            if not ok:
+                break
+            frames += 1
+            first_at = first_at or now
+            last_at = now
+            if now - first_at >= cfg.DEVICE_HEALTH_SAMPLE_SEC:
+                break
+        if not frames:
+            return {"ok": False, "error": "no frame"}
+        fps = (frames - 1) / (last_at - first_at) if frames > 1 and last_at > first_at else None
+        return {"ok": True, "latency_ms": int((first_at - t0) * 1000), "fps": fps}
+    finally:
+        cap.release()
+
+
+def _probe_tcp(ip: str, port: int = 80) -> dict:
+    t0 = time.monotonic()
+    try:
+        with socket.create_connection((ip, port), timeout=cfg.DEVICE_HEALTH_TIMEOUT_SEC):
+            return {"ok": True, "latency_ms": int((time.monotonic() - t0) * 1000)}
+    except OSError as e:
+        return {"ok": False, "error": f"tcp {port}: {e.strerror or e}"}
+
+
+def _probe(target: dict) -> Optional[dict]:
+    url, ip = target["url"], target["ip"]
+    try:
+        if url:
+            hub = camera_hub.peek_hub(url)
+            st = hub.stats() if hub else None
+            if st and st["running"] and st["frame_age_sec"] is not None and st["frame_age_sec"] < 5:
+                return {"ok": True, "latency_ms": None, "fps": st["fps"] or None, "via": "hub"}
+            if url.lower().startswith(("http://", "https://")):
+                return _probe_http(url)
+            if "://" in url:
+                return _probe_cv(url)
+            return None   # rutas relativas (simuladores locales): no se sondean
+        if ip:
+            return _probe_tcp(ip)
+    except Exception as e:
+        return {"ok": False, "error": str(e)[:120]}
+    return None
+
+
+def run_cycle() -> int:
+    """Sondea todos los dispositivos y persiste el resultado. Devuelve cuántos sondeó."""
+    targets = _targets()
+    with ThreadPoolExecutor(max_workers=max(1, cfg.DEVICE_HEALTH_WORKERS)) as pool:
+        results = list(pool.map(_probe, targets))
+    now = now_cst()
+    samples, seen_cam, seen_qr = [], [], []
+    with _lock:
+        live = set()
+        for t, res in zip(targets, results):
+            if res is None:
+                continue
+            live.add(t["key"])
+            prev = _current.get(t["key"])
+            changed = prev is None or prev["ok"] != res["ok"]
+            fps = round(res["fps"], 1) if res.get("fps") else None
+            _current[t["key"]] = {
+                "key": t["key"], "kind": t["kind"], "name": t["name"], "url": t["url"] or t["ip"],
+                "ok": res["ok"], "status": "up" if res["ok"] else "down",
+                "latency_ms": res.get("latency_ms"), "fps": fps, "error": res.get("error"),
+                "via": res.get("via", "probe"), "checked_at": now.isoformat(),
+                "since": now.isoformat() if changed else prev["since"],
+                "consecutive_failures": 0 if res["ok"] else ((prev or {}).get("consecutive_failures", 0) + 1),
+            }
+            samples.append(DeviceHealthSample(ts=now, device_key=t["key"], ok=res["ok"],
+                                              latency_ms=res.get("latency_ms"),
+                                              fps=int(fps * 10) if fps else None,
+                                              error=(res.get("error") or "")[:120] or None))
+            if res["ok"] and t["key"].startswith("cam:"):
+                seen_cam.append(int(t["key"][4:]))
+            elif res["ok"] and t["key"].startswith("qr:"):
+                seen_qr.append(int(t["key"][3:]))
+        for k in [k for k in _current if k not in live]:
+            del _current[k]   # dispositivo borrado o ya no sondeable
+    _persist(samples, seen_cam, seen_qr, now)
+    return len(samples)
+
+
+def _persist(samples, seen_cam, seen_qr, now) -> None:
+    db = standalone_session()
+    try:
+        db.add_all(samples)
+        if seen_cam:
+            db.query(CameraDevice).filter(CameraDevice.id.in_(seen_cam)).update(
+                {"last_seen": now}, synchronize_session=False)
+        if seen_qr:
+            db.query(QRScannerDevice).filter(QRScannerDevice.id.in_(seen_qr)).update(
+                {"last_seen": now}, synchronize_session=False)
+        cutoff = now - datetime.timedelta(days=cfg.DEVICE_HEALTH_RETENTION_DAYS)
+        db.query(DeviceHealthSample).filter(DeviceHealthSample.ts < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print("[device_health] persist failed:", e)
+    finally:
+        db.close()
+
+
+def current(key: Optional[str] = None):
+    """Estado actual en memoria: dict de un dispositivo (o None) o lista de todos."""
+    with _lock:
+        if key is not None:
+            st = _current.get(key)
+            return dict(st) if st else None
+        return [dict(v) for v in _current.values()]
+
+
+def history(key: str, limit: int = 100) -> List[dict]:
+    db = standalone_session()
+    try:
+        rows = (db.query(DeviceHealthSample).filter(DeviceHealthSample.device_key == key)
+                .order_by(DeviceHealthSample.id.desc()).limit(max(1, min(limit, 5000))).all())
+        return [{"ts": r.ts.isoformat() if r.ts else None, "ok": r.ok, "latency_ms": r.latency_ms,
+                 "fps": r.fps / 10 if r.fps is not None else None, "error": r.error} for r in rows]
+    finally:
+        db.close()
+
+
+def probe_now() -> None:
+    """Adelanta el siguiente ciclo del sondeo en segundo plano."""
+    _wake.set()
+
+
+def _loop() -> None:
+    time.sleep(5)   # deja terminar el arranque antes del primer ciclo
+    while True:
+        try:
+            run_cycle()
+        except Exception as e:
+            print("[device_health] cycle failed:", e)
+        _wake.wait(max(5, cfg.DEVICE_HEALTH_INTERVAL_SEC))
+        _wake.clear()
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or not cfg.DEVICE_HEALTH_ENABLED:
+        return
+    _thread = threading.Thread(target=_loop, name="device-health", daemon=True)
+    _thread.start()
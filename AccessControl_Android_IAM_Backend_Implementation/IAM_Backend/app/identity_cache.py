@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from sqlalchemy import update
+
+from .config import cfg
+from .models import TokenEpoch, Usuario
+from .time_utils import now_cst
+
+#
+# Caché de identidad de las peticiones autenticadas (req_auth.current_identity y _require_role)
+# - uid → (estado, rol, época de token) con TTL corto (IDENTITY_CACHE_TTL_SEC) en una LRU acotada
+#   (IDENTITY_CACHE_MAX): en régimen estable una petición con JWT no consulta la BD.
+# - Época de token por usuario (tabla token_epochs): el JWT lleva la época vigente al emitirse
+#   (claim "te"; sin claim = 0). bump_epoch() la incrementa al revocar o cambiar el estado, y todo
+#   token anterior deja de valer aunque no haya expirado.
+# - invalidate(uid) / bump_epoch() descartan la entrada en este proceso en el acto y tocan
+#   IDENTITY_CACHE_SIGNAL_PATH; los demás workers comparan su mtime (un stat por consulta) y vacían
+#   su caché al verlo cambiar. Sin archivo de señal, otro worker tarda como mucho el TTL.
+# - Invalidar siempre después del commit: una consulta en curso con datos viejos no se guarda
+#   (contador de generación).
+#
+
+
+class Identity(NamedTuple):
+    uid: str
+    estado: str
+    rol: str
+    epoch: int
+
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, tuple]" = OrderedDict()   # uid → (Identity, expira_monotonic)
+_generation = 0
+_signal_mtime: Optional[int] = None
+_stats = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0, "signal_flushes": 0, "evictions": 0}
+
+
+def _signal_stat() -> Optional[int]:
+    try:
+        return os.stat(cfg.IDENTITY_CACHE_SIGNAL_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _check_signal() -> None:
+    # Llamar con _lock tomado
+    global _signal_mtime, _generation
+    if not cfg.IDENTITY_CACHE_SIGNAL_PATH:
+        return
+    mtime = _signal_stat()
+    if mtime != _signal_mtime:
+        if _signal_mtime is not None or _entries:
+            _entries.clear()
+            _generation += 1
+            _stats["signal_flushes"] += 1
+        _signal_mtime = mtime
+
+
+def _touch_signal() -> None:
+    global _signal_mtime
+    path = cfg.IDENTITY_CACHE_SIGNAL_PATH
+    if not path:
+        return
+    try:
+        with open(path, "a"):
+            os.utime(path, None)
+        _signal_mtime = _signal_stat()   # el propio proceso ya invalidó: no vaciar otra vez
+    except OSError as e:
+        print("[identity_cache] signal write failed:", e)
+
+
+def lookup(db, uid: str) -> Optional[Identity]:
+    """Identidad de `uid` (caché → BD). None si el usuario no existe."""
+    if not uid:
+        return None
+    now = time.monotonic()
+    with _lock:
+        _check_signal()
+        hit = _entries.get(uid)
+        if hit is not None:
+            if hit[1] > now:
+                _entries.move_to_end(uid)
+                _stats["hits"] += 1
+                return hit[0]
+            del _entries[uid]
+            _stats["expired"] += 1
+        _stats["misses"] += 1
+        gen = _generation
+    row = (db.query(Usuario.uid, Usuario.estado, Usuario.rol, TokenEpoch.epoch)
+           .outerjoin(TokenEpoch, TokenEpoch.uid == Usuario.uid)
+           .filter(Usuario.uid == uid).first())
+    if row is None:
+        return None
+    ident = Identity(row[0], row[1], row[2], int(row[3] or 0))
+    ttl = max(0, cfg.IDENTITY_CACHE_TTL_SEC)
+    if ttl:
+        with _lock:
+            if gen == _generation:   # nadie invalidó mientras consultábamos
+                _entries[uid] = (ident, now + ttl)
+                while len(_entries) > max(1, cfg.IDENTITY_CACHE_MAX):
+                    _entries.popitem(last=False)
+                    _stats["evictions"] += 1
+    return ident
+
+
+def token_valid(ident: Optional[Identity], payload: dict) -> bool:
+    """El JWT corresponde a un usuario activo y lleva la época vigente."""
+    try:
+        te = int(payload.get("te") or 0)
+    except (TypeError, ValueError):
+        return False
+    return ident is not None and ident.estado == "active" and te >= ident.epoch
+
+
+def invalidate(uid: Optional[str] = None) -> None:
+    """Descarta `uid` (o todo si es None) aquí y avisa a los demás workers. Llamar tras el commit."""
+    global _generation
+    with _lock:
+        if uid is None:
+            _entries.clear()
+        else:
+            _entries.pop(uid, None)
+        _generation += 1
+        _stats["invalidations"] += 1
+        _touch_signal()
+
+
+def bump_epoch(db, uid: str) -> int:
+    """Incrementa la época de token de `uid` (commit incluido) e invalida su entrada.
+    Devuelve la nueva época."""
+    n = db.execute(update(TokenEpoch).where(TokenEpoch.uid == uid)
+                   .values(epoch=TokenEpoch.epoch + 1, updated_at=now_cst())).rowcount
+    if not n:
+        db.add(TokenEpoch(uid=uid, epoch=1))
+    db.commit()
+    epoch = db.query(TokenEpoch.epoch).filter(TokenEpoch.uid == uid).scalar() or 0
+    invalidate(uid)
+    return int(epoch)
+
+
+def stats() -> dict:
+    with _lock:
+        return {"entries": len(_entries), "max": cfg.IDENTITY_CACHE_MAX, "ttl_sec": cfg.IDENTITY_CACHE_TTL_SEC,
+                "signal_path": cfg.IDENTITY_CACHE_SIGNAL_PATH or None, **_stats}
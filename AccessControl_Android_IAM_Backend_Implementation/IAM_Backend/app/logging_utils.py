@@ -75,7 +75,8 @@ def _sanitize_context(ctx):
         return ctx
 
 
-def sign_event_and_persist(db, event_name, actor_uid=None, source=None, context=None):
+def _signed_event(event_name, actor_uid, source, context, prev):
+    """Evento firmado y encadenado a `prev` (hash del evento anterior), sin persistir."""
     context = _sanitize_context(context)
     payload = {
         "event": event_name,
@@ -86,7 +87,6 @@ def sign_event_and_persist(db, event_name, actor_uid=None, source=None, context=
     payload_bytes = json.dumps(payload, sort_keys=True).encode()
     sig = _signing_key.sign(payload_bytes).signature
     sig_b64 = binascii.b2a_base64(sig).decode().strip()
-    prev = last_hash_prev(db)
     # compute simple chain hash: H(prev || payload || sig)
     m = hashlib.sha256()
     if prev:
@@ -94,19 +94,49 @@ def sign_event_and_persist(db, event_name, actor_uid=None, source=None, context=
     m.update(payload_bytes)
     m.update(sig)
     hash_prev = m.hexdigest()
-    ev = Evento(event=event_name, actor_uid=actor_uid, source=source, context=context, signature=sig_b64, hash_prev=hash_prev)
+    return Evento(event=event_name, actor_uid=actor_uid, source=source, context=context, signature=sig_b64, hash_prev=hash_prev)
+
+
+def _public_row(ev) -> dict:
+    return {
+        "id": ev.id,
+        "event": ev.event,
+        "actor_uid": ev.actor_uid,
+        "source": ev.source,
+        "ts": getattr(ev, 'ts', None).isoformat() if getattr(ev, 'ts', None) else None,
+        "context": ev.context or {},
+    }
+
+
+def sign_event_and_persist(db, event_name, actor_uid=None, source=None, context=None):
+    ev = _signed_event(event_name, actor_uid, source, context, last_hash_prev(db))
     db.add(ev)
     db.commit()
     db.refresh(ev)
     try:
-        _broadcast_event({
-            "id": ev.id,
-            "event": event_name,
-            "actor_uid": actor_uid,
-            "source": source,
-            "ts": getattr(ev, 'ts', None).isoformat() if getattr(ev, 'ts', None) else None,
-            "context": context or {},
-        })
+        _broadcast_event(_public_row(ev))
     except Exception:
         pass
     return ev
+
+
+def sign_events_and_persist(db, events):
+    """Varios eventos [(event_name, actor_uid, source, context), ...] encadenados en orden y
+    guardados en la misma transacción que los cambios pendientes de `db` (un solo commit).
+    Devuelve los eventos como dicts (id, event, actor_uid, source, ts, context)."""
+    prev = last_hash_prev(db)
+    rows = []
+    for event_name, actor_uid, source, context in events:
+        ev = _signed_event(event_name, actor_uid, source, context, prev)
+        prev = ev.hash_prev
+        rows.append(ev)
+    db.add_all(rows)
+    db.flush()
+    payloads = [_public_row(ev) for ev in rows]   # antes del commit: evita recargar cada fila
+    db.commit()
+    for payload in payloads:
+        try:
+            _broadcast_event(payload)
+        except Exception:
+            pass
+    return payloads
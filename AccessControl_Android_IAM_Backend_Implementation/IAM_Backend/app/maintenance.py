@@ -0,0 +1,370 @@
+import binascii
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from .config import cfg
+from .db import engine, standalone_session
+from .models import EventArchiveSegment, Evento, ProcessingCursor
+from .time_utils import now_cst, ensure_cst
+
+#
+# Mantenimiento programado: retención, archivado y compactación (hilo de fondo y CLI maintenance)
+# - eventos (opcional, MAINT_EVENTOS_RETENTION_DAYS=-1 por defecto): los anteriores a la retención
+#   se mueven, en orden de id, a segmentos
+#   <MAINT_ARCHIVE_DIR>/eventos_<primero>-<último>.jsonl.gz (MAINT_ARCHIVE_SEGMENT_ROWS filas, fila
+#   completa con firma y hash). Cada segmento se registra en event_archive_segments con el hash
+#   ancla (evento previo), el hash de cabeza (su último evento) y el sha256 del archivo; después se
+#   borran las filas por lotes. verify_chain() recorre segmentos y tabla viva como una sola cadena.
+#   Nunca se archiva el último evento (ancla de la siguiente firma) ni lo que aún no consumieron los
+#   cursores incrementales (ocupación, asistencia).
+# - auth_sessions: histórico vencido (pending_sessions.purge_history, PENDING_SESSION_RETENTION_DAYS).
+# - alarm_commands: comandos procesados hace más de MAINT_ALARM_COMMANDS_RETENTION_DAYS.
+# - SQLite: PRAGMA incremental_vacuum (MAINT_VACUUM_PAGES páginas por pasada) si la BD está en
+#   auto_vacuum=INCREMENTAL (las nuevas lo están, ver app/db.py; las existentes se convierten una
+#   vez con `python -m app.cli maintenance --convert-vacuum`).
+# - Los borrados van en lotes de MAINT_DELETE_BATCH con commit entre lotes: ningún bloqueo largo.
+# - Con varios workers solo uno ejecuta cada pasada: arrendamiento en processing_cursors
+#   (name="maintenance", last_id = epoch de la última pasada) tomado con un UPDATE condicional.
+#
+
+LEASE_NAME = "maintenance"
+JOBS = ("eventos", "sessions", "alarm_commands", "vacuum")
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_last: Dict[str, object] = {}
+
+
+def _archive_dir() -> str:
+    path = os.path.abspath(cfg.MAINT_ARCHIVE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _row_dict(e: Evento) -> dict:
+    ts = ensure_cst(e.ts)
+    return {"id": e.id, "ts": ts.isoformat() if ts else None, "event": e.event, "actor_uid": e.actor_uid,
+            "source": e.source, "context": e.context, "signature": e.signature, "hash_prev": e.hash_prev}
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _delete_ids(db, table: str, ids: List[int]) -> int:
+    if not ids:
+        return 0
+    n = db.execute(text(f"DELETE FROM {table} WHERE id IN ({','.join(str(int(i)) for i in ids)})")).rowcount
+    db.commit()
+    return n
+
+
+def _archive_limit(db) -> int:
+    """Mayor id archivable: antes del último evento y de lo pendiente en los cursores."""
+    max_id = db.query(func.max(Evento.id)).scalar() or 0
+    limit = max_id - 1
+    from . import attendance, occupancy
+    names = (occupancy.CURSOR_NAME, attendance.CURSOR_NAME)   # consumidores de la bitácora (no leases)
+    cursors = [c for (c,) in db.query(ProcessingCursor.last_id).filter(ProcessingCursor.name.in_(names)).all()]
+    if cursors:
+        limit = min(limit, min(cursors))
+    return limit
+
+
+def archive_eventos(retention_days: Optional[int] = None, segment_rows: Optional[int] = None,
+                    batch: Optional[int] = None) -> dict:
+    """Archiva en segmentos comprimidos los eventos anteriores a la retención y los borra."""
+    days = cfg.MAINT_EVENTOS_RETENTION_DAYS if retention_days is None else retention_days
+    if days < 0:
+        return {"skipped": "retention disabled"}
+    segment_rows = max(1, segment_rows or cfg.MAINT_ARCHIVE_SEGMENT_ROWS)
+    batch = max(1, batch or cfg.MAINT_DELETE_BATCH)
+    cutoff = now_cst() - datetime.timedelta(days=days)
+    out = {"segments": 0, "archived": 0, "deleted": 0}
+    db = standalone_session()
+    try:
+        last = db.query(EventArchiveSegment).order_by(EventArchiveSegment.last_id.desc()).first()
+        done_upto = last.last_id if last else 0
+        anchor = last.head_hash if last else None
+        # Reanudar: filas ya archivadas que no llegaron a borrarse (corte a mitad de pasada)
+        while True:
+            ids = [i for (i,) in db.query(Evento.id).filter(Evento.id <= done_upto).order_by(Evento.id).limit(batch)]
+            if not ids:
+                break
+            out["deleted"] += _delete_ids(db, "eventos", ids)
+        upto = db.query(func.max(Evento.id)).filter(Evento.ts < cutoff, Evento.id <= _archive_limit(db)).scalar()
+        if not upto:
+            return out
+        archive_dir = _archive_dir()
+        while True:
+            rows = (db.query(Evento).filter(Evento.id > done_upto, Evento.id <= upto)
+                    .order_by(Evento.id).limit(segment_rows).all())
+            if not rows:
+                break
+            name = f"eventos_{rows[0].id:010d}-{rows[-1].id:010d}.jsonl.gz"
+            path = os.path.join(archive_dir, name)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+                    for e in rows:
+                        gz.write((json.dumps(_row_dict(e), ensure_ascii=False, sort_keys=True) + "\n").encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp, path)
+            db.add(EventArchiveSegment(first_id=rows[0].id, last_id=rows[-1].id, rows=len(rows),
+                                       first_ts=rows[0].ts, last_ts=rows[-1].ts, anchor_hash=anchor,
+                                       head_hash=rows[-1].hash_prev, file=name, sha256=_file_sha256(path)))
+            db.commit()   # el segmento queda registrado antes de borrar nada
+            ids = [e.id for e in rows]
+            anchor, done_upto = rows[-1].hash_prev, rows[-1].id
+            db.expunge_all()
+            for i in range(0, len(ids), batch):
+                out["deleted"] += _delete_ids(db, "eventos", ids[i:i + batch])
+            out["segments"] += 1
+            out["archived"] += len(ids)
+        return out
+    finally:
+        db.close()
+
+
+def purge_alarm_commands(retention_days: Optional[int] = None, batch: Optional[int] = None) -> dict:
+    """Borra por lotes los comandos de alarma procesados hace más de la retención."""
+    days = cfg.MAINT_ALARM_COMMANDS_RETENTION_DAYS if retention_days is None else retention_days
+    if days < 0:
+        return {"skipped": "retention disabled"}
+    if not inspect(engine).has_table("alarm_commands"):
+        return {"skipped": "no alarm_commands table"}
+    batch = max(1, batch or cfg.MAINT_DELETE_BATCH)
+    # processed_at lo pone CURRENT_TIMESTAMP (UTC)
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    deleted = 0
+    db = standalone_session()
+    try:
+        while True:
+            ids = [r[0] for r in db.execute(text(
+                "SELECT id FROM alarm_commands WHERE processed = 1 AND processed_at IS NOT NULL "
+                "AND processed_at < :cutoff LIMIT :n"), {"cutoff": cutoff, "n": batch})]
+            if not ids:
+                break
+            deleted += _delete_ids(db, "alarm_commands", ids)
+    finally:
+        db.close()
+    return {"deleted": deleted}
+
+
+def purge_sessions() -> dict:
+    from . import pending_sessions
+    return {"deleted": pending_sessions.purge_history(batch=max(1, cfg.MAINT_DELETE_BATCH))}
+
+
+def vacuum(pages: Optional[int] = None) -> dict:
+    """PRAGMA incremental_vacuum: devuelve al sistema hasta `pages` páginas libres (solo SQLite)."""
+    if engine.dialect.name != "sqlite":
+        return {"skipped": "not sqlite"}
+    pages = max(1, pages or cfg.MAINT_VACUUM_PAGES)
+    with engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if mode != 2:
+            return {"skipped": "auto_vacuum is not INCREMENTAL (run: python -m app.cli maintenance --convert-vacuum)",
+                    "freelist_pages": before}
+        # El driver sqlite3 ejecuta un solo paso por sentencia (1 página): se repite hasta `pages`
+        for _ in range(min(pages, before)):
+            conn.exec_driver_sql("PRAGMA incremental_vacuum(1)")
+        conn.commit()
+        after = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return {"freed_pages": before - after, "freelist_pages": after}
+
+
+def convert_vacuum() -> dict:
+    """Pasa una BD SQLite existente a auto_vacuum=INCREMENTAL (VACUUM completo, una sola vez)."""
+    if engine.dialect.name != "sqlite":
+        return {"skipped": "not sqlite"}
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cur.execute("VACUUM")
+        mode = cur.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        raw.close()
+    return {"auto_vacuum": mode}
+
+
+def _iter_segment(path: str) -> Iterator[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def verify_chain(limit_report: int = 50) -> dict:
+    """Verifica firma y hash encadenado de toda la bitácora: segmentos archivados (en orden) y
+    después la tabla viva. Un segmento ilegible se salta continuando desde su head_hash."""
+    from nacl.exceptions import BadSignatureError
+    from .logging_utils import _signing_key
+    vk = _signing_key.verify_key
+    rep = {"rows": 0, "archived_rows": 0, "segments": 0, "unsigned": 0,
+           "breaks": [], "bad_signatures": [], "bad_segments": []}
+    prev = None
+
+    def check(row: dict) -> None:
+        nonlocal prev
+        rep["rows"] += 1
+        if not row.get("signature"):
+            rep["unsigned"] += 1   # sin firmar (no encadena): el siguiente parte de su hash_prev
+            prev = row.get("hash_prev")
+            return
+        payload = json.dumps({"event": row["event"], "actor_uid": row["actor_uid"], "source": row["source"],
+                              "context": row["context"] or {}}, sort_keys=True).encode()
+        sig = binascii.a2b_base64(row["signature"])
+        try:
+            vk.verify(payload, sig)
+        except BadSignatureError:
+            rep["bad_signatures"].append(row["id"])
+        m = hashlib.sha256()
+        if prev:
+            m.update(prev.encode())
+        m.update(payload)
+        m.update(sig)
+        if m.hexdigest() != row["hash_prev"]:
+            rep["breaks"].append(row["id"])
+        prev = row["hash_prev"]   # seguir desde el valor guardado: un corte no contamina el resto
+
+    db = standalone_session()
+    try:
+        archive_dir = os.path.abspath(cfg.MAINT_ARCHIVE_DIR)
+        for seg in db.query(EventArchiveSegment).order_by(EventArchiveSegment.first_id).all():
+            rep["segments"] += 1
+            path = os.path.join(archive_dir, seg.file)
+            if seg.anchor_hash != prev:
+                rep["breaks"].append(seg.first_id)
+            if not os.path.isfile(path) or _file_sha256(path) != seg.sha256:
+                rep["bad_segments"].append(seg.file)
+                prev = seg.head_hash
+                continue
+            n0 = rep["rows"]
+            for row in _iter_segment(path):
+                check(row)
+            rep["archived_rows"] += rep["rows"] - n0
+            if prev != seg.head_hash:
+                rep["bad_segments"].append(seg.file)
+                prev = seg.head_hash
+        for e in db.query(Evento).order_by(Evento.id).yield_per(1000):
+            check(_row_dict(e))
+    finally:
+        db.close()
+    rep["ok"] = not (rep["breaks"] or rep["bad_signatures"] or rep["bad_segments"])
+    for k in ("breaks", "bad_signatures"):
+        rep[f"n_{k}"] = len(rep[k])
+        rep[k] = rep[k][:limit_report]
+    return rep
+
+
+def _claim_lease(min_interval: float) -> bool:
+    """Toma el turno de mantenimiento si nadie corrió en los últimos `min_interval` segundos."""
+    now = int(time.time())
+    db = standalone_session()
+    try:
+        if db.query(ProcessingCursor).filter(ProcessingCursor.name == LEASE_NAME).first() is None:
+            db.add(ProcessingCursor(name=LEASE_NAME, last_id=now))
+            try:
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+                return False
+        n = (db.query(ProcessingCursor)
+             .filter(ProcessingCursor.name == LEASE_NAME, ProcessingCursor.last_id <= now - min_interval)
+             .update({ProcessingCursor.last_id: now}, synchronize_session=False))
+        db.commit()
+        return bool(n)
+    finally:
+        db.close()
+
+
+def run(jobs=JOBS, force: bool = False) -> Optional[dict]:
+    """Ejecuta los trabajos indicados. Sin `force` respeta el arrendamiento entre workers y
+    devuelve None si otro proceso ya hizo la pasada."""
+    if not force and not _claim_lease(max(60, cfg.MAINT_INTERVAL_SEC) * 0.5):
+        return None
+    if force:
+        _claim_lease(0)
+    t0 = time.perf_counter()
+    results = {}
+    with _lock:
+        for job in jobs:
+            try:
+                if job == "eventos":
+                    results[job] = archive_eventos()
+                elif job == "sessions":
+                    results[job] = purge_sessions()
+                elif job == "alarm_commands":
+                    results[job] = purge_alarm_commands()
+                elif job == "vacuum":
+                    results[job] = vacuum()
+            except Exception as e:
+                results[job] = {"error": str(e)}
+        summary = {"at": now_cst().isoformat(), "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+                   "results": results}
+        _last.clear()
+        _last.update(summary)
+    # Dejar constancia firmada de lo archivado/borrado
+    try:
+        from .logging_utils import sign_event_and_persist
+        db = standalone_session()
+        try:
+            sign_event_and_persist(db, "maintenance_run", actor_uid=None, source="maintenance", context=results)
+        finally:
+            db.close()
+    except Exception as e:
+        print("[maintenance] audit event failed:", e)
+    return summary
+
+
+def status() -> dict:
+    db = standalone_session()
+    try:
+        segs, rows = db.query(func.count(EventArchiveSegment.id), func.coalesce(func.sum(EventArchiveSegment.rows), 0)).one()
+        live = db.query(func.count(Evento.id)).scalar()
+    finally:
+        db.close()
+    with _lock:
+        last = dict(_last)
+    return {"enabled": cfg.MAINT_ENABLED, "interval_sec": cfg.MAINT_INTERVAL_SEC,
+            "retention_days": {"eventos": cfg.MAINT_EVENTOS_RETENTION_DAYS,
+                               "auth_sessions": cfg.PENDING_SESSION_RETENTION_DAYS,
+                               "alarm_commands": cfg.MAINT_ALARM_COMMANDS_RETENTION_DAYS},
+            "archive": {"dir": os.path.abspath(cfg.MAINT_ARCHIVE_DIR), "segments": segs, "rows": int(rows)},
+            "eventos_live": live, "last_run": last or None}
+
+
+def _loop() -> None:
+    time.sleep(max(0, cfg.MAINT_START_DELAY_SEC))
+    while True:
+        try:
+            run()
+        except Exception as e:
+            print("[maintenance] run failed:", e)
+        time.sleep(max(60, cfg.MAINT_INTERVAL_SEC))
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or not cfg.MAINT_ENABLED:
+        return
+    _thread = threading.Thread(target=_loop, name="maintenance", daemon=True)
+    _thread.start()
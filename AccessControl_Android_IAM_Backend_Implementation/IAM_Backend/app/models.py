@@ -125,3 +125,84 @@ class ChannelKey(Base):
     key_map = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), default=now_cst)
     updated_at = Column(DateTime(timezone=True), default=now_cst, onupdate=now_cst)
+
+# Reglas de política de acceso (rol × área × horario), compiladas en memoria por app/policy.py
+class AccessPolicyRule(Base):
+    __tablename__ = "access_policy_rules"
+    id = Column(Integer, primary_key=True, index=True)
+    role = Column(String, nullable=False, default="*")       # R-EMP, R-ADM, ... o "*"
+    area = Column(String, nullable=False, default="*")       # área/puerta o grupo de mensajes, o "*"
+    action = Column(String, nullable=False, default="enter") # enter | msg_read | msg_write
+    effect = Column(String, nullable=False, default="allow") # allow | deny
+    days = Column(String, nullable=False, default="*")       # "*" o CSV 0-6 (0 = lunes), admite rangos "0-4"
+    start_time = Column(String, nullable=True)               # "HH:MM" (None = todo el día)
+    end_time = Column(String, nullable=True)                 # "HH:MM"; si end < start cruza medianoche
+    priority = Column(Integer, nullable=False, default=100)  # mayor prioridad se evalúa primero
+    enabled = Column(Boolean, nullable=False, default=True)
+    description = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), default=now_cst, onupdate=now_cst)
+
+# Cursor de procesamiento incremental de la bitácora (último Evento.id consumido por un job)
+class ProcessingCursor(Base):
+    __tablename__ = "processing_cursors"
+    name = Column(String, primary_key=True)  # p.ej. "occupancy", "attendance"
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), default=now_cst, onupdate=now_cst)
+
+# Snapshot del estado de ocupación (quién está dentro de cada área); ver app/occupancy.py
+class OccupancyState(Base):
+    __tablename__ = "occupancy_state"
+    uid = Column(String, primary_key=True)
+    area = Column(String, primary_key=True)
+    inside = Column(Boolean, nullable=False, default=False)
+    since = Column(DateTime(timezone=True), nullable=True)
+    event_id = Column(Integer, nullable=True)
+
+# Asistencia por usuario y día (GMT-6), plegada incrementalmente desde eventos; ver app/attendance.py
+class AttendanceDay(Base):
+    __tablename__ = "attendance_days"
+    uid = Column(String, primary_key=True)
+    day = Column(String(10), primary_key=True, index=True)  # YYYY-MM-DD
+    first_in = Column(DateTime(timezone=True), nullable=True)
+    last_out = Column(DateTime(timezone=True), nullable=True)
+    presence_sec = Column(Integer, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)
+    open_since = Column(DateTime(timezone=True), nullable=True)  # entrada sin salida aún
+    missing_out = Column(Integer, nullable=False, default=0)     # entradas sin salida descartadas
+    last_event_id = Column(Integer, nullable=True)
+
+# Historial compacto de salud de dispositivos (cámaras / escáneres QR); ver app/device_health.py
+class DeviceHealthSample(Base):
+    __tablename__ = "device_health"
+    id = Column(Integer, primary_key=True)
+    ts = Column(DateTime(timezone=True), default=now_cst, index=True)
+    device_key = Column(String(32), nullable=False, index=True)  # cam:<id> | qr:<id> | env:<n>
+    ok = Column(Boolean, nullable=False, default=False)
+    latency_ms = Column(Integer, nullable=True)   # hasta el primer frame / respuesta
+    fps = Column(Integer, nullable=True)          # fps × 10 (entero para una fila compacta)
+    error = Column(String(120), nullable=True)
+
+# Época de los JWT por usuario (claim "te"); incrementarla invalida los tokens ya emitidos.
+# Ver app/identity_cache.py
+class TokenEpoch(Base):
+    __tablename__ = "token_epochs"
+    uid = Column(String, primary_key=True)
+    epoch = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), default=now_cst, onupdate=now_cst)
+
+# Segmentos de bitácora archivados (eventos antiguos movidos a <dir>/<archivo>.jsonl.gz); ver
+# app/maintenance.py. anchor_hash es el hash del evento previo al segmento y head_hash el del
+# último evento del segmento: la cadena se verifica de segmento en segmento hasta la tabla viva.
+class EventArchiveSegment(Base):
+    __tablename__ = "event_archive_segments"
+    id = Column(Integer, primary_key=True)
+    first_id = Column(Integer, nullable=False, index=True)
+    last_id = Column(Integer, nullable=False, index=True)
+    rows = Column(Integer, nullable=False)
+    first_ts = Column(DateTime(timezone=True), nullable=True)
+    last_ts = Column(DateTime(timezone=True), nullable=True)
+    anchor_hash = Column(String, nullable=True)
+    head_hash = Column(String, nullable=True)
+    file = Column(String, nullable=False)         # nombre dentro de MAINT_ARCHIVE_DIR
+    sha256 = Column(String(64), nullable=False)   # del archivo comprimido
+    created_at = Column(DateTime(timezone=True), default=now_cst)
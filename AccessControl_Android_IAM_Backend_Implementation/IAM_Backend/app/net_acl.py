@@ -1,24 +1,160 @@
 import ipaddress
-from typing import List
+import os
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from .config import cfg
+
+#
+# ACL por IP (before_request en app/__init__.py)
+# - Los CIDR se compilan una vez en tablas de intervalos enteros ordenados y fusionados, una por
+#   familia (IPv4 / IPv6); comprobar una IP es una búsqueda binaria (bisect), sin reparsear nada.
+# - Políticas por prefijo de ruta (ACL_POLICIES, gana el prefijo más largo), p. ej. lectores NFC
+#   desde la red de planta y administración solo desde localhost; "*" = cualquier IP. El resto de
+#   rutas usa ALLOWED_IP_RANGES.
+# - Rutas públicas (páginas y estáticos) por conjunto exacto y extensión (nunca bajo /api/), sin
+#   recorrer sufijos.
+# - X-Forwarded-For solo se atiende si la conexión viene de un proxy de confianza (TRUSTED_PROXIES):
+#   se recorre de derecha a izquierda saltando proxies de confianza y el primer salto ajeno es el
+#   cliente. Sin proxy de confianza la cabecera se ignora (no se puede falsear la IP de origen).
+# - LRU de decisiones recientes (política, IP) → permitido (ACL_CACHE_SIZE).
+#
+
+PUBLIC_PATHS = frozenset({"/health", "/favicon.ico", "/", "/login.html", "/app.html", "/qr.html"})
+PUBLIC_EXTENSIONS = frozenset({".html", ".css", ".js", ".png", ".ico", ".svg", ".jpg", ".jpeg", ".webp"})
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+class IntervalSet:
+    """Rangos CIDR como intervalos [inicio, fin] enteros, ordenados y sin solapes, por familia."""
+
+    def __init__(self, cidrs: List[str], allow_all: bool = False):
+        self.allow_all = allow_all
+        self._tables: Dict[int, Tuple[List[int], List[int]]] = {}
+        by_version: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for cidr in cidrs:
+            try:
+                net = ipaddress.ip_network(cidr.strip(), strict=False)
+            except ValueError:
+                continue   # CIDR mal escrito: lo ignoramos
+            by_version[net.version].append((int(net.network_address), int(net.broadcast_address)))
+        for version, ranges in by_version.items():
+            starts: List[int] = []
+            ends: List[int] = []
+            for lo, hi in sorted(ranges):
+                if ends and lo <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], hi)   # contiguo o solapado: se fusiona
+                else:
+                    starts.append(lo)
+                    ends.append(hi)
+            self._tables[version] = (starts, ends)
+
+    def __contains__(self, ip: Optional[IPAddress]) -> bool:
+        if ip is None:
+            return False
+        if self.allow_all:
+            return True
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped   # ::ffff:a.b.c.d (sockets de doble pila)
+        starts, ends = self._tables[ip.version]
+        n = int(ip)
+        i = bisect_right(starts, n) - 1
+        return i >= 0 and n <= ends[i]
+
+    def __len__(self) -> int:
+        return sum(len(s) for s, _ in self._tables.values())
+
+
+def _parse_ip(value: Optional[str]) -> Optional[IPAddress]:
+    if not value:
+        return None
+    try:
+        return ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+
+
+def parse_policies(spec: str) -> List[Tuple[str, List[str]]]:
+    """"/api/nfc/=10.0.0.0/8,192.168.0.0/16;/api/admin/=127.0.0.1/32" → [(prefijo, [cidr, ...])]."""
+    out = []
+    for item in (spec or "").split(";"):
+        prefix, sep, cidrs = item.partition("=")
+        if sep and prefix.strip():
+            out.append((prefix.strip(), [c.strip() for c in cidrs.split(",") if c.strip()]))
+    return out
+
+
+class CompiledACL:
+    def __init__(self, default_cidrs: List[str], policies: List[Tuple[str, List[str]]],
+                 trusted_proxies: List[str], cache_size: int = 4096):
+        self.default = IntervalSet(default_cidrs)
+        # Más largo primero: el primer prefijo que encaja es el más específico
+        self.policies = [(p, IntervalSet(c, allow_all="*" in c)) for p, c in
+                         sorted(policies, key=lambda pc: len(pc[0]), reverse=True)]
+        self.trusted = IntervalSet(trusted_proxies)
+        self._decide = lru_cache(maxsize=max(1, cache_size))(self._decide_uncached)
+
+    @staticmethod
+    def is_public(path: str) -> bool:
+        if path in PUBLIC_PATHS or path.startswith("/static/"):
+            return True
+        # Por extensión solo fuera de /api/ (p. ej. /api/x.png no salta la ACL)
+        return not path.startswith("/api/") and os.path.splitext(path)[1].lower() in PUBLIC_EXTENSIONS
+
+    def policy_for(self, path: str) -> int:
+        """Índice de la política que aplica a `path` (-1 = ALLOWED_IP_RANGES)."""
+        for i, (prefix, _) in enumerate(self.policies):
+            if path.startswith(prefix):
+                return i
+        return -1
+
+    def client_ip(self, remote_addr: Optional[str], forwarded_for: Optional[str] = None) -> Optional[str]:
+        """IP del cliente: remote_addr, o el primer salto no confiable de X-Forwarded-For si la
+        conexión llega desde un proxy de confianza."""
+        if not forwarded_for or _parse_ip(remote_addr) not in self.trusted:
+            return remote_addr
+        hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+        for hop in reversed(hops):
+            if _parse_ip(hop) not in self.trusted:
+                return hop   # inválida incluida: se deniega después
+        return hops[0] if hops else remote_addr
+
+    def _decide_uncached(self, policy: int, ip: Optional[str]) -> bool:
+        ranges = self.policies[policy][1] if policy >= 0 else self.default
+        return _parse_ip(ip) in ranges
+
+    def allowed(self, ip: Optional[str], path: str) -> bool:
+        return self._decide(self.policy_for(path), ip)
+
+    def stats(self) -> dict:
+        info = self._decide.cache_info()
+        return {"default_intervals": len(self.default), "trusted_intervals": len(self.trusted),
+                "policies": [{"prefix": p, "intervals": len(r), "any": r.allow_all} for p, r in self.policies],
+                "cache": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max": info.maxsize}}
+
+
+_acl: Optional[CompiledACL] = None
+
+
+def get_acl() -> CompiledACL:
+    """ACL compilada desde la configuración (una vez por proceso)."""
+    global _acl
+    if _acl is None:
+        _acl = CompiledACL(cfg.ALLOWED_IP_RANGES, parse_policies(cfg.ACL_POLICIES),
+                           cfg.TRUSTED_PROXIES, cfg.ACL_CACHE_SIZE)
+    return _acl
+
+
+@lru_cache(maxsize=32)
+def _compiled(cidrs: Tuple[str, ...]) -> IntervalSet:
+    return IntervalSet(list(cidrs))
+
 
 def ip_allowed(remote_addr: str, cidrs: List[str]) -> bool:
     """
     Devuelve True si la IP remota cae dentro de alguno de los rangos CIDR permitidos.
     Acepta IPv4/IPv6. Si remote_addr es None o inválida, devuelve False.
     """
-    if not remote_addr:
-        return False
-    try:
-        ip = ipaddress.ip_address(remote_addr)
-    except ValueError:
-        return False
-
-    for cidr in cidrs:
-        try:
-            net = ipaddress.ip_network(cidr, strict=False)
-            if ip in net:
-                return True
-        except ValueError:
-            # CIDR mal escrito: lo ignoramos
-            continue
-    return False
+    return _parse_ip(remote_addr) in _compiled(tuple(cidrs))
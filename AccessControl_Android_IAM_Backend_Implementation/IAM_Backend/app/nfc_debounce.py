@@ -0,0 +1,118 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from .config import cfg
+from .db import standalone_session
+from .models import Evento
+
+#
+# Debounce de lecturas NFC (en memoria de proceso)
+# - Los lectores Android reenvían la misma tarjeta varias veces mientras se mantiene apoyada.
+# - Dentro de la ventana NFC_DEBOUNCE_MS, (device_id, uid) repetido devuelve la decisión en caché
+#   sin consultar BD ni crear un Evento nuevo.
+# - Al expirar la entrada, el número de repeticiones se anota en el Evento original
+#   (context.repeat_count), de modo que queda una sola fila por toque.
+#
+
+_Key = Tuple[str, str, bool]
+
+_lock = threading.Lock()
+_entries: "OrderedDict[_Key, dict]" = OrderedDict()
+_last_sweep = 0.0
+
+
+def _window() -> float:
+    return max(0, cfg.NFC_DEBOUNCE_MS) / 1000.0
+
+
+def lookup(device_id: str, nfc_uid: str, password_valid: bool) -> Optional[dict]:
+    """Devuelve la respuesta en caché si es una repetición dentro de la ventana, si no None."""
+    window = _window()
+    if window <= 0:
+        return None
+    now = time.monotonic()
+    key = (device_id or "", nfc_uid, password_valid)
+    with _lock:
+        rec = _entries.get(key)
+        if rec is not None and now - rec["ts"] <= window:
+            rec["repeats"] += 1
+            out = dict(rec["payload"])
+            out["debounced"] = True
+            out["repeat_count"] = rec["repeats"]
+            return out
+    _maybe_sweep(now)
+    return None
+
+
+def remember(device_id: str, nfc_uid: str, password_valid: bool, payload: dict, event_id: Optional[int]) -> None:
+    """Guarda la decisión recién calculada para responder a las repeticiones."""
+    if _window() <= 0:
+        return
+    key = (device_id or "", nfc_uid, password_valid)
+    evicted = []
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            evicted.append(old)
+        _entries[key] = {"ts": time.monotonic(), "payload": payload, "event_id": event_id, "repeats": 0}
+        while len(_entries) > cfg.NFC_DEBOUNCE_MAX_ENTRIES:
+            evicted.append(_entries.popitem(last=False)[1])
+    _persist_repeats(evicted)
+
+
+def invalidate(nfc_uid: str) -> None:
+    """Descarta decisiones en caché de una tarjeta (tras asignación/revocación)."""
+    if not nfc_uid:
+        return
+    with _lock:
+        dropped = [_entries.pop(k) for k in list(_entries) if k[1] == nfc_uid]
+    _persist_repeats(dropped)
+
+
+def _maybe_sweep(now: float) -> None:
+    global _last_sweep
+    window = _window()
+    with _lock:
+        if now - _last_sweep < window:
+            return
+        _last_sweep = now
+        # OrderedDict en orden de inserción: las expiradas están al principio
+        expired = []
+        while _entries:
+            key, rec = next(iter(_entries.items()))
+            if now - rec["ts"] <= window:
+                break
+            expired.append(_entries.pop(key))
+    _persist_repeats(expired)
+
+
+def flush() -> None:
+    """Vacía la caché anotando las repeticiones pendientes (p. ej. al apagar)."""
+    with _lock:
+        pending = list(_entries.values())
+        _entries.clear()
+    _persist_repeats(pending)
+
+
+def _persist_repeats(records) -> None:
+    counts = {r["event_id"]: r["repeats"] for r in records if r.get("event_id") and r.get("repeats")}
+    if not counts:
+        return
+    db = standalone_session()
+    try:
+        for ev in db.query(Evento).filter(Evento.id.in_(list(counts))).all():
+            ctx = dict(ev.context or {})
+            ctx["repeat_count"] = int(ctx.get("repeat_count", 0)) + counts[ev.id]
+            ev.context = ctx
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print("[nfc_debounce] repeat_count update failed:", e)
+    finally:
+        db.close()
+
+
+atexit.register(flush)
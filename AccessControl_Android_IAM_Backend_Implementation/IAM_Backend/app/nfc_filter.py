@@ -0,0 +1,291 @@
+import atexit
+import base64
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .config import cfg
+from .db import standalone_session
+from .models import Usuario
+from .logging_utils import sign_event_and_persist
+
+#
+# Filtro de rechazo rápido para UIDs NFC desconocidos
+# - Bloom filter en memoria con los nfc_uid registrados (sin falsos negativos).
+# - Si el filtro dice "no está", la tarjeta NO está registrada y se evita la consulta a BD.
+# - Si dice "puede estar", se consulta la BD como siempre (falso positivo ≈ NFC_FILTER_FP_RATE).
+# - Los rechazos de tarjetas desconocidas se agregan por (dispositivo, ventana) en una sola fila.
+# - Varios workers: add_uid/remove_uid tocan NFC_FILTER_SIGNAL_PATH tras el commit; cada proceso
+#   compara su mtime (un stat por consulta) y reconstruye antes de responder si cambió, así una
+#   tarjeta asignada en otro worker nunca se rechaza. Sin archivo de señal, solo la reconstrucción
+#   periódica (NFC_FILTER_REFRESH_SEC) recoge esos cambios.
+# - La versión/ETag de /api/nfc/filter es un hash del contenido (m, k, bits): igual en todos los
+#   workers para el mismo filtro.
+#
+# Esquema de hash (lo replican los lectores que descargan el filtro):
+#   d  = sha256(uid.encode("utf-8"))
+#   h1 = int(d[0:8], big-endian);  h2 = int(d[8:16], big-endian) | 1
+#   bit_i = (h1 + i * h2) mod m,   i = 0..k-1   (bit j → byte j // 8, máscara 1 << (j % 8))
+#
+
+
+class BloomFilter:
+    """Bloom filter compacto sobre bytearray (double hashing con SHA-256)."""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        n = max(1, int(capacity))
+        p = min(max(float(fp_rate), 1e-9), 0.5)
+        self.m = max(64, int(math.ceil(-n * math.log(p) / (math.log(2) ** 2))))
+        self.k = max(1, int(round((self.m / n) * math.log(2))))
+        self.capacity = n
+        self.count = 0
+        self.bits = bytearray((self.m + 7) // 8)
+
+    def _indexes(self, key: str):
+        d = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(d[0:8], "big")
+        h2 = int.from_bytes(d[8:16], "big") | 1
+        m = self.m
+        for i in range(self.k):
+            yield (h1 + i * h2) % m
+
+    def add(self, key: str) -> None:
+        for j in self._indexes(key):
+            self.bits[j >> 3] |= 1 << (j & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        for j in self._indexes(key):
+            if not bits[j >> 3] & (1 << (j & 7)):
+                return False
+        return True
+
+
+_lock = threading.Lock()
+_filter: Optional[BloomFilter] = None
+_built_at = 0.0
+_built_signal: Optional[int] = None  # mtime del archivo de señal visto al reconstruir
+_stale = 0  # UIDs que ya no están asignados pero siguen en el filtro
+_recent_adds: list[Tuple[float, str]] = []  # altas recientes, para no perderlas durante un rebuild
+
+
+def _signal_stat() -> Optional[int]:
+    try:
+        return os.stat(cfg.NFC_FILTER_SIGNAL_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _touch_signal() -> None:
+    """Avisa a los demás workers de un alta/baja (llamar tras el commit)."""
+    global _built_signal
+    path = cfg.NFC_FILTER_SIGNAL_PATH
+    if not path:
+        return
+    try:
+        seen = _signal_stat()
+        with open(path, "a"):
+            os.utime(path, None)
+        with _lock:
+            # El propio filtro ya tiene el cambio: no reconstruir salvo que otro worker
+            # haya tocado la señal desde la última reconstrucción
+            if seen == _built_signal:
+                _built_signal = _signal_stat()
+    except OSError as e:
+        print("[nfc_filter] signal write failed:", e)
+
+
+def rebuild() -> BloomFilter:
+    """Reconstruye el filtro desde la BD (todas las tarjetas con nfc_uid asignado)."""
+    global _filter, _built_at, _built_signal, _stale
+    t0 = time.time()
+    signal = _signal_stat()  # antes de la consulta: un cambio posterior fuerza otro rebuild
+    db = standalone_session()
+    try:
+        uids = [row[0] for row in db.query(Usuario.nfc_uid).filter(Usuario.nfc_uid != None).all()]  # noqa: E711
+    finally:
+        db.close()
+    bf = BloomFilter(max(cfg.NFC_FILTER_CAPACITY, 2 * len(uids)), cfg.NFC_FILTER_FP_RATE)
+    for uid in uids:
+        if uid:
+            bf.add(uid)
+    with _lock:
+        # Re-aplicar altas concurrentes a la consulta (pudieron no estar confirmadas aún)
+        _recent_adds[:] = [(ts, u) for ts, u in _recent_adds if ts >= t0 - 5]
+        for _, u in _recent_adds:
+            bf.add(u)
+        _filter = bf
+        _built_at = time.time()
+        _built_signal = signal
+        _stale = 0
+    return bf
+
+
+_rebuild_lock = threading.Lock()
+
+
+def _current() -> BloomFilter:
+    bf = _filter
+    if bf is None:
+        with _rebuild_lock:
+            return _filter or rebuild()
+    if cfg.NFC_FILTER_SIGNAL_PATH and _signal_stat() != _built_signal:
+        # Otro worker asignó o liberó tarjetas: esperar al rebuild (sin falsos negativos)
+        with _rebuild_lock:
+            if _signal_stat() != _built_signal:
+                return rebuild()
+            return _filter
+    if (time.time() - _built_at) > cfg.NFC_FILTER_REFRESH_SEC and _rebuild_lock.acquire(blocking=False):
+        # Un solo hilo reconstruye; el resto sigue con el filtro vigente
+        try:
+            bf = rebuild()
+        finally:
+            _rebuild_lock.release()
+    return bf
+
+
+def might_be_registered(nfc_uid: str) -> bool:
+    """False ⇒ el UID seguro no está registrado. True ⇒ consultar BD."""
+    if not nfc_uid:
+        return False
+    try:
+        return nfc_uid in _current()
+    except Exception:
+        # Ante cualquier fallo del filtro, no bloquear: ir a BD
+        return True
+
+
+def add_uid(nfc_uid: str) -> None:
+    """Alta incremental tras /api/nfc/assign (después del commit)."""
+    if not nfc_uid:
+        return
+    with _lock:
+        _recent_adds.append((time.time(), nfc_uid))
+        bf = _filter
+        if bf is not None:
+            bf.add(nfc_uid)
+        overfull = bf is not None and bf.count > bf.capacity
+    _touch_signal()
+    if overfull:
+        rebuild()
+
+
+def remove_uid(nfc_uid: str) -> None:
+    """Baja de un UID (reasignación/liberación). El Bloom no borra: se cuenta como obsoleto
+    y se reconstruye cuando los obsoletos superan el 10% del contenido."""
+    global _stale
+    if not nfc_uid:
+        return
+    with _lock:
+        bf = _filter
+        if bf is not None:
+            _stale += 1
+        needs_rebuild = bf is not None and _stale > max(16, bf.count // 10)
+    _touch_signal()
+    if needs_rebuild:
+        rebuild()
+
+
+def _content_version(bf: BloomFilter) -> str:
+    # Llamar con _lock tomado
+    h = hashlib.sha256(f"{bf.m}:{bf.k}:".encode())
+    h.update(bf.bits)
+    return h.hexdigest()[:16]
+
+
+def export_filter() -> dict:
+    """Filtro serializado para descarga por lectores (bits en base64)."""
+    bf = _current()
+    with _lock:
+        return {
+            "version": _content_version(bf),
+            "algorithm": "bloom-sha256-double-hash",
+            "m": bf.m,
+            "k": bf.k,
+            "count": bf.count,
+            "fp_rate": cfg.NFC_FILTER_FP_RATE,
+            "bits_b64": base64.b64encode(bytes(bf.bits)).decode(),
+        }
+
+
+def filter_version() -> str:
+    """Hash del contenido del filtro vigente (mismo valor en todos los workers)."""
+    bf = _current()
+    with _lock:
+        return _content_version(bf)
+
+
+# ---------------------------
+# Registro agregado de rechazos por tarjeta desconocida
+# ---------------------------
+_agg_lock = threading.Lock()
+_agg: Dict[Tuple[str, int], dict] = {}
+_flusher: Optional[threading.Thread] = None
+MAX_SAMPLES = 5
+
+
+def _window_start(ts: float) -> int:
+    w = max(1, cfg.NFC_UNKNOWN_AGG_WINDOW_SEC)
+    return int(ts // w) * w
+
+
+def record_unknown_reject(device_id: str, nfc_uid: str) -> None:
+    """Acumula un rechazo card_not_registered en la ventana actual del dispositivo."""
+    key = (device_id or "unknown", _window_start(time.time()))
+    tail = nfc_uid[-4:] if len(nfc_uid) >= 4 else nfc_uid
+    with _agg_lock:
+        rec = _agg.get(key)
+        if rec is None:
+            rec = _agg[key] = {"count": 0, "samples": []}
+        rec["count"] += 1
+        if tail not in rec["samples"] and len(rec["samples"]) < MAX_SAMPLES:
+            rec["samples"].append(tail)
+    _ensure_flusher()
+
+
+def flush_unknown_rejects(force: bool = False) -> int:
+    """Persiste las ventanas cerradas (o todas si force) como un evento por dispositivo/ventana."""
+    now_w = _window_start(time.time())
+    with _agg_lock:
+        keys = [k for k in _agg if force or k[1] < now_w]
+        batch = [(k, _agg.pop(k)) for k in keys]
+    if not batch:
+        return 0
+    db = standalone_session()
+    try:
+        for (device_id, w_start), rec in batch:
+            sign_event_and_persist(db, "nfc_scan_denied", actor_uid=None, source=device_id, context={
+                "reason": "card_not_registered",
+                "aggregated": True,
+                "count": rec["count"],
+                "window_start": w_start,
+                "window_sec": cfg.NFC_UNKNOWN_AGG_WINDOW_SEC,
+                "nfc_uid_truncated": rec["samples"],
+            })
+    except Exception as e:
+        print("[nfc_filter] flush failed:", e)
+    finally:
+        db.close()
+    return len(batch)
+
+
+def _flush_loop():
+    while True:
+        w = max(1, cfg.NFC_UNKNOWN_AGG_WINDOW_SEC)
+        time.sleep(w - (time.time() % w) + 0.05)
+        flush_unknown_rejects()
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is not None:
+        return
+    with _agg_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="nfc-unknown-flush", daemon=True)
+            _flusher.start()
+            atexit.register(flush_unknown_rejects, True)
@@ -0,0 +1,226 @@
+import atexit
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import func
+
+from .config import cfg
+from .db import standalone_session
+from .models import Evento, OccupancyState, ProcessingCursor
+from .time_utils import now_cst, ensure_cst
+
+#
+# Ocupación en tiempo real y anti-passback
+# - Un hilo consume la bitácora de forma incremental (Evento.id > cursor) y mantiene en memoria:
+#     · por usuario y área: dentro/fuera, desde cuándo y el evento que lo cambió
+#     · por área: conjunto de UIDs dentro
+# - Eventos consumidos: access_granted, nfc_scan_granted (qr_scanned_ok es el 2º factor del
+#   login web, no un paso por puerta).
+#   Área = area_key(context.area, source del evento), igual en vivo y al reproducir. Dirección = context.direction ("in"/"out");
+#   sin dirección, cada acceso concedido alterna dentro/fuera.
+# - El estado se persiste cada OCCUPANCY_SNAPSHOT_SEC en occupancy_state (+ cursor en
+#   processing_cursors) y se recupera al arrancar, reproduciendo solo los eventos nuevos.
+# - /api/nfc/scan aplica sus concesiones directamente (observe) para que el anti-passback
+#   vea el estado al instante y sin consultas extra (después del commit: un escaneo revertido
+#   no cambia la ocupación).
+#
+
+ACCESS_EVENTS = ("access_granted", "nfc_scan_granted")
+CURSOR_NAME = "occupancy"
+BATCH = 1000
+
+_lock = threading.Lock()
+_users: Dict[str, Dict[str, dict]] = {}   # uid -> area -> {"inside", "since", "event_id"}
+_areas: Dict[str, set] = {}               # area -> {uid dentro}
+_cursor = 0
+_applied_ahead: set = set()               # ids aplicados por observe() antes que el consumidor
+_dirty = False
+_thread: Optional[threading.Thread] = None
+
+
+def direction_of(ctx: Optional[dict]) -> Optional[str]:
+    d = str((ctx or {}).get("direction") or "").strip().lower()
+    return d if d in ("in", "out") else None
+
+
+def area_key(area: Optional[str], source: Optional[str] = None) -> str:
+    """Clave de área: la del evento, o su source (lector) si no trae área."""
+    return area or source or "unknown"
+
+
+def _apply(uid: str, area: str, direction: Optional[str], ts, event_id: Optional[int]) -> None:
+    global _dirty
+    per_user = _users.setdefault(uid, {})
+    st = per_user.get(area)
+    inside = (direction == "in") if direction else not (st and st["inside"])
+    per_user[area] = {"inside": inside, "since": ts, "event_id": event_id}
+    members = _areas.setdefault(area, set())
+    if inside:
+        members.add(uid)
+    else:
+        members.discard(uid)
+    _dirty = True
+
+
+def observe(event_id: Optional[int], uid: str, area: Optional[str], direction: Optional[str], ts=None,
+            source: Optional[str] = None) -> None:
+    """Aplica un acceso concedido y ya confirmado (camino NFC); el consumidor lo omitirá después."""
+    if not uid:
+        return
+    with _lock:
+        if event_id is not None:
+            if event_id <= _cursor:
+                return
+            _applied_ahead.add(event_id)
+        _apply(uid, area_key(area, source), direction, ts or now_cst(), event_id)
+
+
+def check_passback(uid: str, area: Optional[str], direction: Optional[str],
+                   source: Optional[str] = None) -> Optional[str]:
+    """Motivo de rechazo anti-passback o None. Solo aplica con dirección explícita."""
+    if not direction or not uid:
+        return None
+    with _lock:
+        st = _users.get(uid, {}).get(area_key(area, source))
+        inside = bool(st and st["inside"])
+    if direction == "in" and inside:
+        return "anti_passback_already_inside"
+    if direction == "out" and not inside:
+        return "anti_passback_not_inside"
+    return None
+
+
+def occupancy(area: Optional[str] = None) -> dict:
+    """{área: {"count", "uids"}} (o solo el área pedida)."""
+    with _lock:
+        areas = {area: _areas.get(area, set())} if area else dict(_areas)
+        return {a: {"count": len(u), "uids": sorted(u)} for a, u in areas.items()}
+
+
+def user_state(uid: str) -> dict:
+    with _lock:
+        return {a: {"inside": st["inside"],
+                    "since": st["since"].isoformat() if st["since"] else None,
+                    "event_id": st["event_id"]}
+                for a, st in _users.get(uid, {}).items()}
+
+
+def cursor() -> int:
+    return _cursor
+
+
+# ---------------------------
+# Consumidor incremental + snapshots
+# ---------------------------
+def _load_snapshot() -> None:
+    global _cursor
+    db = standalone_session()
+    try:
+        cur = db.query(ProcessingCursor).filter(ProcessingCursor.name == CURSOR_NAME).first()
+        rows = db.query(OccupancyState).all()
+    finally:
+        db.close()
+    with _lock:
+        _users.clear(); _areas.clear(); _applied_ahead.clear()
+        for r in rows:
+            _users.setdefault(r.uid, {})[r.area] = {"inside": bool(r.inside), "since": ensure_cst(r.since),
+                                                     "event_id": r.event_id}
+            if r.inside:
+                _areas.setdefault(r.area, set()).add(r.uid)
+        _cursor = cur.last_id if cur else 0
+
+
+def poll_once() -> int:
+    """Consume los eventos nuevos (id > cursor). Devuelve cuántos aplicó."""
+    global _cursor
+    db = standalone_session()
+    try:
+        max_id = db.query(func.max(Evento.id)).scalar() or 0
+        if max_id < _cursor:
+            # IDs reiniciados (wipe-db): estado inválido, empezar de cero
+            with _lock:
+                _users.clear(); _areas.clear(); _applied_ahead.clear()
+                _cursor = 0
+        if max_id == _cursor:
+            return 0
+        upper = min(max_id, _cursor + BATCH * 10)
+        rows = (db.query(Evento.id, Evento.ts, Evento.actor_uid, Evento.source, Evento.context)
+                .filter(Evento.id > _cursor, Evento.id <= upper, Evento.event.in_(ACCESS_EVENTS))
+                .order_by(Evento.id.asc()).all())
+    finally:
+        db.close()
+    applied = 0
+    with _lock:
+        for ev_id, ts, uid, source, ctx in rows:
+            if ev_id in _applied_ahead:
+                _applied_ahead.discard(ev_id)
+                continue
+            if not uid:
+                continue
+            ctx = ctx or {}
+            _apply(uid, area_key(ctx.get("area"), source), direction_of(ctx), ensure_cst(ts), ev_id)
+            applied += 1
+        _cursor = upper
+        _applied_ahead.difference_update({i for i in _applied_ahead if i <= upper})
+    return applied
+
+
+def snapshot() -> None:
+    """Persiste el estado y el cursor en una sola transacción."""
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        rows = [(uid, area, dict(st)) for uid, areas in _users.items() for area, st in areas.items()]
+        cur = _cursor
+        _dirty = False
+    db = standalone_session()
+    try:
+        db.query(OccupancyState).delete(synchronize_session=False)
+        db.bulk_save_objects([OccupancyState(uid=uid, area=area, inside=st["inside"], since=st["since"],
+                                             event_id=st["event_id"]) for uid, area, st in rows])
+        rec = db.query(ProcessingCursor).filter(ProcessingCursor.name == CURSOR_NAME).first()
+        if rec is None:
+            db.add(ProcessingCursor(name=CURSOR_NAME, last_id=cur))
+        else:
+            rec.last_id = cur
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        _dirty = True
+        print("[occupancy] snapshot failed:", e)
+    finally:
+        db.close()
+
+
+def _loop() -> None:
+    last_snap = time.monotonic()
+    while True:
+        try:
+            poll_once()
+            if time.monotonic() - last_snap >= cfg.OCCUPANCY_SNAPSHOT_SEC:
+                snapshot()
+                last_snap = time.monotonic()
+        except Exception as e:
+            print("[occupancy] poll failed:", e)
+        time.sleep(max(0.1, cfg.OCCUPANCY_POLL_SEC))
+
+
+def start() -> None:
+    """Carga el último snapshot, se pone al día y arranca el consumidor en segundo plano."""
+    global _thread
+    if _thread is not None or not cfg.OCCUPANCY_ENABLED:
+        return
+    try:
+        _load_snapshot()
+        while True:
+            before = _cursor
+            poll_once()
+            if _cursor == before:
+                break
+    except Exception as e:
+        print("[occupancy] initial load failed:", e)
+    _thread = threading.Thread(target=_loop, name="occupancy-consumer", daemon=True)
+    _thread.start()
+    atexit.register(snapshot)
@@ -0,0 +1,387 @@
+import datetime
+import heapq
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .config import cfg
+from .db import standalone_session
+from .models import AuthSession
+from .time_utils import now_cst, ensure_cst
+
+#
+# Sesiones pendientes de login (contraseña correcta → falta escanear el QR en QR_TTL_SECONDS)
+# - Almacén enchufable (PENDING_SESSION_STORE):
+#     · memory: dict en el proceso, sin tocar la BD; las sesiones cerradas se conservan
+#       PENDING_SESSION_KEEP_SEC (para responder "expirada" en vez de "no existe") y luego se olvidan.
+#       Requiere que /api/auth/login y /api/qr/scan lleguen al mismo proceso (un worker).
+#     · db: filas AuthSession (varios procesos); cada worker reclama las vencidas con un UPDATE
+#       condicional, así que el evento de expiración se emite una sola vez.
+# - La expiración la dispara un temporizador (hilo de fondo que duerme hasta el próximo
+#   vencimiento; con db sondea cada PENDING_SESSION_POLL_SEC) y emite qr_session_expired en el
+#   momento, sin esperar a que alguien vuelva a tocar la sesión. /api/qr/scan y /api/qr/timeout
+#   usan expire() si llegan antes que el temporizador; el evento sigue saliendo una sola vez.
+# - Retención: purge_history() borra por lotes las filas de auth_sessions vencidas hace más de
+#   PENDING_SESSION_RETENTION_DAYS (histórico del backend db y filas anteriores); la ejecuta el
+#   mantenimiento programado (app/maintenance.py).
+#
+
+OPEN_STATES = ("pending", "mfa_required", "failed")   # aún pueden completarse o expirar
+PURGE_BATCH = 500
+
+
+class PendingSession:
+    __slots__ = ("session_id", "uid", "state", "created_at", "expires_at", "context")
+
+    def __init__(self, session_id, uid, state, created_at, expires_at, context=None):
+        self.session_id = session_id
+        self.uid = uid
+        self.state = state
+        self.created_at = ensure_cst(created_at)
+        self.expires_at = ensure_cst(expires_at)
+        self.context = context
+
+    def copy(self) -> "PendingSession":
+        return PendingSession(self.session_id, self.uid, self.state, self.created_at, self.expires_at, self.context)
+
+    def is_expired(self, now: Optional[datetime.datetime] = None) -> bool:
+        return self.expires_at is not None and self.expires_at <= (now or now_cst())
+
+    def as_dict(self) -> dict:
+        return {"session_id": self.session_id, "uid": self.uid, "state": self.state,
+                "created_at": self.created_at.isoformat() if self.created_at else None,
+                "expires_at": self.expires_at.isoformat() if self.expires_at else None}
+
+
+class SessionStore(ABC):
+    """Interfaz común de los backends."""
+    backend = "base"
+
+    @abstractmethod
+    def create(self, uid: str, ttl_sec: int, context: Optional[dict] = None) -> PendingSession:
+        ...
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[PendingSession]:
+        ...
+
+    @abstractmethod
+    def set_state(self, session_id: str, state: str) -> bool:
+        ...
+
+    @abstractmethod
+    def expire(self, session_id: str, force: bool = False) -> Optional[PendingSession]:
+        """Pasa a expired una sesión abierta (vencida, o cualquiera si force). Devuelve la sesión
+        si esta llamada hizo la transición (quien la hace emite el evento) o None."""
+
+    @abstractmethod
+    def due(self) -> List[PendingSession]:
+        """Expira y devuelve las sesiones abiertas ya vencidas."""
+
+    def next_deadline(self) -> Optional[float]:
+        """time.time() del próximo vencimiento conocido, o None (sondeo periódico)."""
+        return None
+
+    def recent(self, limit: int = 300) -> List[dict]:
+        """Sesiones que no están en auth_sessions (solo memory) para el volcado del panel."""
+        return []
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    backend = "memory"
+
+    def __init__(self, keep_sec: int = 300, max_sessions: int = 100000):
+        self.keep_sec = max(0, int(keep_sec))
+        self.max_sessions = max(1, int(max_sessions))
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, PendingSession]" = OrderedDict()   # orden de creación
+        self._heap: List[tuple] = []   # (vencimiento epoch, session_id)
+        self._stats = {"created": 0, "completed": 0, "failed": 0, "expired": 0, "evicted": 0}
+
+    def create(self, uid, ttl_sec, context=None):
+        now = now_cst()
+        sess = PendingSession(str(uuid.uuid4()), uid, "pending", now,
+                              now + datetime.timedelta(seconds=ttl_sec), context)
+        with self._lock:
+            self._sessions[sess.session_id] = sess
+            heapq.heappush(self._heap, (sess.expires_at.timestamp(), sess.session_id))
+            self._stats["created"] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._stats["evicted"] += 1
+        return sess.copy()
+
+    def get(self, session_id):
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            return sess.copy() if sess else None
+
+    def set_state(self, session_id, state):
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is None:
+                return False
+            sess.state = state
+            if state in self._stats:
+                self._stats[state] += 1
+            return True
+
+    def _expire_locked(self, sess, now, force) -> Optional[PendingSession]:
+        if sess is None or sess.state not in OPEN_STATES or not (force or sess.is_expired(now)):
+            return None
+        sess.state = "expired"
+        self._stats["expired"] += 1
+        return sess.copy()
+
+    def expire(self, session_id, force=False):
+        with self._lock:
+            return self._expire_locked(self._sessions.get(session_id), now_cst(), force)
+
+    def due(self):
+        now = now_cst()
+        ts = now.timestamp()
+        out = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= ts:
+                _, sid = heapq.heappop(self._heap)
+                sess = self._expire_locked(self._sessions.get(sid), now, False)
+                if sess:
+                    out.append(sess)
+            # Olvidar las cerradas hace más de keep_sec (orden de creación ≈ orden de vencimiento)
+            horizon = now - datetime.timedelta(seconds=self.keep_sec)
+            while self._sessions:
+                sid, sess = next(iter(self._sessions.items()))
+                if sess.state in OPEN_STATES or sess.expires_at > horizon:
+                    break
+                del self._sessions[sid]
+        return out
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def recent(self, limit=300):
+        with self._lock:
+            rows = list(self._sessions.values())[-limit:]
+            return [s.as_dict() for s in reversed(rows)]
+
+    def stats(self):
+        with self._lock:
+            open_ = sum(1 for s in self._sessions.values() if s.state in OPEN_STATES)
+            return {"backend": self.backend, "sessions": len(self._sessions), "open": open_,
+                    "timers": len(self._heap), **self._stats}
+
+
+class DBSessionStore(SessionStore):
+    backend = "db"
+
+    @staticmethod
+    def _wrap(row: AuthSession) -> PendingSession:
+        return PendingSession(row.session_id, row.uid, row.state, row.created_at, row.expires_at, row.context)
+
+    def create(self, uid, ttl_sec, context=None):
+        now = now_cst()
+        row = AuthSession(session_id=str(uuid.uuid4()), uid=uid, state="pending", created_at=now,
+                          expires_at=now + datetime.timedelta(seconds=ttl_sec), context=context)
+        sess = self._wrap(row)
+        db = standalone_session()
+        try:
+            db.add(row)
+            db.commit()
+        finally:
+            db.close()
+        return sess
+
+    def get(self, session_id):
+        db = standalone_session()
+        try:
+            row = db.query(AuthSession).filter(AuthSession.session_id == session_id).first()
+            return self._wrap(row) if row else None
+        finally:
+            db.close()
+
+    def set_state(self, session_id, state):
+        db = standalone_session()
+        try:
+            n = (db.query(AuthSession).filter(AuthSession.session_id == session_id)
+                 .update({AuthSession.state: state}, synchronize_session=False))
+            db.commit()
+            return bool(n)
+        finally:
+            db.close()
+
+    def _claim(self, db, session_id, now, force) -> bool:
+        # UPDATE condicional: solo un proceso gana la transición (y emite el evento)
+        q = db.query(AuthSession).filter(AuthSession.session_id == session_id,
+                                         AuthSession.state.in_(OPEN_STATES))
+        if not force:
+            q = q.filter(AuthSession.expires_at <= now)
+        return bool(q.update({AuthSession.state: "expired"}, synchronize_session=False))
+
+    def expire(self, session_id, force=False):
+        db = standalone_session()
+        try:
+            won = self._claim(db, session_id, now_cst(), force)
+            db.commit()
+            if not won:
+                return None
+            row = db.query(AuthSession).filter(AuthSession.session_id == session_id).first()
+            return self._wrap(row) if row else None
+        finally:
+            db.close()
+
+    def due(self):
+        now = now_cst()
+        db = standalone_session()
+        try:
+            rows = (db.query(AuthSession).filter(AuthSession.state.in_(OPEN_STATES),
+                                                 AuthSession.expires_at <= now)
+                    .order_by(AuthSession.expires_at).limit(200).all())
+            out = []
+            for row in rows:
+                if self._claim(db, row.session_id, now, False):
+                    sess = self._wrap(row)
+                    sess.state = "expired"
+                    out.append(sess)
+            db.commit()
+            return out
+        finally:
+            db.close()
+
+    def stats(self):
+        db = standalone_session()
+        try:
+            open_ = db.query(AuthSession).filter(AuthSession.state.in_(OPEN_STATES)).count()
+            total = db.query(AuthSession).count()
+        finally:
+            db.close()
+        return {"backend": self.backend, "sessions": total, "open": open_}
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_wake = threading.Event()
+_stats = {"timer_expired": 0, "touch_expired": 0, "client_expired": 0, "purged": 0}
+
+
+def get_store() -> SessionStore:
+    """Backend configurado (PENDING_SESSION_STORE), creado una vez por proceso."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if cfg.PENDING_SESSION_STORE == "db":
+                _store = DBSessionStore()
+            else:
+                _store = MemorySessionStore(cfg.PENDING_SESSION_KEEP_SEC, cfg.PENDING_SESSION_MAX)
+        return _store
+
+
+def create(uid: str, context: Optional[dict] = None) -> PendingSession:
+    """Abre una sesión pendiente de `uid` que vence en QR_TTL_SECONDS."""
+    sess = get_store().create(uid, cfg.QR_TTL_SECONDS, context)
+    _wake.set()   # el temporizador recalcula su próximo vencimiento
+    return sess
+
+
+def get(session_id: Optional[str]) -> Optional[PendingSession]:
+    return get_store().get(session_id) if session_id else None
+
+
+def mark(session_id: str, state: str) -> bool:
+    """Cambia el estado (completed / failed) de una sesión."""
+    return get_store().set_state(session_id, state)
+
+
+def _emit_expired(sessions: List[PendingSession], via: str) -> None:
+    if not sessions:
+        return
+    from .logging_utils import sign_events_and_persist
+    events = []
+    for s in sessions:
+        ctx = {"session_id": s.session_id, "via": via}
+        if via == "client":
+            ctx["client"] = True   # compatibilidad con el evento que emitía /api/qr/timeout
+        events.append(("qr_session_expired", s.uid, "qr_api", ctx))
+    db = standalone_session()
+    try:
+        sign_events_and_persist(db, events)
+    finally:
+        db.close()
+
+
+def expire(session_id: str, client: bool = False) -> bool:
+    """Expira la sesión si sigue abierta (vencida, o ya si `client`: el frontend agotó su
+    contador) y emite qr_session_expired. False si ya estaba cerrada o el temporizador se adelantó."""
+    sess = get_store().expire(session_id, force=client)
+    if sess is None:
+        return False
+    _stats["client_expired" if client else "touch_expired"] += 1
+    _emit_expired([sess], "client" if client else "touch")
+    return True
+
+
+def purge_history(retention_days: Optional[int] = None, batch: int = PURGE_BATCH) -> int:
+    """Borra por lotes las filas de auth_sessions vencidas hace más de `retention_days`."""
+    days = cfg.PENDING_SESSION_RETENTION_DAYS if retention_days is None else retention_days
+    if days < 0:
+        return 0
+    cutoff = now_cst() - datetime.timedelta(days=days)
+    total = 0
+    db = standalone_session()
+    try:
+        while True:
+            ids = [r[0] for r in db.query(AuthSession.session_id)
+                   .filter(AuthSession.expires_at < cutoff, ~AuthSession.state.in_(OPEN_STATES))
+                   .limit(batch).all()]
+            if not ids:
+                break
+            db.query(AuthSession).filter(AuthSession.session_id.in_(ids)).delete(synchronize_session=False)
+            db.commit()   # lotes cortos: no bloquea la tabla mientras hay logins
+            total += len(ids)
+    finally:
+        db.close()
+    _stats["purged"] += total
+    return total
+
+
+def recent(limit: int = 300) -> List[dict]:
+    return get_store().recent(limit)
+
+
+def stats() -> Dict[str, object]:
+    return {**get_store().stats(), **_stats, "ttl_sec": cfg.QR_TTL_SECONDS,
+            "retention_days": cfg.PENDING_SESSION_RETENTION_DAYS}
+
+
+def _loop() -> None:
+    store = get_store()
+    while True:
+        try:
+            expired = store.due()
+            if expired:
+                _stats["timer_expired"] += len(expired)
+                _emit_expired(expired, "timer")
+        except Exception as e:
+            print("[pending_sessions] timer failed:", e)
+        deadline = store.next_deadline()
+        poll = max(0.2, cfg.PENDING_SESSION_POLL_SEC)
+        wait = poll if deadline is None else min(poll, max(0.0, deadline - time.time()) + 0.05)
+        _wake.wait(wait)
+        _wake.clear()
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None:
+        return
+    get_store()
+    _thread = threading.Thread(target=_loop, name="pending-sessions", daemon=True)
+    _thread.start()
@@ -0,0 +1,299 @@
+import threading
+import time
+from bisect import bisect_right
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from .config import cfg
+from .db import standalone_session
+from .models import AccessPolicyRule, ProcessingCursor, Usuario
+from .time_utils import now_cst, ensure_cst
+
+#
+# Motor de políticas de acceso (rol × área × horario)
+# - Las reglas viven en BD (access_policy_rules) y se compilan en memoria:
+#     · por acción y rol, bitsets de áreas (permitido siempre / denegado siempre / con reglas)
+#     · por (rol, área), lista de reglas ordenada por prioridad con horarios como intervalos
+#       ordenados de minuto-de-semana (búsqueda binaria)
+# - Evaluar una lectura es O(1) en el caso común y O(log n) con horarios.
+# - Recarga en caliente: reload() tras cambios por API; además se compara la firma
+#   (count, max(updated_at)) cada POLICY_RELOAD_CHECK_SEC para cambios de otros procesos.
+# - Primera coincidencia gana; si ninguna regla aplica → deny (default_deny).
+# - Siembra de DEFAULT_RULES con la tabla vacía: una sola vez aunque arranquen varios workers
+#   (lock de proceso + fila "policy_seed" de processing_cursors bloqueada en la transacción que
+#   vuelve a contar las reglas).
+#
+
+WILDCARD = "*"
+ACTIONS = ("enter", "msg_read", "msg_write")
+ROLES = ("R-ADM", "R-MON", "R-IM", "R-AC", "R-EMP", "R-GRD", "R-AUD")
+SEED_LOCK = "policy_seed"
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Reglas iniciales (si la tabla está vacía): reproducen el comportamiento previo
+# - enter: cualquier rol con tarjeta activa entra en cualquier área
+# - msg_*: tabla de grupos de mensajes por rol
+DEFAULT_RULES = [
+    {"role": "*", "area": "*", "action": "enter", "effect": "allow", "description": "default: tarjeta activa"},
+    {"role": "*", "area": "Avisos", "action": "msg_read", "effect": "allow", "description": "Avisos: lectura para todos"},
+    {"role": "R-ADM", "area": "*", "action": "msg_read", "effect": "allow", "description": "admin lee todos los grupos"},
+    {"role": "R-ADM", "area": "*", "action": "msg_write", "effect": "allow", "description": "admin escribe en todos los grupos"},
+    {"role": "R-IM", "area": "IM", "action": "msg_read", "effect": "allow"},
+    {"role": "R-IM", "area": "IM", "action": "msg_write", "effect": "allow"},
+    {"role": "R-AC", "area": "AC", "action": "msg_read", "effect": "allow"},
+    {"role": "R-AC", "area": "AC", "action": "msg_write", "effect": "allow"},
+    {"role": "R-MON", "area": "Mon", "action": "msg_read", "effect": "allow"},
+    {"role": "R-MON", "area": "Mon", "action": "msg_write", "effect": "allow"},
+]
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    rule_id: Optional[int]
+    reason: str
+
+    def explain(self) -> dict:
+        return {"allowed": self.allowed, "rule_id": self.rule_id, "reason": self.reason}
+
+
+def _parse_hhmm(s: Optional[str]) -> Optional[int]:
+    if s is None or str(s).strip() == "":
+        return None
+    h, m = str(s).strip().split(":", 1)
+    h, m = int(h), int(m)
+    if not (0 <= h <= 24 and 0 <= m < 60) or h * 60 + m > MINUTES_PER_DAY:
+        raise ValueError(f"invalid time: {s}")
+    return h * 60 + m
+
+
+def _parse_days(s: Optional[str]) -> List[int]:
+    s = (s or WILDCARD).strip()
+    if s == WILDCARD:
+        return list(range(7))
+    out = set()
+    for part in s.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = (int(x) for x in part.split("-", 1))
+            out.update(range(a, b + 1))
+        else:
+            out.add(int(part))
+    if any(d < 0 or d > 6 for d in out):
+        raise ValueError(f"invalid days: {s}")
+    return sorted(out)
+
+
+def validate_rule(days: Optional[str], start_time: Optional[str], end_time: Optional[str]) -> None:
+    """Lanza ValueError si el horario de la regla no es válido."""
+    _parse_days(days)
+    start, end = _parse_hhmm(start_time), _parse_hhmm(end_time)
+    if (start is None) != (end is None):
+        raise ValueError("start_time and end_time must be set together")
+
+
+class _Rule:
+    """Regla compilada: horario como intervalos [inicio, fin) de minuto-de-semana."""
+    __slots__ = ("id", "allow", "priority", "specificity", "always", "starts", "ends", "label")
+
+    def __init__(self, r: AccessPolicyRule):
+        self.id = r.id
+        self.allow = (r.effect or "allow") == "allow"
+        self.priority = int(r.priority or 0)
+        self.specificity = int(r.role != WILDCARD) + int(r.area != WILDCARD)
+        start, end = _parse_hhmm(r.start_time), _parse_hhmm(r.end_time)
+        days = _parse_days(r.days)
+        intervals: List[Tuple[int, int]] = []
+        for d in days:
+            base = d * MINUTES_PER_DAY
+            if start is None:
+                intervals.append((base, base + MINUTES_PER_DAY))
+            elif start <= end:
+                intervals.append((base + start, base + end))
+            else:
+                # Cruza medianoche: tramo hasta fin del día y tramo del día siguiente
+                intervals.append((base + start, base + MINUTES_PER_DAY))
+                nxt = ((d + 1) % 7) * MINUTES_PER_DAY
+                intervals.append((nxt, nxt + end))
+        intervals.sort()
+        merged: List[List[int]] = []
+        for a, b in intervals:
+            if merged and a <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], b)
+            else:
+                merged.append([a, b])
+        self.starts = [a for a, _ in merged]
+        self.ends = [b for _, b in merged]
+        self.always = merged == [[0, MINUTES_PER_WEEK]]
+        self.label = (f"{'allow' if self.allow else 'deny'} {r.role}→{r.area} "
+                      f"days={r.days or WILDCARD} {r.start_time or '00:00'}-{r.end_time or '24:00'}"
+                      + (f" ({r.description})" if r.description else ""))
+
+    def matches(self, minute_of_week: int) -> bool:
+        if self.always:
+            return True
+        i = bisect_right(self.starts, minute_of_week) - 1
+        return i >= 0 and minute_of_week < self.ends[i]
+
+
+class _Compiled:
+    def __init__(self, rows: List[AccessPolicyRule], signature):
+        self.signature = signature
+        rules = []
+        for r in rows:
+            if not r.enabled:
+                continue
+            try:
+                rules.append((r, _Rule(r)))
+            except (ValueError, TypeError) as e:
+                print(f"[policy] rule {r.id} ignored: {e}")
+        self.role_index: Dict[str, int] = {WILDCARD: 0}
+        self.area_index: Dict[str, int] = {WILDCARD: 0}
+        for r, _ in rules:
+            self.role_index.setdefault(r.role or WILDCARD, len(self.role_index))
+            self.area_index.setdefault(r.area or WILDCARD, len(self.area_index))
+        roles = list(self.role_index)
+        areas = list(self.area_index)
+        self.table: Dict[str, List[List[Tuple[_Rule, ...]]]] = {}
+        self.always_allow: Dict[str, List[int]] = {}
+        self.always_deny: Dict[str, List[int]] = {}
+        self.has_rules: Dict[str, List[int]] = {}
+        for action in {r.action or "enter" for r, _ in rules}:
+            mine = [(r, c) for r, c in rules if (r.action or "enter") == action]
+            grid, allow_bits, deny_bits, any_bits = [], [], [], []
+            for role in roles:
+                row = []
+                a_mask = d_mask = h_mask = 0
+                for ai, area in enumerate(areas):
+                    applicable = [c for r, c in mine
+                                  if (r.role or WILDCARD) in (role, WILDCARD)
+                                  and (r.area or WILDCARD) in (area, WILDCARD)]
+                    applicable.sort(key=lambda c: (-c.priority, -c.specificity, c.allow, c.id))
+                    row.append(tuple(applicable))
+                    if applicable:
+                        h_mask |= 1 << ai
+                        if applicable[0].always:
+                            if applicable[0].allow:
+                                a_mask |= 1 << ai
+                            else:
+                                d_mask |= 1 << ai
+                grid.append(row)
+                allow_bits.append(a_mask)
+                deny_bits.append(d_mask)
+                any_bits.append(h_mask)
+            self.table[action] = grid
+            self.always_allow[action] = allow_bits
+            self.always_deny[action] = deny_bits
+            self.has_rules[action] = any_bits
+
+    def evaluate(self, role: str, area: Optional[str], action: str, minute_of_week: int) -> Decision:
+        grid = self.table.get(action)
+        if grid is None:
+            return Decision(False, None, f"default_deny: no rules for action {action}")
+        ri = self.role_index.get(role or WILDCARD, 0)
+        ai = self.area_index.get(area or WILDCARD, 0)
+        bit = 1 << ai
+        if not self.has_rules[action][ri] & bit:
+            return Decision(False, None, f"default_deny: no rule for {role}→{area or WILDCARD}")
+        rules = grid[ri][ai]
+        if self.always_allow[action][ri] & bit or self.always_deny[action][ri] & bit:
+            top = rules[0]
+            return Decision(top.allow, top.id, top.label)
+        for c in rules:
+            if c.matches(minute_of_week):
+                return Decision(c.allow, c.id, c.label)
+        return Decision(False, None, f"default_deny: outside schedule for {role}→{area or WILDCARD}")
+
+
+_lock = threading.Lock()
+_compiled: Optional[_Compiled] = None
+_checked_at = 0.0
+
+
+def _signature(db):
+    return db.query(func.count(AccessPolicyRule.id), func.max(AccessPolicyRule.updated_at)).one()
+
+
+_seed_lock = threading.Lock()
+
+
+def known_role(db, role) -> bool:
+    """'*', un rol del sistema o uno que ya tenga algún usuario."""
+    if not isinstance(role, str) or not role.strip():
+        return False
+    if role == WILDCARD or role in ROLES:
+        return True
+    return db.query(Usuario.uid).filter(Usuario.rol == role).first() is not None
+
+
+def _seed_defaults(db) -> None:
+    """Siembra DEFAULT_RULES si no hay reglas, serializado entre hilos y procesos."""
+    with _seed_lock:
+        try:
+            if not db.get(ProcessingCursor, SEED_LOCK):
+                db.add(ProcessingCursor(name=SEED_LOCK, last_id=0))
+                db.commit()
+        except IntegrityError:
+            db.rollback()   # otro worker creó la fila a la vez
+        # Tomar la fila (bloqueo de escritura) y volver a contar dentro de la misma transacción
+        db.execute(update(ProcessingCursor).where(ProcessingCursor.name == SEED_LOCK)
+                   .values(last_id=ProcessingCursor.last_id + 1, updated_at=now_cst()))
+        if not db.query(AccessPolicyRule.id).first():
+            for d in DEFAULT_RULES:
+                db.add(AccessPolicyRule(**d))
+        db.commit()
+
+
+def reload() -> _Compiled:
+    """Relee y recompila las reglas desde BD (siembra las reglas por defecto si no hay ninguna)."""
+    global _compiled, _checked_at
+    db = standalone_session()
+    try:
+        if not db.query(AccessPolicyRule.id).first():
+            _seed_defaults(db)
+        rows = db.query(AccessPolicyRule).all()
+        sig = tuple(_signature(db))
+        compiled = _Compiled(rows, sig)
+    finally:
+        db.close()
+    with _lock:
+        _compiled = compiled
+        _checked_at = time.monotonic()
+    return compiled
+
+
+def _current() -> _Compiled:
+    global _checked_at
+    comp = _compiled
+    if comp is None:
+        return reload()
+    if time.monotonic() - _checked_at > cfg.POLICY_RELOAD_CHECK_SEC:
+        _checked_at = time.monotonic()
+        db = standalone_session()
+        try:
+            changed = tuple(_signature(db)) != comp.signature
+        except Exception:
+            changed = False
+        finally:
+            db.close()
+        if changed:
+            comp = reload()
+    return comp
+
+
+def _minute_of_week(when=None) -> int:
+    dt = (ensure_cst(when) if when is not None else None) or now_cst()
+    return dt.weekday() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def evaluate(role: str, area: Optional[str], action: str = "enter", when=None) -> Decision:
+    """Decisión completa (con la regla que la produjo) para role/area/action en el instante dado."""
+    return _current().evaluate(role, area, action, _minute_of_week(when))
+
+
+def is_allowed(role: str, area: Optional[str], action: str = "enter", when=None) -> bool:
+    return evaluate(role, area, action, when).allowed
@@ -2,14 +2,18 @@
 # ✔ Genera valor QR (Base32)
 # ✔ Hashea/verifica con Argon2
 # ✔ Renderiza SOLO el QR en un lienzo cuadrado con tema UPY Center (sin datos personales)
+# ✔ Misma tarjeta en SVG (marco, módulos en un solo path, logo embebido): sin rasterizar, para vistas previas
 
+import io
 import os
 import base64
 import hashlib
+from functools import lru_cache
 from typing import Optional
 
+import numpy as np
 from argon2 import PasswordHasher
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageFilter, PngImagePlugin
 import qrcode
 
 from .config import cfg
@@ -44,6 +48,13 @@ def qr_value_fingerprint(qr_value: str) -> str:
     return hashlib.sha256(qr_value.encode()).hexdigest()
 
 
+def card_version(qr_value_hash: Optional[str]) -> Optional[str]:
+    """Versión de la tarjeta: cambia con cada rotación (derivada del hash guardado, no del valor)."""
+    if not qr_value_hash:
+        return None
+    return hashlib.sha256(qr_value_hash.encode()).hexdigest()[:20]
+
+
 # ---------------------------
 # Render del QR (temático UPY)
 # ---------------------------
@@ -61,24 +72,24 @@ def _rounded_rect(draw: ImageDraw.ImageDraw, xy, radius: int, fill=None, outline
     draw.rounded_rectangle(xy, radius=radius, fill=fill, outline=outline, width=width)
 
 
-def make_upy_qr_image(
-    qr_value: str,
-    size: int = 600,
-    logo_path: Optional[str] = None,
-    accent: str = "#0b2a3c",   # UPY primary
-    accent2: str = "#2f7ea1",  # UPY accent
-    bg: str = "#f5f7fb",
-) -> Image.Image:
-    """
-    Crea una imagen cuadrada con SOLO el código QR (tema UPY):
-    - Lienzo con fondo claro y marco redondeado UPY.
-    - QR centrado en color UPY.
-    - (Opcional) watermark/logo pequeño al centro (<= 18% del QR) para mantener scaneabilidad.
-    - Sin texto de identificación.
+def _logo_key(logo_path: Optional[str]):
+    """(ruta, mtime) del logo: un logo reemplazado en disco invalida su plantilla."""
+    if not logo_path:
+        return None
+    try:
+        return (logo_path, os.path.getmtime(logo_path))
+    except OSError:
+        return None
 
-    size: tamaño final (px) del lienzo cuadrado (ej. 600, 800, 1024).
+
+@lru_cache(maxsize=max(1, cfg.QR_TEMPLATE_CACHE_SIZE))
+def _card_template(size: int, accent: str, accent2: str, bg: str, logo_key):
+    """Capas estáticas de la tarjeta para (tamaño, colores, logo); todo excepto los módulos del QR.
+
+    Devuelve (lienzo RGB con marco, borde y sombra ya aplicados, caja del QR, y dos planos de la
+    caja ya compuestos con logo y sombra: cómo queda cada píxel si su módulo es claro u oscuro).
+    Los arrays son de solo lectura: se comparten entre tarjetas.
     """
-    # Lienzo final
     W = H = size
     canvas = Image.new("RGB", (W, H), bg)
     draw = ImageDraw.Draw(canvas)
@@ -93,23 +104,6 @@ def make_upy_qr_image(
     qr_box = (inner_pad, inner_pad, W - inner_pad, H - inner_pad)
     qr_side = qr_box[2] - qr_box[0]
 
-    # Generar QR monocromo con color UPY
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,  # 15% tolerancia (permite logo pequeño)
-        box_size=10,
-        border=0,
-    )
-    qr.add_data(qr_value)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color=accent, back_color="white").convert("RGBA")
-
-    # Ajustar tamaño del QR a la caja
-    qr_img = qr_img.resize((qr_side, qr_side), Image.LANCZOS)
-
-    # Pegar QR en lienzo
-    canvas.paste(qr_img, (qr_box[0], qr_box[1]), qr_img)
-
     # Borde sutil alrededor del QR
     border_pad = int(size * 0.01)
     _rounded_rect(
@@ -120,42 +114,195 @@ def make_upy_qr_image(
         width=2,
     )
 
-    # (Opcional) Watermark/logo pequeño en el centro del QR
-    if logo_path:
+    # (Opcional) Watermark/logo pequeño en el centro del QR: fondo blanco ligero + logo en una
+    # sola capa RGBA del tamaño de la caja (se compone sobre los módulos en cada tarjeta)
+    logo_layer = None
+    if logo_key:
         try:
-            logo = Image.open(logo_path).convert("RGBA")
+            logo = Image.open(logo_key[0]).convert("RGBA")
             # Tamaño del logo: ~16% del lado del QR para no afectar la lectura
             lw = int(qr_side * 0.16)
             logo = logo.resize((lw, lw), Image.LANCZOS)
-
-            # Fondo blanco muy ligero detrás del logo para contraste
             pad2 = int(lw * 0.14)
+            layer = Image.new("RGBA", (qr_side, qr_side), (0, 0, 0, 0))
             bg_logo = Image.new("RGBA", (lw + pad2 * 2, lw + pad2 * 2), (255, 255, 255, 220))
-            bx = qr_box[0] + (qr_side - lw) // 2 - pad2
-            by = qr_box[1] + (qr_side - lw) // 2 - pad2
-            canvas.paste(bg_logo, (bx, by), bg_logo)
-
-            # Pegar logo centrado
-            lx = qr_box[0] + (qr_side - lw) // 2
-            ly = qr_box[1] + (qr_side - lw) // 2
-            canvas.paste(logo, (lx, ly), logo)
+            layer.alpha_composite(bg_logo, ((qr_side - lw) // 2 - pad2, (qr_side - lw) // 2 - pad2))
+            layer.alpha_composite(logo, ((qr_side - lw) // 2, (qr_side - lw) // 2))
+            rgba = np.asarray(layer, dtype=np.float32)
+            logo_layer = (rgba[..., :3], rgba[..., 3:] / 255.0)
         except Exception:
-            pass
+            logo_layer = None
 
-    # Sombra suave exterior del marco (opcional, estética)
+    # Sombra suave exterior del marco (opcional, estética): se aplica aquí al lienzo y se guarda
+    # su factor sobre la caja del QR para oscurecer igual los módulos de cada tarjeta
+    shade = np.ones((qr_side, qr_side, 1), dtype=np.float32)
     try:
         shadow = Image.new("RGBA", (W, H), (0, 0, 0, 0))
         sd = ImageDraw.Draw(shadow)
         _rounded_rect(sd, (pad, pad, W - pad, H - pad), radius=radius, fill=(0, 0, 0, 40))
         shadow = shadow.filter(ImageFilter.GaussianBlur(radius=8))
         canvas = Image.alpha_composite(canvas.convert("RGBA"), shadow).convert("RGB")
+        alpha = np.asarray(shadow.getchannel("A"), dtype=np.float32)
+        shade = (1.0 - alpha[qr_box[1]:qr_box[3], qr_box[0]:qr_box[2]] / 255.0)[..., None]
     except Exception:
         pass
 
-    return canvas
+    # Píxel final de la caja para módulo claro (blanco) y oscuro (accent): logo encima y sombra
+    planes = []
+    for color in ((255, 255, 255), ImageColor.getrgb(accent)):
+        plane = np.empty((qr_side, qr_side, 3), dtype=np.float32)
+        plane[:] = color
+        if logo_layer is not None:
+            rgb, a = logo_layer
+            plane = plane * (1.0 - a) + rgb * a
+        plane = (plane * shade + 0.5).astype(np.uint8)
+        plane.setflags(write=False)
+        planes.append(plane)
+
+    base = np.asarray(canvas).copy()
+    base.setflags(write=False)
+    return base, qr_box, planes[0], planes[1]
+
+
+def _qr_modules(qr_value: str) -> np.ndarray:
+    """Matriz booleana de módulos del QR (sin zona de silencio)."""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,  # 15% tolerancia (permite logo pequeño)
+        box_size=1,
+        border=0,
+    )
+    qr.add_data(qr_value)
+    qr.make(fit=True)
+    return np.asarray(qr.get_matrix(), dtype=bool)
+
+
+def make_upy_qr_image(
+    qr_value: str,
+    size: int = 600,
+    logo_path: Optional[str] = None,
+    accent: str = "#0b2a3c",   # UPY primary
+    accent2: str = "#2f7ea1",  # UPY accent
+    bg: str = "#f5f7fb",
+) -> Image.Image:
+    """
+    Crea una imagen cuadrada con SOLO el código QR (tema UPY):
+    - Lienzo con fondo claro y marco redondeado UPY.
+    - QR centrado en color UPY.
+    - (Opcional) watermark/logo pequeño al centro (<= 18% del QR) para mantener scaneabilidad.
+    - Sin texto de identificación.
+
+    size: tamaño final (px) del lienzo cuadrado (ej. 600, 800, 1024).
+
+    Las capas estáticas (fondo, marco, sombra, logo) salen de una plantilla en caché LRU por
+    (tamaño, colores, logo); por tarjeta solo se codifica el QR y se escalan sus módulos
+    (vecino más cercano, bordes nítidos) dentro de la caja.
+    """
+    size = int(size)
+    base, qr_box, light, dark = _card_template(size, accent, accent2, bg, _logo_key(logo_path))
+    qr_side = qr_box[2] - qr_box[0]
+
+    # Módulos escalados por índice (cada píxel toma el módulo que le corresponde)
+    modules = _qr_modules(qr_value)
+    idx = np.arange(qr_side) * modules.shape[0] // qr_side
+    mask = modules[idx[:, None], idx[None, :]]
 
+    out = base.copy()
+    out[qr_box[1]:qr_box[3], qr_box[0]:qr_box[2]] = np.where(mask[..., None], dark, light)
+    return Image.fromarray(out)
 
-def save_upy_qr_png(path: str, qr_value: str, size: int = 600, logo_path: Optional[str] = None) -> None:
-    """Crea y guarda un PNG del QR temático UPY (solo código QR)."""
+
+def save_upy_qr_png(path: str, qr_value: str, size: int = 600, logo_path: Optional[str] = None,
+                    version: Optional[str] = None) -> None:
+    """Crea y guarda un PNG del QR temático UPY (solo código QR).
+    `version` (card_version) se guarda como texto del PNG: permite detectar imágenes de un QR ya rotado."""
     img = make_upy_qr_image(qr_value=qr_value, size=size, logo_path=logo_path)
-    img.save(path, format="PNG")
+    info = None
+    if version:
+        info = PngImagePlugin.PngInfo()
+        info.add_text("card_version", version)
+    img.save(path, format="PNG", pnginfo=info)
+
+
+# ---------------------------
+# Render vectorial (SVG)
+# ---------------------------
+@lru_cache(maxsize=max(1, cfg.QR_TEMPLATE_CACHE_SIZE))
+def _svg_logo_href(logo_key, px: int) -> Optional[str]:
+    """Logo reducido a `px` como data URI PNG (se codifica una vez por logo y tamaño)."""
+    try:
+        logo = Image.open(logo_key[0]).convert("RGBA").resize((px, px), Image.LANCZOS)
+        buf = io.BytesIO()
+        logo.save(buf, format="PNG", optimize=True)
+        return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+    except Exception:
+        return None
+
+
+def _svg_modules_path(modules: np.ndarray) -> str:
+    """Módulos oscuros como un único path en unidades de módulo (un rectángulo por tramo horizontal)."""
+    parts = []
+    for y, row in enumerate(modules):
+        # Inicios/fines de tramos de módulos oscuros consecutivos en la fila
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], row.view(np.int8), [0]))))
+        for x0, x1 in zip(edges[::2], edges[1::2]):
+            parts.append(f"M{x0} {y}h{x1 - x0}v1h{x0 - x1}z")
+    return "".join(parts)
+
+
+def make_upy_qr_svg(
+    qr_value: str,
+    size: int = 600,
+    logo_path: Optional[str] = None,
+    accent: str = "#0b2a3c",
+    accent2: str = "#2f7ea1",
+    bg: str = "#f5f7fb",
+) -> str:
+    """
+    Tarjeta QR tema UPY como documento SVG, con la misma geometría que make_upy_qr_image:
+    fondo, marco redondeado, borde de la caja, módulos (un solo path), logo embebido y la sombra
+    (desenfoque como filtro SVG: lo aplica quien lo muestra, no el servidor).
+    """
+    size = int(size)
+    W = H = size
+    pad = int(size * 0.055)
+    radius = int(size * 0.08)
+    inner_pad = int(size * 0.12)
+    qr_side = W - 2 * inner_pad
+    border_pad = int(size * 0.01)
+    modules = _qr_modules(qr_value)
+    scale = qr_side / modules.shape[0]
+
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{W}" height="{H}" viewBox="0 0 {W} {H}">',
+        '<defs><filter id="s" x="-10%" y="-10%" width="120%" height="120%">'
+        '<feGaussianBlur stdDeviation="8"/></filter></defs>',
+        f'<rect width="{W}" height="{H}" fill="{bg}"/>',
+        f'<rect x="{pad + 1.5}" y="{pad + 1.5}" width="{W - 2 * pad - 3}" height="{H - 2 * pad - 3}" '
+        f'rx="{radius}" fill="#fff" stroke="{accent}" stroke-width="3"/>',
+        f'<rect x="{inner_pad - border_pad + 1}" y="{inner_pad - border_pad + 1}" '
+        f'width="{qr_side + 2 * border_pad - 2}" height="{qr_side + 2 * border_pad - 2}" '
+        f'rx="{int(radius * 0.6)}" fill="none" stroke="{accent2}" stroke-width="2"/>',
+        f'<path transform="translate({inner_pad} {inner_pad}) scale({scale:.5f})" fill="{accent}" '
+        f'shape-rendering="crispEdges" d="{_svg_modules_path(modules)}"/>',
+    ]
+    logo_key = _logo_key(logo_path)
+    if logo_key:
+        lw = int(qr_side * 0.16)
+        pad2 = int(lw * 0.14)
+        href = _svg_logo_href(logo_key, lw)
+        if href:
+            lx = inner_pad + (qr_side - lw) // 2
+            out.append(f'<rect x="{lx - pad2}" y="{lx - pad2}" width="{lw + 2 * pad2}" height="{lw + 2 * pad2}" '
+                       f'fill="#fff" fill-opacity="0.863"/>')
+            out.append(f'<image x="{lx}" y="{lx}" width="{lw}" height="{lw}" href="{href}"/>')
+    out.append(f'<rect x="{pad}" y="{pad}" width="{W - 2 * pad}" height="{H - 2 * pad}" rx="{radius}" '
+               f'fill="#000" fill-opacity="0.157" filter="url(#s)"/>')
+    out.append("</svg>")
+    return "".join(out)
+
+
+def save_upy_qr_svg(path: str, qr_value: str, size: int = 600, logo_path: Optional[str] = None) -> None:
+    """Crea y guarda el SVG del QR temático UPY (solo código QR)."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(make_upy_qr_svg(qr_value=qr_value, size=size, logo_path=logo_path))
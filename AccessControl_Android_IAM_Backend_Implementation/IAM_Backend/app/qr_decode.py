@@ -0,0 +1,229 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .config import cfg
+
+#
+# Decodificación de QR en servidor desde una imagen subida (/api/qr/decode) por etapas
+# - Carga: PIL en modo draft (JPEG se decodifica directamente en gris y a 1/2, 1/4 o 1/8 de escala,
+#   lo justo para QR_DECODE_MAX_SIDE) y reducción final a ese lado máximo. Una foto de 12 MP no se
+#   decodifica completa salvo que haga falta.
+# - Etapa barata (secuencial, en el hilo de la petición): gris, Otsu y umbral adaptativo.
+# - Etapa paralela (pool QR_DECODE_WORKERS): rotaciones 90/180/270, sharpen y la imagen a mayor
+#   resolución (hasta QR_DECODE_FULL_MAX_SIDE) para códigos pequeños en fotos grandes. Gana el
+#   primer intento que decodifica; los pendientes se cancelan.
+# - cv2.QRCodeDetector se reutiliza por hilo (detector()).
+# - multi=True usa detectAndDecodeMulti: todos los códigos del frame (varias credenciales frente a
+#   la cámara de un acceso) en lugar del primero.
+# - decode_batch(): varios frames de una ráfaga en paralelo (pool QR_DECODE_BATCH_WORKERS); responde
+#   con el primer frame que da algún código y cancela el resto.
+# - decode_bytes()/decode_batch() devuelven también los tiempos por etapa (ms) y la variante que
+#   decodificó; stats() acumula ambos por proceso.
+#
+
+_local = threading.local()
+_pool: Optional[ThreadPoolExecutor] = None
+_frame_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "frames": 0, "decoded": 0, "by_stage": {}, "ms": {"load": 0.0, "cheap": 0.0, "parallel": 0.0, "total": 0.0}}
+
+_SHARPEN = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+
+
+def detector() -> "cv2.QRCodeDetector":
+    """cv2.QRCodeDetector del hilo actual (crearlo por petición cuesta más que decodificar)."""
+    det = getattr(_local, "det", None)
+    if det is None:
+        det = _local.det = cv2.QRCodeDetector()
+    return det
+
+
+def try_decode(img, multi: bool = False) -> List[str]:
+    """Un intento sobre img ya preparada: valores decodificados (como mucho uno si multi=False)."""
+    if not multi:
+        val, _, _ = detector().detectAndDecode(img)
+        return [val] if val else []
+    ok, vals, _, _ = detector().detectAndDecodeMulti(img)
+    return list(dict.fromkeys(v for v in vals if v)) if ok else []
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, cfg.QR_DECODE_WORKERS), thread_name_prefix="qrdec")
+        return _pool
+
+
+def _get_frame_pool() -> ThreadPoolExecutor:
+    # Pool aparte: los frames esperan a sus intentos paralelos (en _pool) sin bloquearlo
+    global _frame_pool
+    with _pool_lock:
+        if _frame_pool is None:
+            _frame_pool = ThreadPoolExecutor(max_workers=max(1, cfg.QR_DECODE_BATCH_WORKERS),
+                                             thread_name_prefix="qrframe")
+        return _frame_pool
+
+
+def load_gray(raw: bytes, max_side: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Imagen en gris con lado mayor <= max_side (0 = sin límite) y el tamaño original (ancho, alto).
+    Lanza PIL.UnidentifiedImageError si el formato no se reconoce."""
+    img = Image.open(io.BytesIO(raw))
+    size = img.size
+    if max_side:
+        img.draft("L", (max_side, max_side))   # solo JPEG: reducción en el propio decodificador
+    if img.mode != "L":
+        img = img.convert("L")
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(img), size
+
+
+def _cheap_variants(gray):
+    yield "gray", lambda: gray
+    yield "otsu", lambda: cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    yield "adaptive", lambda: cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                    cv2.THRESH_BINARY, 31, 10)
+
+
+def _parallel_variants(gray, raw: Optional[bytes], size):
+    out = [("rot90", lambda: cv2.rotate(gray, cv2.ROTATE_90_CLOCKWISE)),
+           ("rot180", lambda: cv2.rotate(gray, cv2.ROTATE_180)),
+           ("rot270", lambda: cv2.rotate(gray, cv2.ROTATE_90_COUNTERCLOCKWISE)),
+           ("sharpen", lambda: cv2.filter2D(gray, -1, _SHARPEN))]
+    full = cfg.QR_DECODE_FULL_MAX_SIDE
+    if raw is not None and max(size) > max(gray.shape) and (not full or full > max(gray.shape)):
+        out.append(("full_res", lambda: load_gray(raw, full)[0]))
+    return out
+
+
+def _attempt(make, multi: bool, *cancels: threading.Event) -> List[str]:
+    if any(c.is_set() for c in cancels):
+        return []
+    return try_decode(make(), multi)
+
+
+def decode_gray(gray: np.ndarray, raw: Optional[bytes] = None, size=None,
+                timings: Optional[Dict[str, float]] = None, multi: bool = False,
+                cancel: Optional[threading.Event] = None) -> Tuple[List[str], Optional[str]]:
+    """(valores, variante) del primer intento que decodifica, o ([], None).
+    `cancel` (opcional) aborta los intentos pendientes desde fuera (p. ej. otro frame ya decodificó)."""
+    timings = timings if timings is not None else {}
+    cancel = cancel or threading.Event()
+    t0 = time.perf_counter()
+    for name, make in _cheap_variants(gray):
+        if cancel.is_set():
+            return [], None
+        vals = try_decode(make(), multi)
+        if vals:
+            timings["cheap"] = (time.perf_counter() - t0) * 1000
+            return vals, name
+    t1 = time.perf_counter()
+    timings["cheap"] = (t1 - t0) * 1000
+
+    done = threading.Event()
+    pool = _get_pool()
+    futures = {pool.submit(_attempt, make, multi, done, cancel): name
+               for name, make in _parallel_variants(gray, raw, size or gray.shape[::-1])}
+    found = ([], None)
+    try:
+        for fut in as_completed(futures):
+            try:
+                vals = fut.result()
+            except Exception:
+                continue
+            if vals:
+                found = (vals, futures[fut])
+                break
+    finally:
+        done.set()
+        for f in futures:
+            f.cancel()
+    timings["parallel"] = (time.perf_counter() - t1) * 1000
+    return found
+
+
+def _record(values: List[str], stage: Optional[str], timings: Dict[str, float], frames: int = 1) -> None:
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["frames"] += frames
+        if values:
+            _stats["decoded"] += 1
+            _stats["by_stage"][stage] = _stats["by_stage"].get(stage, 0) + 1
+        for k, v in timings.items():
+            _stats["ms"][k] = _stats["ms"].get(k, 0.0) + v
+
+
+def _decode_one(raw: bytes, multi: bool, cancel: Optional[threading.Event] = None):
+    t0 = time.perf_counter()
+    gray, size = load_gray(raw, cfg.QR_DECODE_MAX_SIDE)
+    timings = {"load": (time.perf_counter() - t0) * 1000}
+    vals, stage = decode_gray(gray, raw, size, timings, multi=multi, cancel=cancel)
+    timings["total"] = (time.perf_counter() - t0) * 1000
+    return vals, {"stage": stage, "size": list(size), "decoded_size": [gray.shape[1], gray.shape[0]],
+                  "timings_ms": {k: round(v, 2) for k, v in timings.items()}}
+
+
+def decode_bytes(raw: bytes, multi: bool = False) -> Tuple[List[str], dict]:
+    """Decodifica los bytes de una imagen. Devuelve (valores, info de etapas); [] si no hay QR."""
+    vals, info = _decode_one(raw, multi)
+    _record(vals, info["stage"], info["timings_ms"])
+    return vals, info
+
+
+def decode_batch(raws: List[bytes], multi: bool = False) -> Tuple[List[str], dict]:
+    """Decodifica una ráfaga de frames en paralelo y devuelve el primero con algún código.
+    info: frame (índice del que decodificó o None), frames, stage y timings_ms (total y el del frame).
+    Los frames ilegibles se ignoran (unreadable=True); con un único frame ilegible se relanza el error."""
+    t0 = time.perf_counter()
+    cancel = threading.Event()
+    pool = _get_frame_pool()
+    futures = {pool.submit(_decode_one, raw, multi, cancel): i for i, raw in enumerate(raws)}
+    found, error = None, None
+    try:
+        for fut in as_completed(futures):
+            try:
+                vals, info = fut.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if vals:
+                found = (vals, futures[fut], info)
+                break
+    finally:
+        cancel.set()
+        for f in futures:
+            f.cancel()
+    total = round((time.perf_counter() - t0) * 1000, 2)
+    if found is None:
+        if error is not None and len(raws) == 1:
+            raise error
+        _record([], None, {"total": total}, frames=len(raws))
+        return [], {"frame": None, "frames": len(raws), "stage": None,
+                    "unreadable": error is not None, "timings_ms": {"total": total}}
+    vals, idx, info = found
+    timings = {"total": total, **{f"frame_{k}": v for k, v in info["timings_ms"].items()}}
+    _record(vals, info["stage"], {"total": total}, frames=len(raws))
+    return vals, {"frame": idx, "frames": len(raws), "stage": info["stage"], "size": info["size"],
+                  "timings_ms": timings}
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Valor de cabecera Server-Timing (visible en las DevTools del navegador)."""
+    return ", ".join(f"{k};dur={v}" for k, v in timings.items())
+
+
+def stats() -> dict:
+    with _stats_lock:
+        n = _stats["requests"] or 1
+        return {"requests": _stats["requests"], "frames": _stats["frames"], "decoded": _stats["decoded"],
+                "by_stage": dict(_stats["by_stage"]),
+                "avg_ms": {k: round(v / n, 2) for k, v in _stats["ms"].items()}}
@@ -0,0 +1,305 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from .config import cfg
+from .db import standalone_session
+from .models import QRScannerDevice, Usuario
+from .qr import verify_qr_value, qr_value_fingerprint
+from .access import log_access
+from .time_utils import now_cst
+from . import camera_hub, policy, qr_decode
+
+#
+# Escaneo continuo de QR en servidor (cámaras fijas como lectores de torniquete)
+# - Un hilo ligero por escáner QR activo con URL de stream (devices_qr_scanners) se suscribe al hub
+#   de captura compartido (app/camera_hub.py): no abre otra sesión si la cámara ya se está viendo.
+# - Submuestreo: como mucho QR_SCAN_FPS frames por segundo y por dispositivo; si la decodificación
+#   anterior de ese dispositivo sigue en curso el frame se descarta (nunca hay cola).
+# - La decodificación (gris + reescalado a QR_SCAN_MAX_WIDTH, detector por hilo de qr_decode) y la
+#   decisión corren en un pool acotado (QR_SCAN_WORKERS) compartido por todos los dispositivos.
+# - Con QR_SCAN_MULTI cada frame puede dar varios códigos (detectAndDecodeMulti): cada uno se decide
+#   y registra por separado.
+# - Debounce: el mismo código visto por el mismo dispositivo dentro de QR_SCAN_DEBOUNCE_SEC desde
+#   la última vez que se vio cuenta como una sola lectura (una tarjeta sostenida frente a la cámara).
+# - Decisión como en /api/nfc/scan: usuario activo, QR no revocado y política rol × área (área =
+#   location del dispositivo); el resultado se registra con log_access (access_granted/denied).
+# - Resolución valor → usuario: Argon2 contra los hashes activos (caro) y caché en memoria por huella
+#   SHA-256; un acierto en caché solo se acepta si el hash guardado del usuario no cambió (rotación).
+# - Caché negativa por huella (QR_SCAN_UNKNOWN_TTL_SEC, acotada a QR_SCAN_UNKNOWN_MAX): un código
+#   desconocido sostenido frente a la cámara no repite el barrido Argon2 en cada lectura.
+#   forget_unknown() la vacía al asignar/rotar un QR y toca QR_SCAN_SIGNAL_PATH para que el proceso
+#   del escáner la vacíe también (asignaciones desde el CLI u otro worker).
+# - La lista de dispositivos se relee cada QR_SCAN_REFRESH_SEC o al llamar refresh().
+#
+
+_lock = threading.Lock()
+_workers: Dict[int, "_DeviceWorker"] = {}
+_pool: Optional[ThreadPoolExecutor] = None
+_thread: Optional[threading.Thread] = None
+_wake = threading.Event()
+_resolved: Dict[str, Tuple[str, str]] = {}   # huella -> (uid, qr_value_hash) de aciertos previos
+_resolved_lock = threading.Lock()
+_unknown: Dict[str, float] = {}              # huella -> expira_monotonic de códigos sin usuario
+_unknown_signal: Optional[int] = None
+_unknown_gen = 0
+
+
+def decode_frame(frame) -> List[str]:
+    """Valores QR del frame (BGR); varios con QR_SCAN_MULTI. Reescala a QR_SCAN_MAX_WIDTH antes."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    h, w = gray.shape[:2]
+    max_w = cfg.QR_SCAN_MAX_WIDTH
+    if max_w and w > max_w:
+        gray = cv2.resize(gray, (max_w, int(h * max_w / w)), interpolation=cv2.INTER_AREA)
+    return qr_decode.try_decode(gray, multi=cfg.QR_SCAN_MULTI)
+
+
+def _signal_stat() -> Optional[int]:
+    try:
+        return os.stat(cfg.QR_SCAN_SIGNAL_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def forget_unknown() -> None:
+    """Vacía la caché negativa (llamar tras asignar o rotar un QR, después del commit)."""
+    global _unknown_gen
+    with _resolved_lock:
+        _unknown.clear()
+        _unknown_gen += 1
+    path = cfg.QR_SCAN_SIGNAL_PATH
+    if not path:
+        return
+    try:
+        with open(path, "a"):
+            os.utime(path, None)
+    except OSError as e:
+        print("[qr_scanner] signal write failed:", e)
+
+
+def _check_unknown(fp: str) -> Tuple[bool, int]:
+    """(código desconocido en caché, generación vista); la generación se pasa a _remember_unknown."""
+    global _unknown_signal, _unknown_gen
+    now = time.monotonic()
+    signal = _signal_stat() if cfg.QR_SCAN_SIGNAL_PATH else None
+    with _resolved_lock:
+        if signal != _unknown_signal:
+            _unknown.clear()
+            _unknown_gen += 1
+            _unknown_signal = signal
+        expires = _unknown.get(fp)
+        if expires is not None and expires <= now:
+            _unknown.pop(fp, None)
+            expires = None
+        return expires is not None, _unknown_gen
+
+
+def _remember_unknown(fp: str, gen: int) -> None:
+    # Un barrido que empezó antes de una asignación (generación distinta) no se guarda
+    ttl = cfg.QR_SCAN_UNKNOWN_TTL_SEC
+    if ttl <= 0:
+        return
+    signal = _signal_stat() if cfg.QR_SCAN_SIGNAL_PATH else None
+    now = time.monotonic()
+    with _resolved_lock:
+        if gen != _unknown_gen or signal != _unknown_signal:
+            return
+        if len(_unknown) >= cfg.QR_SCAN_UNKNOWN_MAX:
+            for key in [k for k, exp in _unknown.items() if exp <= now]:
+                del _unknown[key]
+            while len(_unknown) >= cfg.QR_SCAN_UNKNOWN_MAX:
+                del _unknown[next(iter(_unknown))]   # el más antiguo (orden de inserción)
+        _unknown[fp] = now + ttl
+
+
+def _resolve(db, qr_value: str, fp: str) -> Optional[Usuario]:
+    unknown, gen = _check_unknown(fp)
+    if unknown:
+        return None
+    with _resolved_lock:
+        hit = _resolved.get(fp)
+    if hit:
+        user = db.query(Usuario).filter(Usuario.uid == hit[0]).first()
+        if user and user.qr_value_hash == hit[1]:
+            return user
+        with _resolved_lock:
+            _resolved.pop(fp, None)
+    for user in db.query(Usuario).filter(Usuario.qr_value_hash.isnot(None)).all():
+        if getattr(user, "qr_status", None) == "revoked":
+            continue
+        if verify_qr_value(qr_value, user.qr_value_hash):
+            with _resolved_lock:
+                _resolved[fp] = (user.uid, user.qr_value_hash)
+            return user
+    _remember_unknown(fp, gen)
+    return None
+
+
+def decide(qr_value: str, device_id: int, area: Optional[str]) -> dict:
+    """Decisión de acceso para un QR leído por un dispositivo; registra el evento con log_access."""
+    fp = qr_value_fingerprint(qr_value)
+    source = f"qr_scanner:{device_id}"
+    extra = {"via": "qr_camera", "fp": fp[:16]}
+    db = standalone_session()
+    try:
+        user = _resolve(db, qr_value, fp)
+        if user is None:
+            reason, uid = "qr_not_registered", None
+        else:
+            uid = user.uid
+            if user.estado != "active":
+                reason = "user_inactive"
+            elif getattr(user, "qr_status", None) == "revoked":
+                reason = "qr_revoked"
+            else:
+                decision = policy.evaluate(user.rol, area, "enter")
+                reason = None if decision.allowed else "policy_denied"
+                extra["policy_rule_id"] = decision.rule_id
+                if decision.allowed:
+                    user.ultimo_acceso = now_cst()
+                    db.commit()
+    finally:
+        db.close()
+    result = "denied" if reason else "granted"
+    ev = log_access(uid, result, source=source, device_id=device_id, area=area, reason=reason, extra=extra)
+    return {"result": result, "uid": uid, "reason": reason, "event_id": getattr(ev, "id", None)}
+
+
+class _DeviceWorker:
+    """Submuestrea el stream de un escáner QR y envía frames al pool de decodificación."""
+
+    def __init__(self, device_id: int, url: str, area: Optional[str]):
+        self.device_id = device_id
+        self.url = url
+        self.area = area
+        self._stop = threading.Event()
+        self._busy = threading.Event()
+        self._seen: Dict[str, float] = {}   # huella -> última vez vista (debounce)
+        self.st = {"frames": 0, "sampled": 0, "dropped_busy": 0, "decoded": 0, "debounced": 0,
+                   "granted": 0, "denied": 0, "errors": 0, "decode_ms": 0.0,
+                   "last_result": None, "last_read_at": None}
+        self._thread = threading.Thread(target=self._run, name=f"qrscan:{device_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        hub = camera_hub.get_hub(self.url)
+        hub.subscribe()
+        try:
+            last_seq, next_at = 0, 0.0
+            interval = 1.0 / max(0.1, cfg.QR_SCAN_FPS)
+            while not self._stop.is_set():
+                got = hub.wait_frame(last_seq, timeout=1.0)
+                if got is None:
+                    continue
+                last_seq, frame = got
+                self.st["frames"] += 1
+                now = time.monotonic()
+                if now < next_at:
+                    continue
+                if self._busy.is_set():
+                    self.st["dropped_busy"] += 1
+                    continue
+                next_at = now + interval
+                self.st["sampled"] += 1
+                self._busy.set()
+                try:
+                    _pool.submit(self._process, frame)
+                except RuntimeError:   # pool cerrado al apagar
+                    self._busy.clear()
+                    return
+        finally:
+            hub.unsubscribe()
+
+    def _process(self, frame) -> None:
+        try:
+            t0 = time.perf_counter()
+            values = decode_frame(frame)
+            ms = (time.perf_counter() - t0) * 1000
+            self.st["decode_ms"] = round(ms if not self.st["decode_ms"] else 0.9 * self.st["decode_ms"] + 0.1 * ms, 2)
+            for value in values:
+                self.st["decoded"] += 1
+                if self._debounced(qr_value_fingerprint(value)):
+                    self.st["debounced"] += 1
+                    continue
+                out = decide(value, self.device_id, self.area)
+                self.st[out["result"]] += 1
+                self.st["last_result"] = {k: out[k] for k in ("result", "uid", "reason")}
+                self.st["last_read_at"] = now_cst().isoformat()
+        except Exception as e:
+            self.st["errors"] += 1
+            print(f"[qr_scanner] device {self.device_id} failed:", e)
+        finally:
+            self._busy.clear()
+
+    def _debounced(self, fp: str) -> bool:
+        now = time.monotonic()
+        window = cfg.QR_SCAN_DEBOUNCE_SEC
+        last = self._seen.get(fp)
+        self._seen[fp] = now   # cada avistamiento extiende la ventana mientras el código siga a la vista
+        if len(self._seen) > 256:
+            self._seen = {k: t for k, t in self._seen.items() if now - t <= window}
+        return last is not None and now - last <= window
+
+
+def _targets() -> Dict[int, Tuple[str, Optional[str]]]:
+    db = standalone_session()
+    try:
+        rows = db.query(QRScannerDevice).all()
+        return {q.id: ((q.url or "").strip(), q.location) for q in rows
+                if (q.status or "active") != "disabled" and "://" in (q.url or "")}
+    finally:
+        db.close()
+
+
+def sync() -> int:
+    """Arranca/detiene hilos según los escáneres registrados. Devuelve cuántos están activos."""
+    global _pool
+    targets = _targets()
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, cfg.QR_SCAN_WORKERS), thread_name_prefix="qrdecode")
+        for dev_id in list(_workers):
+            w = _workers[dev_id]
+            if targets.get(dev_id) != (w.url, w.area):
+                w.stop()
+                del _workers[dev_id]
+        for dev_id, (url, area) in targets.items():
+            if dev_id not in _workers:
+                _workers[dev_id] = _DeviceWorker(dev_id, url, area)
+        return len(_workers)
+
+
+def refresh() -> None:
+    """Adelanta la relectura de dispositivos (tras altas/cambios por API)."""
+    _wake.set()
+
+
+def stats() -> list:
+    with _lock:
+        return [{"device_id": w.device_id, "url": w.url, "area": w.area, **w.st} for w in _workers.values()]
+
+
+def _loop() -> None:
+    while True:
+        try:
+            sync()
+        except Exception as e:
+            print("[qr_scanner] sync failed:", e)
+        _wake.wait(max(1, cfg.QR_SCAN_REFRESH_SEC))
+        _wake.clear()
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or not cfg.QR_SCAN_ENABLED:
+        return
+    _thread = threading.Thread(target=_loop, name="qr-scanner", daemon=True)
+    _thread.start()
@@ -0,0 +1,329 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .config import cfg
+
+#
+# Limitación de tasa por token bucket (before_request en app/__init__.py)
+# - Reglas por blueprint o endpoint (RATE_LIMITS, gana el endpoint exacto sobre el blueprint):
+#     "auth.login=ip:20/60,uid:10/60;nfc=ip:600/60,device:120/60"
+#   Cada dimensión N/S es un cubo de capacidad N (ráfaga) que se rellena a N/S tokens por segundo.
+# - Dimensiones: ip (cliente real, misma resolución de X-Forwarded-For que la ACL), device
+#   (device_id / door_id / camera_id del cuerpo o cabecera X-Device-Id) y uid (uid del JWT, o
+#   uid / email / session_id del cuerpo). Si la petición no trae la dimensión, no se limita por ella.
+# - Una petición consume un token de cada cubo de su regla solo si todos tienen saldo; si alguno
+#   está vacío → 429 con Retry-After (segundos hasta el próximo token del cubo más lento).
+# - Backends (RATE_LIMIT_STORE):
+#     · memory: dict LRU acotado (RATE_LIMIT_MAX_KEYS) por proceso.
+#     · sqlite: archivo SQLite local (RATE_LIMIT_STORE_PATH, WAL) compartido por los workers.
+# - stats() expone por regla peticiones admitidas, limitadas y limitadas por dimensión.
+#
+
+DIMENSIONS = ("ip", "device", "uid")
+_DEVICE_FIELDS = ("device_id", "door_id", "camera_id")
+_UID_FIELDS = ("uid", "email", "session_id")
+
+
+class Limit:
+    __slots__ = ("dim", "capacity", "period")
+
+    def __init__(self, dim: str, capacity: int, period: float):
+        self.dim = dim
+        self.capacity = capacity
+        self.period = period
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    def __repr__(self) -> str:
+        return f"{self.dim}:{self.capacity}/{self.period:g}"
+
+
+def parse_rules(spec: str) -> Dict[str, List[Limit]]:
+    """"auth.login=ip:20/60,uid:10/60;ingest=ip:600/60" → {"auth.login": [Limit, ...], ...}.
+    Las dimensiones o tasas mal escritas se ignoran."""
+    rules: Dict[str, List[Limit]] = {}
+    for item in (spec or "").split(";"):
+        name, sep, limits = item.partition("=")
+        name = name.strip()
+        if not sep or not name:
+            continue
+        out = []
+        for part in limits.split(","):
+            dim, _, rate = part.strip().partition(":")
+            n, _, s = rate.partition("/")
+            try:
+                capacity, period = int(n), float(s or 1)
+            except ValueError:
+                continue
+            if dim in DIMENSIONS and capacity > 0 and period > 0:
+                out.append(Limit(dim, capacity, period))
+        if out:
+            rules[name] = out
+    return rules
+
+
+class BucketStore(ABC):
+    """Interfaz común de los backends."""
+    backend = "base"
+
+    @abstractmethod
+    def consume(self, rule: str, buckets: List[Tuple[str, Limit]]) -> Tuple[bool, int, Optional[str]]:
+        """Toma un token de cada cubo (clave, límite) si todos tienen saldo.
+        Devuelve (admitida, retry_after_seg, dimensión que limitó o None)."""
+
+    @abstractmethod
+    def sweep(self, max_period: float) -> int:
+        """Purga cubos que ya estarían llenos (equivalen a no tener entrada). Devuelve cuántos."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+    @staticmethod
+    def _refill(tokens: float, ts: float, limit: Limit, now: float) -> float:
+        return min(float(limit.capacity), tokens + max(0.0, now - ts) * limit.rate)
+
+    @staticmethod
+    def _retry_after(tokens: float, limit: Limit) -> int:
+        return max(1, math.ceil((1.0 - tokens) / limit.rate))
+
+
+class MemoryBucketStore(BucketStore):
+    backend = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max(1, int(max_keys))
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()   # clave → [tokens, ts]
+        self._counters: Dict[str, int] = {}
+        self._evicted = 0
+
+    def _bump(self, name: str) -> None:
+        self._counters[name] = self._counters.get(name, 0) + 1
+
+    def consume(self, rule, buckets):
+        now = time.time()
+        with self._lock:
+            state = []
+            blocked, retry = None, 0
+            for key, limit in buckets:
+                b = self._buckets.get(key)
+                tokens = self._refill(b[0], b[1], limit, now) if b else float(limit.capacity)
+                state.append((key, tokens))
+                if tokens < 1.0:
+                    wait = self._retry_after(tokens, limit)
+                    if wait > retry:
+                        blocked, retry = limit.dim, wait
+            if blocked:
+                self._bump(f"{rule}|limited")
+                self._bump(f"{rule}|limited:{blocked}")
+                return False, retry, blocked
+            for key, tokens in state:
+                self._buckets.pop(key, None)
+                self._buckets[key] = [tokens - 1.0, now]   # al final: más reciente
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self._evicted += 1
+            self._bump(f"{rule}|allowed")
+            return True, 0, None
+
+    def sweep(self, max_period):
+        cutoff = time.time() - max_period
+        with self._lock:
+            dead = [k for k, (_, ts) in self._buckets.items() if ts <= cutoff]
+            for k in dead:
+                del self._buckets[k]
+        return len(dead)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.backend, "keys": len(self._buckets), "max_keys": self.max_keys,
+                    "evicted": self._evicted, "counters": dict(self._counters)}
+
+
+class SQLiteBucketStore(BucketStore):
+    backend = "sqlite"
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS ratelimit_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_ratelimit_buckets_ts ON ratelimit_buckets (ts)",
+        "CREATE TABLE IF NOT EXISTS ratelimit_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    )
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+        conn = self._conn()
+        for stmt in self._SCHEMA:
+            conn.execute(stmt)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo; autocommit salvo las transacciones explícitas
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _bump(conn, name: str) -> None:
+        conn.execute("INSERT INTO ratelimit_stats (name, value) VALUES (?, 1) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def consume(self, rule, buckets):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")   # serializa entre procesos: ningún token se gasta dos veces
+        try:
+            state = []
+            blocked, retry = None, 0
+            for key, limit in buckets:
+                row = conn.execute("SELECT tokens, ts FROM ratelimit_buckets WHERE key = ?", (key,)).fetchone()
+                tokens = self._refill(row[0], row[1], limit, now) if row else float(limit.capacity)
+                state.append((key, tokens))
+                if tokens < 1.0:
+                    wait = self._retry_after(tokens, limit)
+                    if wait > retry:
+                        blocked, retry = limit.dim, wait
+            if blocked:
+                self._bump(conn, f"{rule}|limited")
+                self._bump(conn, f"{rule}|limited:{blocked}")
+            else:
+                conn.executemany("INSERT OR REPLACE INTO ratelimit_buckets (key, tokens, ts) VALUES (?, ?, ?)",
+                                 [(key, tokens - 1.0, now) for key, tokens in state])
+                self._bump(conn, f"{rule}|allowed")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return (False, retry, blocked) if blocked else (True, 0, None)
+
+    def sweep(self, max_period):
+        conn = self._conn()
+        return conn.execute("DELETE FROM ratelimit_buckets WHERE ts <= ?", (time.time() - max_period,)).rowcount
+
+    def stats(self):
+        conn = self._conn()
+        keys = conn.execute("SELECT COUNT(*) FROM ratelimit_buckets").fetchone()[0]
+        counters = dict(conn.execute("SELECT name, value FROM ratelimit_stats").fetchall())
+        return {"backend": self.backend, "path": self.path, "keys": keys, "counters": counters}
+
+
+class RateLimiter:
+    def __init__(self, rules: Dict[str, List[Limit]], store: BucketStore):
+        self.rules = rules
+        self.store = store
+        # Un cubo lleno tras el periodo más largo equivale a no tener entrada
+        self.max_period = max((l.period for ls in rules.values() for l in ls), default=60.0)
+
+    def rule_for(self, endpoint: Optional[str], blueprint: Optional[str]) -> Optional[str]:
+        if endpoint and endpoint in self.rules:
+            return endpoint
+        if blueprint and blueprint in self.rules:
+            return blueprint
+        return None
+
+    def check(self, rule: str, keys: Dict[str, Optional[str]]) -> Tuple[bool, int, Optional[str]]:
+        """keys: dimensión → identificador de la petición (None = no aplica)."""
+        buckets = [(f"{rule}|{l.dim}|{keys[l.dim]}", l) for l in self.rules[rule] if keys.get(l.dim)]
+        if not buckets:
+            return True, 0, None
+        return self.store.consume(rule, buckets)
+
+    def stats(self) -> dict:
+        raw = self.store.stats()
+        counters = raw.pop("counters", {})
+        per_rule = {}
+        for rule, limits in self.rules.items():
+            per_rule[rule] = {
+                "limits": [repr(l) for l in limits],
+                "allowed": counters.get(f"{rule}|allowed", 0),
+                "limited": counters.get(f"{rule}|limited", 0),
+                "limited_by": {d: counters.get(f"{rule}|limited:{d}", 0) for d in {l.dim for l in limits}},
+            }
+        return {"enabled": cfg.RATE_LIMIT_ENABLED, **raw, "rules": per_rule}
+
+
+def request_keys(req, client_ip: Optional[str], limits: List[Limit]) -> Dict[str, Optional[str]]:
+    """Identificadores de la petición Flask para las dimensiones que usa la regla. El cuerpo solo se
+    lee si la regla limita por device o uid (JSON o formulario; get_json cachea el resultado)."""
+    dims = {l.dim for l in limits}
+    keys: Dict[str, Optional[str]] = {"ip": client_ip}
+    if not dims & {"device", "uid"}:
+        return keys
+    body = req.get_json(force=True, silent=True) if not req.files else None
+    if not isinstance(body, dict):
+        body = req.form.to_dict() if req.form else {}
+
+    def pick(fields) -> Optional[str]:
+        for f in fields:
+            v = body.get(f) or req.args.get(f)
+            if v and isinstance(v, (str, int)):
+                return f"{f}={str(v).strip().lower()}"
+        return None
+
+    if "device" in dims:
+        dev = req.headers.get("X-Device-Id")
+        keys["device"] = f"device_id={dev.strip().lower()}" if dev else pick(_DEVICE_FIELDS)
+    if "uid" in dims:
+        uid = None
+        authz = req.headers.get("Authorization", "")
+        if authz.lower().startswith("bearer "):
+            from .auth import verify_jwt
+            try:
+                uid = verify_jwt(authz.split(" ", 1)[1].strip()).get("uid")
+            except Exception:
+                uid = None
+        keys["uid"] = f"uid={uid.lower()}" if uid else pick(_UID_FIELDS)
+    return keys
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def get_limiter() -> RateLimiter:
+    """Limitador configurado (RATE_LIMITS / RATE_LIMIT_STORE), creado una vez por proceso."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            if cfg.RATE_LIMIT_STORE == "sqlite":
+                store: BucketStore = SQLiteBucketStore(cfg.RATE_LIMIT_STORE_PATH)
+            else:
+                store = MemoryBucketStore(cfg.RATE_LIMIT_MAX_KEYS)
+            _limiter = RateLimiter(parse_rules(cfg.RATE_LIMITS), store)
+        return _limiter
+
+
+def stats() -> dict:
+    return get_limiter().stats()
+
+
+def _loop() -> None:
+    while True:
+        time.sleep(max(5, cfg.RATE_LIMIT_SWEEP_SEC))
+        try:
+            lim = get_limiter()
+            lim.store.sweep(lim.max_period)
+        except Exception as e:
+            print("[rate_limit] sweep failed:", e)
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or not cfg.RATE_LIMIT_ENABLED:
+        return
+    get_limiter()
+    _thread = threading.Thread(target=_loop, name="rate-limit-sweep", daemon=True)
+    _thread.start()
@@ -2,7 +2,7 @@ from typing import Optional, Tuple, List
 from flask import request
 from sqlalchemy.orm import Session
 from .auth import verify_jwt
-from .models import Usuario
+from . import identity_cache
 
 
 def current_identity(db: Session, allow_query: bool = False) -> Tuple[Optional[str], Optional[str]]:
@@ -11,6 +11,8 @@ def current_identity(db: Session, allow_query: bool = False) -> Tuple[Optional[s
     - Por defecto SOLO acepta Authorization: Bearer <JWT>.
     - Si allow_query=True, como compatibilidad acepta ?uid= para endpoints
       específicos (p. ej., fases de transición de frontend).
+    - Estado, rol y época de token salen de la caché de identidad (app/identity_cache.py);
+      un JWT con época anterior a la vigente (usuario revocado) se rechaza.
     """
     authz = request.headers.get("Authorization", "").strip()
     if authz.lower().startswith("bearer "):
@@ -18,18 +20,16 @@ def current_identity(db: Session, allow_query: bool = False) -> Tuple[Optional[s
         try:
             payload = verify_jwt(token)
             uid = payload.get("uid")
-            if uid:
-                u = db.query(Usuario).filter(Usuario.uid == uid).first()
-                if u and u.estado == "active":
-                    return (u.uid, u.rol)
+            ident = identity_cache.lookup(db, uid)
+            if identity_cache.token_valid(ident, payload):
+                return (ident.uid, ident.rol)
         except Exception:
             pass
     if allow_query:
         uid = request.args.get("uid")
-        if uid:
-            u = db.query(Usuario).filter(Usuario.uid == uid).first()
-            if u and u.estado == "active":
-                return (u.uid, u.rol)
+        ident = identity_cache.lookup(db, uid) if uid else None
+        if ident and ident.estado == "active":
+            return (ident.uid, ident.rol)
     return (None, None)
 
 
@@ -14,6 +14,7 @@ from .db import SessionLocal
 from .models import Usuario, CameraDevice, QRScannerDevice, NFCDevice, Mensaje
 from .auth import hash_password
 from .logging_utils import sign_event_and_persist
+from . import identity_cache
 
 
 USUARIOS = [
@@ -124,6 +125,8 @@ def seed_demo(users_override=None, update_existing=False):
             except Exception:
                 pass
         db.commit()
+        if update_existing:
+            identity_cache.invalidate()   # roles cambiados: que el servidor en marcha los relea
 
         # Cámaras
         for name, ip, url, location in CAMERAS:
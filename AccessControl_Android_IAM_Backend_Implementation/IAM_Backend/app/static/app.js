@@ -180,6 +180,10 @@ async function loadSections(role){
         const info = document.getElementById('camsInfo');
         const prev = document.getElementById('camsPrev');
         const next = document.getElementById('camsNext');
+        // Los mosaicos son pequeños: pedir al proxy MJPEG el ancho real del mosaico y menos fps
+        const tileW = Math.round(((grid.clientWidth || 960) / 2) * (window.devicePixelRatio || 1));
+        const sized = (url) => url.startsWith('/camera_mjpeg')
+          ? `${url}${url.includes('?') ? '&' : '?'}w=${tileW}&fps=8` : url;
         const render = () => {
           const items = [];
           for (let i=0;i<PAGE;i++){
@@ -189,7 +193,7 @@ async function loadSections(role){
             items.push(`
               <div class=\"cam\">
                 <div class=\"title\">${c.name||`Cam ${idx+1}`}</div>
-                ${usingImg ? `<img src=\"${c.url}\" onload=\"this.nextElementSibling.style.display='none'\" onerror=\"this.nextElementSibling.style.display='flex'\">`
+                ${usingImg ? `<img src=\"${sized(c.url)}\" onload=\"this.nextElementSibling.style.display='none'\" onerror=\"this.nextElementSibling.style.display='flex'\">`
                            : c.url ? `<iframe src=\"${c.url}\" onload=\"this.nextElementSibling.style.display='none'\"></iframe>`
                                    : `<div style=\"width:100%;height:220px\"></div>`}
                 <div class=\"nosignal\">NO SIGNAL</div>
@@ -167,14 +167,25 @@ async function scanLocalLoop(){
   }catch{}
   requestAnimationFrame(scanLocalLoop);
 }
+// Ráfaga: varios frames (≤960 px de ancho) en una sola petición; el servidor los decodifica en
+// paralelo y responde con el primero que tenga QR.
+const BURST_FRAMES = 3, BURST_GAP_MS = 150, BURST_MAX_W = 960;
+async function grabFrame(){
+  const vw = video.videoWidth||640, vh = video.videoHeight||480;
+  const s = Math.min(1, BURST_MAX_W / vw);
+  canvas.width=Math.round(vw*s); canvas.height=Math.round(vh*s); ctx.drawImage(video,0,0,canvas.width,canvas.height);
+  return new Promise(res=>canvas.toBlob(res,'image/jpeg',0.85));
+}
 async function scanServerLoop(){
   if(!scanning) return;
-  const vw = video.videoWidth||640, vh = video.videoHeight||480;
-  canvas.width=vw; canvas.height=vh; ctx.drawImage(video,0,0,vw,vh);
-  const blob = await new Promise(res=>canvas.toBlob(res,'image/jpeg',0.85));
-  const fd = new FormData(); fd.append('image', blob, 'frame.jpg');
+  const fd = new FormData();
+  for(let i=0; i<BURST_FRAMES && scanning; i++){
+    if(i) await new Promise(r=>setTimeout(r, BURST_GAP_MS));
+    fd.append('images', await grabFrame(), `frame${i}.jpg`);
+  }
+  if(!scanning) return;
   try{
-    const r = await fetch('/api/qr/decode',{method:'POST', body: fd});
+    const r = await fetch('/api/qr/decode/batch',{method:'POST', body: fd});
     if(r.ok){ const j = await r.json(); if(j && j.value){ scanning=false; aimOk(true); await verifyQR(String(j.value).trim()); return; } }
   }catch{}
   setTimeout(scanServerLoop, 800);
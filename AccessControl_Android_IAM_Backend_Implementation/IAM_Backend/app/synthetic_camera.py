@@ -0,0 +1,239 @@
+import glob
+import os
+import time
+import zlib
+from typing import List, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .config import cfg
+
+#
+# Fuente de cámara sintética (pruebas de carga sin hardware)
+# - URL: synthetic://<nombre>?w=640&h=480&fps=15&rects=3&qr=<valor|random>&qr_every=10&seq=<carpeta>
+#     · rects: rectángulos de colores en movimiento (rebotan en los bordes)
+#     · qr: código QR renderizado con app/qr.py (make_upy_qr_image) que se desplaza por el frame;
+#       "random" genera un valor nuevo cada qr_every segundos; qr_style=card (tarjeta UPY, por
+#       defecto) o plain (QR liso, para medir el decodificador sin el marco decorativo)
+#     · seq: reproduce en bucle las imágenes de CAMERA_SYNTH_SEQ_DIR/<carpeta> como fondo
+#       (p. ej. fotos con rostros para la detección facial)
+# - SyntheticCapture imita la interfaz de cv2.VideoCapture (isOpened/read/get/set/release) y marca
+#   el ritmo como una cámara en vivo; open_capture() la usa para "synthetic://" y cv2 para el resto.
+# - /camera_synth?<mismos parámetros> la sirve como MJPEG por HTTP (vía el hub compartido), así que
+#   cualquier consumidor de cv2.VideoCapture (p. ej. camaras_face_detection.py) puede abrirla.
+#
+
+SCHEME = "synthetic://"
+MAX_SIDE = 3840
+MAX_FPS = 60.0
+
+_COLORS = [(66, 135, 245), (245, 87, 66), (66, 245, 140), (245, 215, 66), (200, 66, 245), (66, 230, 245)]
+
+
+def _num(qs: dict, key: str, default, cast, lo, hi):
+    try:
+        v = cast(qs.get(key, [default])[0])
+    except (TypeError, ValueError):
+        v = default
+    return min(max(v, lo), hi)
+
+
+def _seq_frames(name: str, width: int, height: int) -> List[np.ndarray]:
+    """Imágenes de la carpeta de secuencia (solo dentro de CAMERA_SYNTH_SEQ_DIR), redimensionadas."""
+    base = os.path.abspath(cfg.CAMERA_SYNTH_SEQ_DIR)
+    folder = os.path.abspath(os.path.join(base, name))
+    if not folder.startswith(base + os.sep) or not os.path.isdir(folder):
+        return []
+    frames = []
+    for path in sorted(glob.glob(os.path.join(folder, "*"))):
+        if os.path.splitext(path)[1].lower() not in (".jpg", ".jpeg", ".png", ".bmp", ".webp"):
+            continue
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            frames.append(cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA))
+        if len(frames) >= cfg.CAMERA_SYNTH_SEQ_MAX:
+            break
+    return frames
+
+
+def _qr_tile(value: str, side: int, style: str = "card") -> np.ndarray:
+    pad = side // 8   # zona de silencio blanca, como la pantalla del teléfono alrededor del código
+    if style == "plain":
+        import qrcode
+        q = qrcode.QRCode(border=0, box_size=1)
+        q.add_data(value)
+        q.make(fit=True)
+        img = q.make_image().convert("RGB").resize((side - 2 * pad,) * 2, Image.NEAREST)
+    else:
+        from .qr import make_upy_qr_image
+        img = make_upy_qr_image(qr_value=value, size=side - 2 * pad)
+    tile = cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return cv2.copyMakeBorder(tile, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+
+
+class SyntheticCapture:
+    """Generador de frames NumPy con la interfaz mínima de cv2.VideoCapture."""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        qs = parse_qs(parts.query)
+        self.name = parts.netloc or parts.path.strip("/") or "synthetic"
+        self.width = _num(qs, "w", 640, int, 16, MAX_SIDE)
+        self.height = _num(qs, "h", 480, int, 16, MAX_SIDE)
+        self.fps = _num(qs, "fps", 15.0, float, 0.5, MAX_FPS)
+        n_rects = _num(qs, "rects", 3, int, 0, 64)
+        self.qr_value = (qs.get("qr") or [None])[0]
+        self.qr_every = _num(qs, "qr_every", 10.0, float, 0.5, 86400.0)
+        self.qr_style = "plain" if (qs.get("qr_style") or [""])[0] == "plain" else "card"
+        self._opened = True
+        self._index = 0
+        self._next_at = time.monotonic()
+        rng = np.random.default_rng(zlib.crc32(self.name.encode()))   # mismo nombre → misma escena
+        # Fondo: secuencia de imágenes o degradado fijo (se calcula una vez)
+        self._seq = _seq_frames(qs["seq"][0], self.width, self.height) if qs.get("seq") else []
+        grad = np.linspace(40, 90, self.width, dtype=np.uint8)
+        self._background = np.dstack([np.tile(grad, (self.height, 1))] * 3)
+        self._frame = np.empty((self.height, self.width, 3), np.uint8)   # lienzo preasignado
+        # Rectángulos: posición, velocidad (px/frame), tamaño y color
+        side = max(8, min(self.width, self.height) // 6)
+        self._rects = [{"x": float(rng.integers(0, max(1, self.width - side))),
+                        "y": float(rng.integers(0, max(1, self.height - side))),
+                        "vx": float(rng.uniform(-6, 6)) or 3.0, "vy": float(rng.uniform(-6, 6)) or 3.0,
+                        "w": int(side * rng.uniform(0.6, 1.4)), "h": int(side * rng.uniform(0.6, 1.4)),
+                        "color": _COLORS[i % len(_COLORS)]} for i in range(n_rects)]
+        self._qr_side = max(64, min(self.width, self.height) // 2)
+        self._qr_img: Optional[np.ndarray] = None
+        self._qr_current: Optional[str] = None
+        self._qr_changed_at = 0.0
+        self._qr_pos = [0.0, 0.0, 2.0, 1.5]
+
+    # ---- interfaz estilo cv2.VideoCapture ----
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def release(self) -> None:
+        self._opened = False
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return -1.0   # fuente "en vivo"
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._index)
+        return 0.0
+
+    def set(self, prop: int, value) -> bool:
+        return False
+
+    def read(self, image=None):
+        if not self._opened:
+            return False, None
+        # Ritmo de cámara en vivo: un frame cada 1/fps
+        self._next_at += 1.0 / self.fps
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next_at = time.monotonic()
+        frame = self.render()
+        if image is not None and image.shape == frame.shape:
+            image[:] = frame
+            return True, image
+        return True, frame.copy()
+
+    # ---- render ----
+    def _current_qr(self) -> Optional[np.ndarray]:
+        if not self.qr_value:
+            return None
+        now = time.monotonic()
+        if self.qr_value == "random":
+            if self._qr_img is None or now - self._qr_changed_at >= self.qr_every:
+                from .qr import gen_qr_value_b32
+                self._qr_current = gen_qr_value_b32()
+                self._qr_img = _qr_tile(self._qr_current, self._qr_side, self.qr_style)
+                self._qr_changed_at = now
+        elif self._qr_img is None:
+            self._qr_current = self.qr_value
+            self._qr_img = _qr_tile(self.qr_value, self._qr_side, self.qr_style)
+        return self._qr_img
+
+    def render(self) -> np.ndarray:
+        """Dibuja el siguiente frame en el lienzo preasignado y lo devuelve (sin copiar)."""
+        f = self._frame
+        if self._seq:
+            f[:] = self._seq[self._index % len(self._seq)]
+        else:
+            f[:] = self._background
+        H, W = self.height, self.width
+        for r in self._rects:
+            r["x"] += r["vx"]; r["y"] += r["vy"]
+            if r["x"] < 0 or r["x"] + r["w"] > W:
+                r["vx"] = -r["vx"]; r["x"] = min(max(r["x"], 0), max(0, W - r["w"]))
+            if r["y"] < 0 or r["y"] + r["h"] > H:
+                r["vy"] = -r["vy"]; r["y"] = min(max(r["y"], 0), max(0, H - r["h"]))
+            x, y = int(r["x"]), int(r["y"])
+            f[y:y + r["h"], x:x + r["w"]] = r["color"]
+        qr = self._current_qr()
+        if qr is not None:
+            p = self._qr_pos
+            side = min(qr.shape[0], W, H)
+            p[0] += p[2]; p[1] += p[3]
+            if p[0] < 0 or p[0] + side > W:
+                p[2] = -p[2]; p[0] = min(max(p[0], 0), W - side)
+            if p[1] < 0 or p[1] + side > H:
+                p[3] = -p[3]; p[1] = min(max(p[1], 0), H - side)
+            x, y = int(p[0]), int(p[1])
+            f[y:y + side, x:x + side] = qr[:side, :side]
+        cv2.putText(f, f"{self.name} #{self._index} {time.strftime('%H:%M:%S')}", (8, H - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+        self._index += 1
+        return f
+
+    @property
+    def qr_current(self) -> Optional[str]:
+        """Valor QR visible en el frame actual (para verificar decodificaciones en pruebas)."""
+        return self._qr_current
+
+
+def is_synthetic(url: Optional[str]) -> bool:
+    return bool(url) and url.lower().startswith(SCHEME)
+
+
+def canonical_url(name: str, params: dict) -> str:
+    """URL synthetic:// normalizada para que fuentes iguales compartan hub.
+
+    Parámetros ordenados y redondeados dentro de los límites del servidor (lado ≤ CAMERA_MAX_WIDTH
+    en múltiplos de 16, fps entero ≤ CAMERA_MAX_FPS): el cliente no puede multiplicar variantes
+    ni pedir generadores más caros que una cámara real.
+    """
+    qs = {k: [v] for k, v in params.items()}
+    keep = {}
+    for k in ("w", "h"):
+        if k in params:
+            keep[k] = _num(qs, k, 640, int, 16, max(16, cfg.CAMERA_MAX_WIDTH)) // 16 * 16
+    if "fps" in params:
+        keep["fps"] = int(round(_num(qs, "fps", 15.0, float, 1.0, max(1.0, cfg.CAMERA_MAX_FPS))))
+    if "rects" in params:
+        keep["rects"] = _num(qs, "rects", 3, int, 0, 64)
+    if "qr_every" in params:
+        keep["qr_every"] = int(round(_num(qs, "qr_every", 10.0, float, 1.0, 86400.0)))
+    for k in ("qr", "qr_style", "seq"):
+        if params.get(k):
+            keep[k] = str(params[k])[:128]
+    keep = dict(sorted(keep.items()))
+    return f"{SCHEME}{(name or 'synthetic')[:64]}" + (f"?{urlencode(keep)}" if keep else "")
+
+
+def open_capture(url: str):
+    """cv2.VideoCapture para URLs reales; SyntheticCapture para synthetic://."""
+    if is_synthetic(url):
+        return SyntheticCapture(url)
+    return cv2.VideoCapture(url)
@@ -3,8 +3,9 @@ from typing import Optional
 
 from .db import SessionLocal
 from .models import Usuario
-from .qr import gen_qr_value_b32, hash_qr_value, save_upy_qr_png
-from .logging_utils import sign_event_and_persist
+from .qr import gen_qr_value_b32, hash_qr_value, save_upy_qr_png, card_version
+from . import card_cache, qr_scanner
+from .logging_utils import sign_event_and_persist, sign_events_and_persist
 
 
 STATIC_LOGO_CANDIDATES = [
@@ -30,14 +31,114 @@ def resolve_outdir(outdir: str) -> str:
     return target
 
 
-def save_user_qr_png(uid: str, qr_value: str, outdir: str = "cards", size: int = 600) -> str:
+def save_user_qr_png(uid: str, qr_value: str, outdir: str = "cards", size: int = 600,
+                     qr_hash: Optional[str] = None) -> str:
+    """PNG maestro de la tarjeta; con `qr_hash` queda etiquetado con su versión (ver card_cache)."""
     outdir = resolve_outdir(outdir)
     logo = resolve_logo()
     png_path = os.path.join(outdir, f"{uid}_QR.png")
-    save_upy_qr_png(png_path, qr_value=qr_value, size=int(size), logo_path=logo)
+    save_upy_qr_png(png_path, qr_value=qr_value, size=int(size), logo_path=logo, version=card_version(qr_hash))
     return png_path
 
 
+STAGED_SUFFIX = ".staged"
+
+
+def render_user_qr(uid: str, outdir: str = "cards", size: int = 600) -> tuple[str, str, str]:
+    """Genera un valor nuevo, su hash Argon2 y el PNG, sin tocar la BD ni el PNG vigente: la imagen
+    queda en <uid>_QR.png.staged y commit_rendered_qrs() la pone en su sitio tras confirmar el hash.
+    Pensado para correr en un pool de procesos. Retorna (uid, qr_value_hash, png_path)."""
+    qr_val = gen_qr_value_b32()
+    qr_hash = hash_qr_value(qr_val)
+    outdir = resolve_outdir(outdir)
+    png_path = os.path.join(outdir, f"{uid}_QR.png")
+    staged = png_path + STAGED_SUFFIX
+    tmp_path = staged + ".tmp"
+    save_upy_qr_png(tmp_path, qr_value=qr_val, size=int(size), logo_path=resolve_logo(),
+                    version=card_version(qr_hash))
+    os.replace(tmp_path, staged)
+    return uid, qr_hash, png_path
+
+
+def _discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def commit_rendered_qrs(rendered: list, source: str = "cli", extra: Optional[dict] = None) -> list:
+    """Persiste un lote de render_user_qr() en una sola transacción: hashes, estado activo,
+    qr_card_id por defecto y un evento qr_assigned firmado por usuario. Después del commit mueve
+    cada PNG preparado a su sitio; si el lote falla los descarta. Retorna los uid guardados."""
+    db = SessionLocal()
+    try:
+        by_uid = {uid: (qr_hash, png_path) for uid, qr_hash, png_path in rendered}
+        users = db.query(Usuario).filter(Usuario.uid.in_(list(by_uid))).all()
+        events = []
+        for user in users:
+            qr_hash, png_path = by_uid[user.uid]
+            user.qr_value_hash = qr_hash
+            user.qr_status = 'active'
+            user.qr_card_id = user.qr_card_id or user.uid
+            events.append(("qr_assigned", user.uid, source,
+                           {"qr_card_id": user.qr_card_id, "png_path": png_path, **(extra or {})}))
+        sign_events_and_persist(db, events)
+    except Exception:
+        db.rollback()
+        for _, _, png_path in rendered:
+            _discard(png_path + STAGED_SUFFIX)
+        raise
+    finally:
+        db.close()
+    saved = [e[1] for e in events]
+    for uid, (_, png_path) in by_uid.items():
+        if uid not in saved:
+            _discard(png_path + STAGED_SUFFIX)   # usuario borrado entretanto
+            continue
+        try:
+            os.replace(png_path + STAGED_SUFFIX, png_path)
+        except OSError as e:
+            # El hash ya está confirmado: settle_staged_qrs() lo pone en su sitio en la próxima corrida
+            print(f"[assign-qr-bulk] Could not move card for {uid}: {e}")
+        card_cache.invalidate(uid)
+    if saved:
+        qr_scanner.forget_unknown()
+    return saved
+
+
+def settle_staged_qrs(outdir: str = "cards") -> tuple[int, int]:
+    """Resuelve los PNG preparados de una corrida interrumpida: si su versión coincide con el hash
+    guardado del usuario se mueven a su sitio; si no (hash nunca confirmado) se borran.
+    Retorna (movidos, descartados)."""
+    outdir = resolve_outdir(outdir)
+    suffix = "_QR.png" + STAGED_SUFFIX
+    staged = {}
+    for name in os.listdir(outdir):
+        if name.endswith(suffix + ".tmp"):
+            _discard(os.path.join(outdir, name))
+        elif name.endswith(suffix):
+            staged[name[:-len(suffix)]] = os.path.join(outdir, name)
+    if not staged:
+        return 0, 0
+    db = SessionLocal()
+    try:
+        hashes = dict(db.query(Usuario.uid, Usuario.qr_value_hash).filter(Usuario.uid.in_(list(staged))).all())
+    finally:
+        db.close()
+    moved = dropped = 0
+    for uid, path in staged.items():
+        version = card_version(hashes.get(uid))
+        if version and card_cache.master_version(path) == version:
+            os.replace(path, path[:-len(STAGED_SUFFIX)])
+            card_cache.invalidate(uid)
+            moved += 1
+        else:
+            _discard(path)
+            dropped += 1
+    return moved, dropped
+
+
 def assign_qr_to_user(uid: str, outdir: str = "cards", size: int = 600, card_id: Optional[str] = None) -> tuple[str, str]:
     """
     Asigna/rota el QR de un usuario, persiste el hash en BD y guarda la imagen PNG.
@@ -60,7 +161,9 @@ def assign_qr_to_user(uid: str, outdir: str = "cards", size: int = 600, card_id:
         except Exception:
             pass
         db.commit()
-        png_path = save_user_qr_png(uid, qr_val, outdir=outdir, size=size)
+        png_path = save_user_qr_png(uid, qr_val, outdir=outdir, size=size, qr_hash=user.qr_value_hash)
+        card_cache.invalidate(uid)
+        qr_scanner.forget_unknown()
         # Registrar en bitácora
         try:
             sign_event_and_persist(db, "qr_assigned", actor_uid=user.uid, source="cli",
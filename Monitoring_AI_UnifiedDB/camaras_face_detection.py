@@ -16,6 +16,7 @@ import requests
 import json
 
 # Data handling and analysis
+import os
 import pandas as pd
 import time
 from datetime import datetime
@@ -33,6 +34,20 @@ logger = logging.getLogger(__name__)
 
 # Server configuration - API endpoint for camera data
 SERVER_BASE_URL = "http://localhost:8080"  # Change this to your server URL
+# IAM backend (serves synthetic:// sources at /camera_synth); not the camera server above
+IAM_BACKEND_URL = os.getenv("IAM_BACKEND_URL", "https://localhost:5443")
+
+
+def open_capture(url: str, iam_url: str = IAM_BACKEND_URL) -> cv2.VideoCapture:
+    """
+    Open a video source with OpenCV.
+    synthetic://<name>?w=&h=&fps=&rects=&qr=&seq= sources (load testing without cameras)
+    are served by the IAM backend as MJPEG at /camera_synth/<name>.
+    """
+    if url.lower().startswith("synthetic://"):
+        name, _, query = url[len("synthetic://"):].partition("?")
+        url = f"{iam_url.rstrip('/')}/camera_synth/{name or 'synthetic'}" + (f"?{query}" if query else "")
+    return cv2.VideoCapture(url)
 
 
 # ============================================================================
@@ -497,7 +512,7 @@ class EnhancedCameraManager:
             
             # Open video stream
             print(f"Intentando conectar a {ip_camara}...")
-            cap = cv2.VideoCapture(ip_camara)
+            cap = open_capture(ip_camara)
             
             # For RTSP streams, set additional properties
             if ip_camara.startswith('rtsp://'):
@@ -567,10 +582,10 @@ class EnhancedCameraManager:
                     # RTSP RECONNECTION LOGIC
                     # ============================================================
                     # For RTSP streams, try to reconnect automatically
-                    if self.camera_info[i]['ip_camara'].startswith('rtsp://'):
+                    if self.camera_info[i]['ip_camara'].startswith(('rtsp://', 'synthetic://')):
                         print(f"Intentando reconectar a {self.camera_info[i]['nombre']}...")
                         cap.release()
-                        new_cap = cv2.VideoCapture(self.camera_info[i]['ip_camara'])
+                        new_cap = open_capture(self.camera_info[i]['ip_camara'])
                         # Configure RTSP stream properties
                         if self.camera_info[i]['ip_camara'].startswith('rtsp://'):
                             new_cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)